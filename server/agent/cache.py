@@ -0,0 +1,113 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import xxhash
+
+from observability import LLM_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+def normalize_history(text: str) -> str:
+    """Normaliza o histórico do prompt para a chave: caixa e espaços não mudam a resposta."""
+    return " ".join(text.split()).lower()
+
+def prompt_version(system_prompt: str) -> str:
+    """Versão do prompt de sistema: muda sozinha quando o texto é editado."""
+    return xxhash.xxh3_64_hexdigest(system_prompt)
+
+def cache_key(model: str, version: str, history: str) -> str:
+    return xxhash.xxh3_128_hexdigest(f"{model}\x00{version}\x00{normalize_history(history)}")
+
+class LRUTTLCache:
+    """Cache em memória do processo, limitado a `max_entries` (LRU) e com validade de `ttl` segundos."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class MongoResponseCache:
+    """
+    Camada compartilhada entre os workers, na coleção `llm_cache`. A expiração
+    fica a cargo de um índice TTL em `expires_at`; a consulta também filtra pelo
+    prazo, já que o MongoDB remove os vencidos só periodicamente.
+    """
+
+    def __init__(self, db, ttl: float):
+        self.collection = db["llm_cache"]
+        self.ttl = ttl
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key: str) -> Optional[str]:
+        doc = await self.collection.find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}}, {"response": 1}
+        )
+        return doc["response"] if doc else None
+
+    async def set(self, key: str, value: str) -> None:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        await self.collection.update_one(
+            {"_id": key}, {"$set": {"response": value, "expires_at": expires_at}}, upsert=True
+        )
+
+class LLMResponseCache:
+    """
+    Cache das respostas brutas do LLM por prompt, em duas camadas: LRU local e,
+    opcionalmente, o MongoDB compartilhado. Uma falha na camada compartilhada só
+    vira miss; o turno segue com a chamada ao modelo.
+    """
+
+    def __init__(self, memory: LRUTTLCache, shared: Optional[MongoResponseCache] = None):
+        self.memory = memory
+        self.shared = shared
+
+    async def ensure_indexes(self) -> None:
+        if self.shared is not None:
+            await self.shared.ensure_indexes()
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        LLM_CACHE_REQUESTS.labels(tier="memory", result="hit" if value is not None else "miss").inc()
+        if value is not None or self.shared is None:
+            return value
+
+        try:
+            value = await self.shared.get(key)
+        except Exception as e:
+            logger.warning("Falha ao ler o cache compartilhado do LLM: %s", e)
+            value = None
+        LLM_CACHE_REQUESTS.labels(tier="mongo", result="hit" if value is not None else "miss").inc()
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.shared is None:
+            return
+        try:
+            await self.shared.set(key, value)
+        except Exception as e:
+            logger.warning("Falha ao gravar no cache compartilhado do LLM: %s", e)
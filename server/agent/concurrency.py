@@ -0,0 +1,74 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from errors import RetryableHTTPError
+from observability import LLM_QUEUE_WAIT
+
+class LLMOverloaded(RetryableHTTPError):
+    """Erro base para chamadas ao LLM rejeitadas por excesso de carga."""
+    status_code = 503
+    retry_after = 5
+
+class LLMQueueFull(LLMOverloaded):
+    """Fila de espera cheia: a requisição é rejeitada imediatamente."""
+    status_code = 429
+    retry_after = 2
+
+class LLMQueueTimeout(LLMOverloaded):
+    """A requisição esperou na fila além do prazo sem conseguir uma vaga."""
+    status_code = 503
+    retry_after = 5
+
+class LLMUnavailable(LLMOverloaded):
+    """Circuit breaker aberto: o provedor do LLM está falhando e a chamada nem é feita."""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, retry_after=retry_after)
+
+class LLMConcurrencyLimiter:
+    """
+    Limita as chamadas ao LLM em andamento no processo.
+
+    Até `max_in_flight` chamadas rodam ao mesmo tempo; as demais esperam numa
+    fila de no máximo `max_waiting` posições, por até `wait_timeout` segundos.
+    Com a fila cheia a rejeição é imediata (LLMQueueFull), o que dá backpressure
+    aos clientes em vez de acumular requisições até o worker entrar em colapso.
+    """
+
+    def __init__(self, max_in_flight: int, max_waiting: int, wait_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    def check_capacity(self) -> None:
+        """Rejeita já se não houver vaga livre nem lugar na fila."""
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            raise LLMQueueFull("Fila de chamadas ao modelo cheia. Tente novamente em instantes.")
+
+    @asynccontextmanager
+    async def slot(self):
+        self.check_capacity()
+        start = time.perf_counter()
+        if not self._semaphore.locked():
+            # Vaga livre: adquire sem suspender, antes que outra requisição passe pela checagem
+            await self._semaphore.acquire()
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise LLMQueueTimeout("Tempo de espera pelo modelo esgotado. Tente novamente em instantes.")
+            finally:
+                self.waiting -= 1
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - start)
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
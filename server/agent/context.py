@@ -0,0 +1,115 @@
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+# --- CONFIGURAÇÃO DA JANELA DE CONTEXTO ---
+# Turnos (pares usuário + modelo) mantidos literalmente no prompt
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "3"))
+# Orçamento de tokens para o histórico literal (o resumo tem orçamento próprio)
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300"))
+
+# Mensagens guardadas no estado do grafo (e portanto nos checkpoints): a janela literal
+# com folga para as mensagens que chegam entre dois turnos. O histórico completo fica
+# só em chat_messages.
+STATE_MAX_MESSAGES = max(CONTEXT_KEEP_TURNS, 1) * 2 + 8
+# Respostas que um turno pode acrescentar ao estado (chatbot + alerta de emergência)
+_TURN_REPLIES = 2
+
+# Tamanho máximo de cada linha do resumo
+_SUMMARY_LINE_CHARS = 160
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata de tokens (~4 caracteres por token em português)."""
+    return (len(text) + 3) // 4
+
+def format_message(msg: Dict[str, Any]) -> str:
+    return f"{msg.get('sender', 'user')}: {msg.get('text', '')}"
+
+def _summary_line(msg: Dict[str, Any]) -> str:
+    text = " ".join(msg.get("text", "").split())
+    if len(text) > _SUMMARY_LINE_CHARS:
+        text = text[:_SUMMARY_LINE_CHARS - 1] + "…"
+    return f"- {text}"
+
+def fold_into_summary(summary: str, evicted: List[Dict[str, Any]]) -> str:
+    """
+    Acrescenta ao resumo o que o paciente disse nas mensagens que saíram da janela,
+    uma linha curta por mensagem. As perguntas do assistente não entram: o que foi
+    respondido já está na triagem estruturada, que vai sempre no prompt. Se o resumo
+    passar do orçamento, descarta as linhas mais antigas.
+    """
+    lines = summary.splitlines() if summary else []
+    lines.extend(_summary_line(msg) for msg in evicted if msg.get("sender", "user") == "user")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > CONTEXT_SUMMARY_MAX_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def recent_messages(current: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Reducer de `messages` no estado do grafo: acrescenta as mensagens novas e
+    guarda só as STATE_MAX_MESSAGES mais recentes, para o checkpoint não crescer
+    com a conversa.
+    """
+    return (current + new)[-STATE_MAX_MESSAGES:]
+
+def fold_overflow(messages: List[Dict[str, Any]], summary: str, summary_upto: int) -> Dict[str, Any]:
+    """
+    Atualização do resumo para as mensagens que `recent_messages` vai descartar
+    do estado antes de build_context resumi-las (histórico de um chat sem
+    checkpoint, várias mensagens chegando entre dois turnos). Vazio se nada se perde.
+    """
+    overflow = messages[:max(0, len(messages) - (STATE_MAX_MESSAGES - _TURN_REPLIES))]
+    unsummarized = [msg for msg in overflow if (msg.get("id") or 0) > summary_upto]
+    if not unsummarized:
+        return {}
+    return {
+        "summary": fold_into_summary(summary, unsummarized),
+        "summary_upto": unsummarized[-1].get("id") or summary_upto,
+    }
+
+def build_context(state: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Monta a parte do prompt com o histórico, limitada em tamanho.
+
+    Mantém as últimas CONTEXT_KEEP_TURNS trocas literalmente (cortando mais, se
+    passarem de CONTEXT_MAX_TOKENS) e substitui as anteriores pela triagem
+    estruturada mais um resumo incremental. O resumo é guardado no estado
+    (`summary` até a mensagem `summary_upto`), então cada mensagem é resumida
+    uma única vez ao longo da conversa.
+
+    Retorna o contexto anterior à janela (triagem + resumo; vazio enquanto nada
+    foi resumido), as mensagens da janela e as atualizações de estado do resumo.
+    """
+    messages = state.get("messages", [])
+    summary = state.get("summary", "")
+    summary_upto = state.get("summary_upto", 0)
+
+    # Janela literal: últimos K turnos, reduzida até caber no orçamento (mantém ao menos a última)
+    window = messages[-CONTEXT_KEEP_TURNS * 2:] if CONTEXT_KEEP_TURNS > 0 else messages[-1:]
+    while len(window) > 1 and estimate_tokens("\n".join(format_message(m) for m in window)) > CONTEXT_MAX_TOKENS:
+        window = window[1:]
+
+    # Mensagens que saíram da janela e ainda não estão no resumo
+    first_window_id = (window[0].get("id") or 0) if window else 0
+    evicted = [
+        msg for msg in messages[:len(messages) - len(window)]
+        if summary_upto < (msg.get("id") or 0) < first_window_id
+    ]
+    updates: Dict[str, Any] = {}
+    if evicted:
+        summary = fold_into_summary(summary, evicted)
+        summary_upto = evicted[-1].get("id") or summary_upto
+        updates = {"summary": summary, "summary_upto": summary_upto}
+
+    context = ""
+    if summary_upto:
+        triagem = json.dumps(state.get("triagem", {}), ensure_ascii=False)
+        context = f"DADOS DA TRIAGEM JÁ COLETADOS:\n{triagem}\n\nRESUMO DO QUE O PACIENTE JÁ DISSE:\n{summary}"
+
+    return context, window, updates
+
+def format_history(context: str, window: List[Dict[str, Any]]) -> str:
+    """Histórico em texto corrido, como vai no prompt de uma parte só (stub, chave do cache)."""
+    recent = "\n".join(format_message(m) for m in window)
+    return f"{context}\n\nMENSAGENS RECENTES:\n{recent}" if context else recent
@@ -1,30 +1,79 @@
+import functools
 import os
-import json
-from typing import TypedDict, List, Dict, Any
+import logging
+from dataclasses import replace
+from datetime import datetime, timezone
+from typing import TypedDict, List, Dict, Any, Optional
 from langgraph.graph import StateGraph, END
-from google import genai
+from langgraph.config import get_stream_writer
+from langchain_core.runnables import RunnableConfig
 from bson import ObjectId
-from database.configurations import collection
-from database.models import State
+from database.configurations import get_checkpointer, get_db, get_repository
+from database.models import ModelReply, State
+from agent.cache import LLMResponseCache, LRUTTLCache, MongoResponseCache, cache_key, prompt_version
+from agent.concurrency import LLMConcurrencyLimiter, LLMOverloaded
+from agent.context import build_context, fold_overflow, recent_messages
+from agent.emergency import EmergencyDetector, KeywordMatcher, normalize_text
+from agent.llm import Prompt, create_llm_provider
+from agent.parsing import ModelOutputError, merge_triagem, parse_model_output
+from agent.resilience import CircuitBreaker, LLMCallPolicy
+from observability import LLM_PARSE_FAILURES, LLM_RESILIENCE_EVENTS, timed_node
+from agent.streaming import JsonStringFieldStreamer
+
+logger = logging.getLogger(__name__)
 
 # --- CONSTANTES DE CONFIGURAÇÃO ---
 MODEL_NAME = "gemini-2.5-flash-lite"
-EMERGENCY_KEYWORDS = [
-    # Cardiovasculares
-    "dor no peito", "pressão no peito", "dor no coração", "taquicardia", "palpitação forte",
-    
-    # Respiratórios
-    "falta de ar", "dificuldade para respirar", "respiração curta", "chiado no peito", "não consigo respirar", "engasguei",
-    
-    # Neurológicos
-    "desmaio", "perda de consciência", "não consigo falar", "fraqueza de um lado do corpo", "formigamento súbito",
-    
-    # Hemorragia / Trauma
-    "sangramento intenso", "sangramento que não para", "muito sangue", "hemorragia", "corte profundo", "acidente grave",
-    
-    # Outros críticos
-    "parada cardiaca", "parada respiratória", "sem pulso", "convulsão", "ataque epiléptico", "choque elétrico"
-]
+
+# Limite de chamadas simultâneas ao LLM por processo e fila de espera
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "256"))
+LLM_QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", "10"))
+
+# Política de chamadas ao LLM: prazo, novas tentativas, hedge, reparo do JSON e circuit breaker
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "20"))
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BACKOFF_S = float(os.getenv("LLM_RETRY_BACKOFF_S", "0.5"))
+LLM_RETRY_BACKOFF_MAX_S = float(os.getenv("LLM_RETRY_BACKOFF_MAX_S", "4"))
+LLM_JSON_REPAIR = os.getenv("LLM_JSON_REPAIR", "true").lower() == "true"
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_DELAY_S = float(os.getenv("LLM_HEDGE_DELAY_S", "2"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+
+# Cache opcional de respostas do LLM (LRU local + camada compartilhada no MongoDB)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", "3600"))
+LLM_CACHE_SHARED = os.getenv("LLM_CACHE_SHARED", "false").lower() == "true"
+
+# Palavras-chave de emergência por categoria, recarregadas do JSON quando o arquivo muda
+EMERGENCY_KEYWORDS_FILE = os.getenv(
+    "EMERGENCY_KEYWORDS_FILE", os.path.join(os.path.dirname(__file__), "emergency_keywords.json")
+)
+EMERGENCY_KEYWORDS_RELOAD_S = float(os.getenv("EMERGENCY_KEYWORDS_RELOAD_S", "5"))
+emergency_detector = EmergencyDetector(EMERGENCY_KEYWORDS_FILE, EMERGENCY_KEYWORDS_RELOAD_S)
+
+# Confirmação do resumo (palavras inteiras: "sim" não casa com "assim")
+confirmation_matcher = KeywordMatcher({
+    "confirmacao": ["sim", "confirmo", "correto", "pode salvar", "pode terminar"]
+}, whole_words=True)
+
+# Limite de segurança de turnos por triagem
+MAX_TURNS = 15
+
+# Instrução da chamada de reparo, quando a resposta não é um JSON válido
+REPAIR_INSTRUCTION = (
+    "ATENÇÃO: a sua resposta anterior não era um JSON válido no formato obrigatório. "
+    "Responda novamente com APENAS o objeto JSON, sem nenhum texto fora dele.\nResposta anterior inválida:\n"
+)
+
+# Pergunta de fechamento pedida no SYSTEM_PROMPT e mensagem final fixa após a confirmação
+SUMMARY_QUESTION_MARKER = "podemos encerrar a triagem"
+CONFIRMATION_MESSAGE = (
+    "Ótimo! Sua triagem foi concluída com sucesso e os dados foram salvos para a sua consulta. "
+    "Obrigado por usar o ClinicAI."
+)
 # -------------------------------
 # 1. Prompt do agente 
 # -------------------------------
@@ -58,31 +107,82 @@ Se o usuário mencionou sintomas de emergência, defina 'emergency_alert': true.
 # -------------------------------
 # 2. Inicialização do Cliente
 # -------------------------------
-llm = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+llm_limiter = LLMConcurrencyLimiter(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT_S)
+
+# O provedor, o cache e o grafo compilado são criados no primeiro uso (ou no
+# aquecimento do worker, em main.py) e compartilhados pelo processo: importar o
+# módulo não carrega o SDK do Gemini nem exige credenciais.
+
+@functools.cache
+def get_llm_policy() -> LLMCallPolicy:
+    """Política de chamadas sobre o provedor escolhido em LLM_PROVIDER (Gemini ou o stub local)."""
+    return LLMCallPolicy(
+        create_llm_provider(MODEL_NAME, response_schema=ModelReply),
+        timeout=LLM_TIMEOUT_S,
+        max_attempts=LLM_RETRY_ATTEMPTS,
+        backoff=LLM_RETRY_BACKOFF_S,
+        backoff_max=LLM_RETRY_BACKOFF_MAX_S,
+        hedge=LLM_HEDGE_ENABLED,
+        hedge_delay=LLM_HEDGE_DELAY_S,
+        breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S),
+        repair=LLM_JSON_REPAIR,
+    )
+
+@functools.cache
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Cache de respostas, se LLM_CACHE_ENABLED."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    return LLMResponseCache(
+        LRUTTLCache(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_S),
+        MongoResponseCache(get_db(), LLM_CACHE_TTL_S) if LLM_CACHE_SHARED else None,
+    )
+
+# Entra na chave do cache: editar o SYSTEM_PROMPT invalida as respostas guardadas
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT)
 
 # ----------------------------------------------------
 # 3. Funções Auxiliares e Nodos
 # ----------------------------------------------------
 
-def clean_json_string(text: str) -> str:
-    """Limpa a string de resposta do LLM, removendo wrappers Markdown e texto extra."""
-    text = text.strip()
-    if text.startswith("```json"):
-        text = text[7:]
-    if text.endswith("```"):
-        text = text[:-3]
-    return text.strip()
+def last_user_text(messages: List[Dict[str, Any]]) -> str:
+    """Texto da última mensagem do usuário (a resposta do modelo pode já estar no fim da lista)."""
+    for msg in reversed(messages):
+        if msg.get("sender", "user") == "user":
+            return msg.get("text", "")
+    return ""
 
-def chatbot_node(state: State):
+def next_message_id(messages: List[Dict[str, Any]]) -> int:
+    """Próximo id sequencial, a partir do maior id já usado no histórico."""
+    return max((msg.get("id") or 0 for msg in messages), default=0) + 1
+
+async def allocate_reply_id(state: State, config: RunnableConfig) -> int:
     """
-    Nó principal: Interage, gera resposta, extrai triagem, e atualiza o estado em UMA CHAMADA.
+    Id da resposta do agente, reservado no contador atômico do chat (`message_seq`),
+    o mesmo que numera as mensagens do usuário: uma mensagem gravada no chat
+    durante o turno nunca recebe o mesmo id. Sem repositório na configuração da
+    execução (grafo rodado isolado) ou com o chat apagado no meio do turno, segue
+    o maior id do estado.
+    """
+    configurable = config.get("configurable", {})
+    repo = configurable.get("repo")
+    if repo is not None:
+        message_id = await repo.allocate_message_id(ObjectId(configurable["thread_id"]))
+        if message_id is not None:
+            return message_id
+    return next_message_id(state.get("messages", []))
+
+def build_prompt(state: State) -> tuple[Prompt, Dict[str, Any]]:
+    """
+    Monta o prompt do turno a partir do estado: o SYSTEM_PROMPT como instrução de
+    sistema, as mensagens da janela como turnos e a instrução forçada, se houver.
+    Retorna o prompt e as atualizações de estado decididas antes da chamada
+    ao LLM (flag resumo_confirmado e resumo da janela de contexto).
     """
     messages = state.get("messages", [])
 
     # 1. VERIFICAÇÃO DE CONFIRMAÇÃO (CHECA A ÚLTIMA MENSAGEM DO USUÁRIO)
-    last_user_input = messages[-1].get("text", "").lower()
-    confirmation_keywords = ["sim", "confirmo", "correto", "pode salvar", "pode terminar"]
-    user_confirmed_summary = any(kw in last_user_input for kw in confirmation_keywords)
+    user_confirmed_summary = confirmation_matcher.search(last_user_text(messages)) is not None
     
     # 2. DECIDE O PROMPT A SER ENVIADO
     forced_instruction = ""
@@ -91,43 +191,46 @@ def chatbot_node(state: State):
     if user_confirmed_summary and not new_resumo_confirmado:
         # Se o usuário confirmou e ainda não tinha a flag, a mensagem final é forçada
         forced_instruction = (
-            "\n\n INSTRUÇÃO DE FLUXO: O usuário CONFIRMOU o resumo na última mensagem. "
+            "INSTRUÇÃO DE FLUXO: O usuário CONFIRMOU o resumo na última mensagem. "
             "Sua ÚNICA TAREFA agora é gerar a mensagem final para o usuário no 'next_response': "
-            "'Ótimo! Sua triagem foi concluída com sucesso e os dados foram salvos para a sua consulta. Obrigado por usar o ClinicAI.'. "
+            f"'{CONFIRMATION_MESSAGE}'. "
             "O grafo será encerrado após esta resposta. O JSON 'triagem_data' deve refletir o estado final do resumo."
         )
         new_resumo_confirmado = True # Marca a flag
     
-    # Cria o histórico de mensagens para enviar ao LLM
-    prompt_history = "\n".join([f"{msg.get('sender', 'user')}: {msg.get('text', '')}" for msg in messages])
+    # Cria o histórico de mensagens para enviar ao LLM (janela limitada + resumo dos turnos antigos)
+    context, window, context_updates = build_context(state)
     
-    # Adiciona a instrução do sistema e a instrução forçada, se houver
-    full_prompt = SYSTEM_PROMPT + forced_instruction + "\n\nHISTÓRICO DA CONVERSA:\n" + prompt_history
+    # A instrução do sistema é fixa (fica em cache no provedor); a instrução forçada vai no fim
+    prompt = Prompt(SYSTEM_PROMPT, window, context, forced_instruction)
+    return prompt, {"resumo_confirmado": new_resumo_confirmado, **context_updates}
 
-    # --- INÍCIO DA ÚNICA CHAMADA DE API ---
-    response_text = ""
+def apply_model_output(state: State, response_text_raw: Optional[str], prompt_updates: Dict[str, Any], reply_id: int):
+    """
+    Interpreta o JSON devolvido pelo LLM e monta a atualização de estado do nó chatbot.
+    `response_text_raw` é None quando a chamada de API falhou; `prompt_updates` vem
+    de build_prompt e `reply_id` de allocate_reply_id. Em `messages` vai só a
+    resposta nova (o estado acumula o histórico).
+    """
     try:
-        response = llm.models.generate_content(
-            model=MODEL_NAME, 
-            contents=[{"role": "user", "parts": [{"text": full_prompt}]}]
-        )
-        response_text_raw = clean_json_string(response.text)
-        
-        # Tenta decodificar o JSON único
-        response_data = json.loads(response_text_raw) 
-        
-        response_text = response_data.get("next_response", "Desculpe, não consegui gerar a próxima resposta.")
-        triagem = response_data.get("triagem_data", state.get("triagem", {})) 
-        
-    except Exception as e:
+        if response_text_raw is None:
+            raise ModelOutputError("api", "chamada de API sem resposta")
+        parsed = parse_model_output(response_text_raw)
+        if parsed.partial:
+            LLM_RESILIENCE_EVENTS.labels(event="partial_json").inc()
+            logger.info("Resposta do LLM cortada; aproveitados os campos completos")
+        response_text = parsed.reply.next_response
+        triagem = merge_triagem(state.get("triagem", {}), parsed)
+
+    except ModelOutputError as e:
         # Mantém a triagem anterior em caso de falha.
-        print(f"Erro na ÚNICA CHAMADA DE API/Parsing de JSON: {e}. Retorno bruto: {response_text_raw if 'response_text_raw' in locals() else 'N/A'}")
+        LLM_PARSE_FAILURES.labels(reason=e.reason).inc()
+        logger.warning("Falha na chamada de API/parsing de JSON (%s): %s. Retorno bruto: %.500r", e.reason, e, response_text_raw)
         response_text = "Houve um erro no processamento. Por favor, tente novamente."
         triagem = state.get("triagem", {}) 
-    # --- FIM DA ÚNICA CHAMADA DE API ---
 
-    # 3. Adiciona a resposta do agente ao histórico
-    messages.append({"id": len(messages) + 1, "text": response_text, "sender": "model"})
+    # 3. Resposta do agente, com o id reservado no chat
+    reply = {"id": reply_id, "text": response_text, "sender": "model"}
 
     # 4. Atualiza flags (emergency_detected)
     emergency_detected = triagem.get("emergency_alert", False) or state.get("emergency_detected", False)
@@ -136,14 +239,117 @@ def chatbot_node(state: State):
     new_turn_count = state.get("turn_count", 0) + 1
 
     return {
-        "messages": messages,
+        **prompt_updates,
+        "messages": [reply],
         "triagem": triagem,
-        "resumo_confirmado": new_resumo_confirmado,
         "emergency_detected": emergency_detected,
         "turn_count": new_turn_count 
     }
 
-def emergency_protocol(state: State):
+async def stream_model_output(prompt: Prompt):
+    """Gera os pedaços de texto da resposta do LLM à medida que chegam (API de stream)."""
+    async with llm_limiter.slot():
+        async for text in get_llm_policy().stream(prompt):
+            yield text
+
+async def stream_next_response(prompt: Prompt) -> str:
+    """
+    Chama o LLM em stream, emitindo o texto de `next_response` conforme chega como
+    eventos `custom` do grafo ({"delta": ...}). Devolve a resposta bruta completa.
+    """
+    writer = get_stream_writer()
+    streamer = JsonStringFieldStreamer("next_response")
+    chunks = []
+    async for text in stream_model_output(prompt):
+        chunks.append(text)
+        delta = streamer.feed(text)
+        if delta:
+            writer({"delta": delta})
+    return "".join(chunks)
+
+def cacheable_turn(state: State) -> bool:
+    """Turnos de emergência (flag ou palavra-chave) nunca usam o cache."""
+    if state.get("emergency_detected"):
+        return False
+    return emergency_detector.search(last_user_text(state.get("messages", []))) is None
+
+def valid_model_output(response_text_raw: Optional[str]) -> bool:
+    """A resposta é um ModelReply completo (sem recorrer à recuperação de JSON cortado)?"""
+    if response_text_raw is None:
+        return False
+    try:
+        parse_model_output(response_text_raw, tolerant=False)
+    except ModelOutputError:
+        return False
+    return True
+
+def cacheable_response(response_text_raw: Optional[str]) -> bool:
+    """Só respostas válidas e sem alerta de emergência vão para o cache."""
+    if response_text_raw is None:
+        return False
+    try:
+        triagem = parse_model_output(response_text_raw, tolerant=False).reply.triagem_data
+    except ModelOutputError:
+        return False
+    return not (triagem is not None and triagem.emergency_alert)
+
+def build_repair_prompt(prompt: Prompt, bad_output: str) -> Prompt:
+    """Prompt da chamada de reparo: o original com o pedido de JSON e a resposta inválida no fim."""
+    instruction = "\n\n".join(filter(None, [prompt.instruction, REPAIR_INSTRUCTION + bad_output[:2000]]))
+    return replace(prompt, instruction=instruction)
+
+async def call_llm(prompt: Prompt, stream: bool) -> Optional[str]:
+    """
+    Uma chamada ao LLM pela política de chamadas (prazo, novas tentativas, hedge,
+    reparo); None se a API falhou. Sobrecarga e circuito aberto (LLMOverloaded e
+    LLMUnavailable) sobem até a rota.
+    """
+    try:
+        if stream:
+            return await stream_next_response(prompt)
+        async with llm_limiter.slot():
+            return await get_llm_policy().generate(prompt, valid_model_output, build_repair_prompt)
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        logger.error("Erro na chamada de API%s: %r", " em stream" if stream else "", e)
+        return None
+
+async def chatbot_node(state: State, config: RunnableConfig):
+    """
+    Nó principal: Interage, gera resposta, extrai triagem, e atualiza o estado em UMA CHAMADA.
+    A chamada é assíncrona e passa pelo limitador de concorrência; rejeições por
+    sobrecarga (LLMOverloaded) sobem até a rota em vez de virarem mensagem de erro.
+    Com `stream_tokens` na configuração da execução, a resposta é gerada em stream.
+    Com o cache ligado, prompts já vistos são respondidos sem chamar o modelo.
+    """
+    prompt, prompt_updates = build_prompt(state)
+    stream = config.get("configurable", {}).get("stream_tokens", False)
+
+    key = None
+    llm_cache = get_llm_cache()
+    if llm_cache is not None and cacheable_turn(state):
+        # O SYSTEM_PROMPT entra na chave pela versão; o resto, pelo texto
+        key = cache_key(MODEL_NAME, PROMPT_VERSION, prompt.dynamic_text())
+        cached = await llm_cache.get(key)
+        if cached is not None:
+            if stream:
+                delta = JsonStringFieldStreamer("next_response").feed(cached)
+                if delta:
+                    get_stream_writer()({"delta": delta})
+            return apply_model_output(state, cached, prompt_updates, await allocate_reply_id(state, config))
+
+    # --- INÍCIO DA ÚNICA CHAMADA DE API ---
+    response_text_raw = await call_llm(prompt, stream)
+    # --- FIM DA ÚNICA CHAMADA DE API ---
+
+    if key is not None and cacheable_response(response_text_raw):
+        await llm_cache.set(key, response_text_raw)
+
+    # O id é reservado depois da chamada, perto da gravação do turno
+    return apply_model_output(state, response_text_raw, prompt_updates, await allocate_reply_id(state, config))
+
+async def emergency_protocol(state: State, config: RunnableConfig):
     """
     Nó de parada: Envia a mensagem de alerta e força o fim da triagem.
     """
@@ -153,19 +359,22 @@ def emergency_protocol(state: State):
         "Por favor, **interrompa esta conversa** e procure o pronto-socorro mais próximo ou ligue para o **192** (SAMU) imediatamente."
     )
     
-    messages = state["messages"] + [{"id": len(state["messages"]) + 1, "text": alert_message, "sender": "model"}]
+    alert = {"id": await allocate_reply_id(state, config), "text": alert_message, "sender": "model"}
+
+    # Categoria que disparou o alerta; sem palavra-chave, o alerta veio do LLM (triagem_data)
+    match = emergency_detector.search(last_user_text(state["messages"]))
+    category = match.category if match else state.get("emergency_category") or "llm"
 
     return {
-        "messages": messages,
+        "messages": [alert],
         "emergency_detected": True, 
+        "emergency_category": category,
         "resumo_confirmado": True,
         "turn_count": state.get("turn_count", 0)
     }
 
 def router_emergency(state: State) -> str:
-    last_user_message = state["messages"][-1].get("text", "").lower()
-    
-    if any(kw in last_user_message for kw in EMERGENCY_KEYWORDS):
+    if emergency_detector.search(last_user_text(state["messages"])):
         return "emergency"
     
     if state.get("emergency_detected"):
@@ -173,20 +382,55 @@ def router_emergency(state: State) -> str:
         
     return "continue_triage"
 
-def router_end(state: State) -> str:
-    """Roteia para o nó de salvamento se o resumo for confirmado, ou volta para a triagem.
-    Adiciona uma condição de segurança para o contador de turnos.
+async def confirmation_node(state: State, config: RunnableConfig):
+    """
+    Nó de encerramento sem LLM: o usuário confirmou o resumo, então a resposta
+    já é conhecida. A triagem fica como estava.
+    """
+    confirmation = {"id": await allocate_reply_id(state, config), "text": CONFIRMATION_MESSAGE, "sender": "model"}
+
+    return {
+        "messages": [confirmation],
+        "resumo_confirmado": True,
+        "turn_count": state.get("turn_count", 0) + 1
+    }
+
+def summary_requested(state: State) -> bool:
+    """O último turno do modelo foi o resumo com a pergunta de confirmação?"""
+    for msg in reversed(state["messages"]):
+        if msg.get("sender") == "model":
+            return SUMMARY_QUESTION_MARKER in normalize_text(msg.get("text", ""))
+    return False
+
+def router_entry(state: State) -> str:
     """
-    # Condição 1: Confirmação do resumo (principal)
+    Roteia ANTES do LLM os turnos com resultado já conhecido: emergência por
+    palavra-chave e confirmação do resumo. Só os demais pagam a chamada ao modelo.
+    """
+    last_user_message = last_user_text(state["messages"])
+
+    if emergency_detector.search(last_user_message):
+        return "emergency"
+
+    if summary_requested(state) and confirmation_matcher.search(last_user_message):
+        return "confirmation"
+
+    return "chatbot"
+
+def end_or_continue(state: State):
+    """
+    Nó de fim de turno (o grafo é interrompido logo depois dele).
+    Condição de segurança: no limite de turnos, força o encerramento da triagem.
+    """
+    if not state.get("resumo_confirmado") and state.get("turn_count", 0) >= MAX_TURNS:
+        logger.warning("LangGraph atingiu o limite de turnos (%s). Forçando encerramento.", state["turn_count"])
+        return {"resumo_confirmado": True}
+    return {}
+
+def router_end(state: State) -> str:
+    """Roteia para o nó de salvamento se o resumo for confirmado, ou volta para a triagem."""
     if state.get("resumo_confirmado"):
         return "save_and_end"
-    
-    # Condição 2 (Segurança): Limite de turnos alcançado
-    if state.get("turn_count", 0) >= 15: 
-        print(f"AVISO: LangGraph atingiu o limite de turnos ({state['turn_count']}). Forçando encerramento.")
-        state["resumo_confirmado"] = True 
-        return "save_and_end"
-        
     return "continue_triage"
 
 # ----------------------------------------------------
@@ -195,11 +439,21 @@ def router_end(state: State) -> str:
 
 graph = StateGraph(State)
 
-graph.add_node("chatbot", chatbot_node)
-graph.add_node("emergency_protocol", emergency_protocol)
-graph.add_node("end_or_continue", lambda x: x) 
+# Cada nó é cronometrado (histograma chatbot_graph_node_seconds em /metrics)
+graph.add_node("chatbot", timed_node("chatbot", chatbot_node))
+graph.add_node("emergency_protocol", timed_node("emergency_protocol", emergency_protocol))
+graph.add_node("confirmation", timed_node("confirmation", confirmation_node))
+graph.add_node("end_or_continue", timed_node("end_or_continue", end_or_continue))
 
-graph.set_entry_point("chatbot")
+# Emergência e confirmação não passam pelo LLM
+graph.set_conditional_entry_point(
+    router_entry,
+    {
+        "emergency": "emergency_protocol",
+        "confirmation": "confirmation",
+        "chatbot": "chatbot"
+    }
+)
 
 graph.add_conditional_edges(
     "chatbot",
@@ -210,8 +464,9 @@ graph.add_conditional_edges(
     }
 )
 
-# Roteia de Emergência para o ponto de roteamento final
+# Roteia de Emergência e Confirmação para o ponto de roteamento final
 graph.add_edge("emergency_protocol", "end_or_continue") 
+graph.add_edge("confirmation", "end_or_continue") 
 
 graph.add_conditional_edges(
     "end_or_continue", 
@@ -222,87 +477,205 @@ graph.add_conditional_edges(
     }
 )
 
-app = graph.compile()
+@functools.cache
+def get_agent_app():
+    """
+    Grafo compilado com o checkpointer. Um turno por execução: o grafo para depois
+    de end_or_continue e o checkpoint guarda onde parou. A próxima mensagem do
+    usuário começa uma nova execução na mesma thread.
+    """
+    return graph.compile(checkpointer=get_checkpointer(), interrupt_after=["end_or_continue"])
 
 # ----------------------------------------------------
 # 5. FUNÇÃO DE INTEGRAÇÃO COM BANCO
 # ----------------------------------------------------
 
-def run_agent(chat_id: str, user_message: str) -> str:
+def load_state(chat: Dict[str, Any]) -> State:
     """
-    Lógica de integração: Carrega estado, executa o grafo, salva o estado atualizado.
+    Monta o estado do grafo a partir do documento do chat. De um histórico longo
+    (chat sem checkpoint) o estado leva só as mensagens recentes; as anteriores
+    entram no resumo.
     """
-    print("\n--- INICIANDO DEPURACÃO DA FUNÇÃO run_agent ---")
-    
-    chat = collection.find_one({"_id": ObjectId(chat_id)})
-    if not chat:
-        raise ValueError("Chat não encontrado")
-
-    # 1. Prepara o estado inicial
-    messages = chat.get("messages", []) + [{"sender": "user", "text": user_message}]
-    state = {
-        "messages": messages,
+    messages = chat.get("messages", [])
+    summary, summary_upto = chat.get("summary", ""), chat.get("summary_upto", 0)
+    return {
+        "messages": recent_messages([], messages),
         "triagem": chat.get("triagem", {}),
         "resumo_confirmado": chat.get("resumo_confirmado", False),
         "emergency_detected": chat.get("emergency_detected", False),
-        "turn_count": chat.get("turn_count", 0) 
+        "turn_count": chat.get("turn_count", 0),
+        "summary": summary,
+        "summary_upto": summary_upto,
+        "emergency_category": chat.get("emergency_category"),
+        **fold_overflow(messages, summary, summary_upto),
     }
-    
-    print(f"1. ESTADO INICIAL (carregado do DB): {state}")
 
-    # 2. Executa o LangGraph usando stream para rodar um turno
-    final_state = state.copy()
-    
-    for s in app.stream(state):
-        print(f"2. ATUALIZAÇÃO DO GRAFO (Stream): {s}")
-        final_state.update(s)
-        
-        # Condição de parada de turno 
-        if "__end__" in s or "decision_point" in s or "emergency_protocol" in s:
-            print("2.1. O LangGraph atingiu um nó de parada. Saindo do loop de stream.")
-            break
-            
-    updated_state = final_state
-    
-    print(f"3. ESTADO FINAL ATUALIZADO (após o stream): {updated_state}")
-    
-    # 3. Prepara a atualização base para o DB 
+def thread_config(chat_id: str, repo=None, **options) -> Dict[str, Any]:
+    """
+    Configuração de execução do grafo: uma thread de checkpoints por chat. Com
+    `repo`, os nós reservam no chat os ids das respostas (allocate_reply_id).
+    """
+    configurable = {"thread_id": str(chat_id), **options}
+    if repo is not None:
+        configurable["repo"] = repo
+    return {"configurable": configurable}
+
+def merge_update(state: State, update: Dict[str, Any]) -> State:
+    """Aplica uma atualização de nó ao estado como o grafo faz (mensagens acumulam, até a janela do estado)."""
+    return {**state, **update, "messages": recent_messages(state.get("messages", []), update.get("messages", []))}
+
+def turn_interrupted(snapshot) -> bool:
+    """
+    O último turno caiu no meio? Depois de um turno completo o grafo fica parado
+    antes do chatbot (ou terminado); qualquer outro nó pendente, ou um chatbot que
+    já tem resultado gravado, indica que o worker caiu durante a execução.
+    """
+    return any(task.name != "chatbot" or task.result is not None for task in snapshot.tasks)
+
+async def sync_history(chat_id: str, values: State, repo) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Compara o checkpoint com chat_messages a partir da última mensagem do usuário
+    que o grafo viu, numa única leitura, e devolve (mensagens que o grafo ainda
+    não viu, respostas do checkpoint que faltavam no histórico).
+
+    As respostas faltam quando o turno anterior terminou no grafo mas não chegou
+    a save_turn (o worker caiu ou o MongoDB falhou depois do ainvoke), ou quando
+    um turno interrompido acabou de ser retomado. O id delas foi reservado no
+    message_seq e ficaria fora do delta deste turno (build_turn_delta): são
+    gravadas aqui, antes de o turno seguir, para o LLM nunca ver uma resposta
+    que o paciente não viu.
+    """
+    known = values.get("messages", [])
+    since = max((msg.get("id") or 0 for msg in known if msg.get("sender") == "user"), default=0)
+    history = (await repo.get_messages(ObjectId(chat_id), since) or {}).get("messages", [])
+
+    stored = {msg.get("id") for msg in history}
+    missing = [
+        msg for msg in known
+        if msg.get("sender") == "model" and (msg.get("id") or 0) > since and msg.get("id") not in stored
+    ]
+    if missing:
+        await repo.save_turn(ObjectId(chat_id), missing, {})
+
+    seen = {(msg.get("id"), msg.get("sender")) for msg in known}
+    return [msg for msg in history if (msg.get("id"), msg.get("sender")) not in seen], missing
+
+async def prepare_turn(chat_id: str, chat: Dict[str, Any], repo) -> tuple[Optional[Dict[str, Any]], State]:
+    """
+    Lê o checkpoint do chat e devolve (entrada do próximo turno, estado atual do grafo).
+
+    Se o turno anterior foi interrompido, termina-o a partir do checkpoint, sem
+    repetir o que já rodou (a resposta do LLM fica nas escritas pendentes). Em
+    seguida grava as respostas do checkpoint que não chegaram a chat_messages
+    (sync_history). A entrada traz só as mensagens do chat que o grafo ainda não
+    viu; em chats sem checkpoint (anteriores ao checkpointer), o estado inteiro,
+    com o histórico lido do repositório. Entrada None: não há mensagem nova e o
+    turno retomado (ou o que não tinha sido gravado) já respondeu à última.
+    """
+    config = thread_config(chat_id, repo)
+    app = get_agent_app()
+    snapshot = await app.aget_state(config)
+    resumed = turn_interrupted(snapshot)
+    values = snapshot.values
+    if resumed:
+        values = await app.ainvoke(None, config, durability="sync")
+
+    if not values:
+        appended = chat.get("message")
+        if appended and appended.get("id") == 1:
+            # Chat novo: o histórico é só a mensagem que acabou de chegar
+            return load_state({**chat, "messages": [appended]}), {}
+        history = await repo.get_messages(ObjectId(chat_id))
+        return load_state({**chat, "messages": (history or {}).get("messages", [])}), {}
+
+    unseen, recovered = await sync_history(chat_id, values, repo)
+    if not unseen and (resumed or recovered):
+        return None, values
+    # Muitas mensagens desde o último turno: as que não cabem no estado vão para o resumo
+    overflow = fold_overflow(values.get("messages", []) + unseen, values.get("summary", ""), values.get("summary_upto", 0))
+    return {"messages": unseen, **overflow}, values
+
+async def run_graph_turn(chat_id: str, chat: Dict[str, Any], repo) -> State:
+    """
+    Executa o grafo por APENAS UM TURNO na thread do chat e devolve o estado final.
+    O ponto de interrupção após end_or_continue encerra a execução; o checkpointer
+    grava a cada passo só os canais alterados.
+    """
+    turn_input, values = await prepare_turn(chat_id, chat, repo)
+    if turn_input is None:
+        return values
+    return await get_agent_app().ainvoke(turn_input, thread_config(chat_id, repo), durability="sync")
+
+def build_update_fields(updated_state: State) -> Dict[str, Any]:
+    """Monta o $set do chat a partir do estado final do turno, incluindo os campos de conclusão."""
+    is_confirmed = updated_state.get("resumo_confirmado", False)
+    is_emergency = updated_state.get("emergency_detected", False)
+
     update_fields = {
         "messages": updated_state.get("messages", []),
         "triagem": updated_state.get("triagem", {}),
-        "resumo_confirmado": updated_state.get("resumo_confirmado", False),
-        "emergency_detected": updated_state.get("emergency_detected", False),
+        "resumo_confirmado": is_confirmed,
+        "emergency_detected": is_emergency,
         "turn_count": updated_state.get("turn_count", 0),
+        "summary": updated_state.get("summary", ""),
+        "summary_upto": updated_state.get("summary_upto", 0),
+        "emergency_category": updated_state.get("emergency_category"),
         "is_completed": False
     }
 
-    print(f"4. VALOR DA FLAG 'resumo_confirmado': {updated_state.get('resumo_confirmado')}")
-    
-    # 4. LÓGICA DE SALVAMENTO FINAL E CONCLUSÃO 
-    if updated_state.get("resumo_confirmado"):
-        print("5. DETECTADO: resumo_confirmado é True. Entrando na lógica de salvamento final.")
-        
+    if is_confirmed:
+        # Se a triagem foi confirmada (pelo usuário ou emergência), salva os campos de conclusão
         update_fields["is_completed"] = True
-        update_fields["triagem"] = updated_state.get("triagem", {}) 
-        
-        if updated_state.get("emergency_detected"):
-            update_fields["status"] = "EMERGENCY_ALERT"
-        else:
-            update_fields["status"] = "TRIAGE_COMPLETED"
-    else:
-        print("5. DETECTADO: resumo_confirmado é False. Nenhuma ação de salvamento final.")
-
-    print(f"6. CAMPOS PREPARADOS PARA O DB: {update_fields}")
-
-    # 5. Atualiza o MongoDB.
-    collection.update_one(
-        {"_id": ObjectId(chat_id)},
-        {"$set": update_fields}
+        update_fields["status"] = "EMERGENCY_ALERT" if is_emergency else "TRIAGE_COMPLETED"
+
+    return update_fields
+
+def build_turn_delta(chat: Dict[str, Any], after: State) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Compara o chat carregado com o estado final do turno e devolve apenas o que mudou:
+    as mensagens novas (ids além do `message_seq` do chat) e os campos do chat
+    alterados (para $set). Assim cada escrita custa O(turno), não O(histórico).
+    """
+    known_id = max(
+        [chat.get("message_seq") or 0] + [msg.get("id") or 0 for msg in chat.get("messages", [])]
     )
+    new_messages = [msg for msg in after.get("messages", []) if (msg.get("id") or 0) > known_id]
+
+    before_fields = build_update_fields(load_state(chat))
+    after_fields = build_update_fields(after)
+    changed_fields = {
+        key: value for key, value in after_fields.items()
+        if key != "messages" and before_fields.get(key) != value
+    }
+    if changed_fields.get("is_completed"):
+        # Marca de conclusão usada na exportação incremental (completed_since)
+        changed_fields["completed_at"] = datetime.now(timezone.utc)
+    return new_messages, changed_fields
+
+async def run_agent(chat_id: str, user_message: str, repo=None) -> str:
+    """
+    Lógica de integração: grava a mensagem, executa um turno do grafo, salva o que mudou no chat.
+    `repo` permite trocar o repositório (ex.: InMemoryChatRepository nos testes).
+    """
+    repo = repo or get_repository()
+    
+    # 1. Grava a mensagem do usuário (atômico) e prepara o estado inicial
+    chat = await repo.append_message(ObjectId(chat_id), {"text": user_message, "sender": "user"})
+    if not chat:
+        raise ValueError("Chat não encontrado")
+
+    logger.debug("run_agent %s: chat carregado do DB: %s", chat_id, chat)
+
+    # 2. Executa o LangGraph para rodar um turno (a partir do checkpoint do chat)
+    updated_state = await run_graph_turn(chat_id, chat, repo)
+    logger.debug("run_agent %s: estado final: %s", chat_id, updated_state)
+
+    # 3. Prepara a atualização para o DB (só o que mudou), com a lógica de salvamento final e conclusão
+    new_messages, changed_fields = build_turn_delta(chat, updated_state)
+    logger.debug("run_agent %s: campos para o DB: %s (+%d mensagens)", chat_id, changed_fields, len(new_messages))
 
-    # 6. Retorna a última mensagem do agente
-    agent_response = updated_state["messages"][-1]["text"]
-    print(f"7. RESPOSTA DO AGENTE RETORNADA: {agent_response}")
-    print("\n--- FIM DA DEPURACÃO ---")
+    # 4. Atualiza o MongoDB.
+    await repo.save_turn(ObjectId(chat_id), new_messages, changed_fields)
 
-    return agent_response
\ No newline at end of file
+    # 5. Retorna a última mensagem do agente
+    return updated_state["messages"][-1]["text"]
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+def normalize_text(text: str) -> str:
+    """
+    Forma canônica para comparação: sem acentos, minúsculas e com pontuação e
+    espaços repetidos reduzidos a um único espaço ("Cardíaca!!" -> "cardiaca").
+    """
+    if not text.isascii():
+        # NFKD separa letra e acento; o encode descarta os acentos (e o que não for latino)
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+def _trie_pattern(node: dict) -> str:
+    """Converte a trie de termos numa regex em que cada posição do texto segue um único ramo."""
+    end = "" in node
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if end:
+        # o termo pode terminar aqui ou continuar num termo mais longo (preferido)
+        body = "(?:" + body + ")?"
+    return body
+
+@dataclass(frozen=True)
+class KeywordMatch:
+    category: str
+    term: str
+
+class KeywordMatcher:
+    """
+    Detector de múltiplos termos compilado uma única vez.
+
+    Os termos (agrupados por categoria) são normalizados e montados numa trie,
+    convertida em uma única regex. O termo precisa começar no início de uma
+    palavra, mas pode ser o começo de uma palavra maior ("hemorragia" casa com
+    "hemorragias", "desmaio" com "desmaiou"): para emergências é melhor um
+    alarme a mais do que uma flexão perdida. Com `whole_words` o termo também
+    precisa terminar numa fronteira de palavra ("sim" não casa com "assim").
+    """
+
+    def __init__(self, terms_by_category: Dict[str, Iterable[str]], whole_words: bool = False):
+        self._categories: Dict[str, str] = {}
+        trie: dict = {}
+        for category, terms in terms_by_category.items():
+            for term in terms:
+                normalized = normalize_text(term)
+                if not normalized:
+                    continue
+                self._categories.setdefault(normalized, category)
+                node = trie
+                for char in normalized:
+                    node = node.setdefault(char, {})
+                node[""] = True
+
+        end = r"(?!\w)" if whole_words else ""
+        self._regex = re.compile(r"(?<!\w)(?:" + _trie_pattern(trie) + ")" + end) if trie else None
+
+    def search(self, text: str) -> Optional[KeywordMatch]:
+        """Primeiro termo encontrado no texto, com a sua categoria, ou None."""
+        if self._regex is None:
+            return None
+        match = self._regex.search(normalize_text(text))
+        if not match:
+            return None
+        term = match.group()
+        return KeywordMatch(category=self._categories[term], term=term)
+
+class EmergencyDetector:
+    """
+    KeywordMatcher de emergência carregado de um arquivo JSON {categoria: [termos]}.
+    O arquivo é recarregado sozinho quando muda (checagem de mtime a cada
+    `reload_interval` segundos), sem reiniciar o servidor.
+    """
+
+    def __init__(self, path: str, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._matcher = KeywordMatcher({})
+        self.reload()
+
+    def reload(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            terms = json.load(f)
+        matcher = KeywordMatcher(terms)
+        with self._lock:
+            self._matcher = matcher
+            self._mtime = os.path.getmtime(self.path)
+            self._checked_at = time.monotonic()
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            if os.path.getmtime(self.path) != self._mtime:
+                self.reload()
+        except (OSError, ValueError) as e:
+            # Arquivo ausente ou inválido: mantém a lista anterior
+            logger.warning("Falha ao recarregar palavras de emergência de %s: %s", self.path, e)
+
+    def search(self, text: str) -> Optional[KeywordMatch]:
+        self._maybe_reload()
+        return self._matcher.search(text)
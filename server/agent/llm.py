@@ -0,0 +1,452 @@
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from agent.context import estimate_tokens, format_history
+from agent.prompt_cache import PromptPrefixCache
+from observability import LLM_TOKENS
+
+# --- CONFIGURAÇÃO DO PROVEDOR DE LLM ---
+# "gemini" (padrão) ou "stub" (local, determinístico, para testes de carga sem rede)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+# Pede ao Gemini saída JSON restrita ao schema da resposta (ModelReply)
+LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "true").lower() == "true"
+LLM_STUB_LATENCY_S = float(os.getenv("LLM_STUB_LATENCY_S", "0.5"))
+LLM_STUB_JITTER_S = float(os.getenv("LLM_STUB_JITTER_S", "0.1"))
+LLM_STUB_SEED = os.getenv("LLM_STUB_SEED")
+# Falhas injetadas no stub (frações das chamadas), para testar a política de chamadas
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+LLM_STUB_MALFORMED_RATE = float(os.getenv("LLM_STUB_MALFORMED_RATE", "0"))
+LLM_STUB_SLOW_RATE = float(os.getenv("LLM_STUB_SLOW_RATE", "0"))
+LLM_STUB_SLOW_S = float(os.getenv("LLM_STUB_SLOW_S", "5"))
+# Custo simulado no stub do processamento da entrada não cacheada (segundos por 1000 tokens)
+LLM_STUB_PREFILL_S_PER_KTOK = float(os.getenv("LLM_STUB_PREFILL_S_PER_KTOK", "0"))
+# Instrução de sistema registrada como contexto em cache no provedor, com prazo e renovação
+LLM_PREFIX_CACHE = os.getenv("LLM_PREFIX_CACHE", "true").lower() == "true"
+LLM_PREFIX_CACHE_TTL_S = float(os.getenv("LLM_PREFIX_CACHE_TTL_S", "3600"))
+LLM_PREFIX_CACHE_REFRESH_S = float(os.getenv("LLM_PREFIX_CACHE_REFRESH_S", "300"))
+# Menor prefixo aceito pelo cache explícito do Gemini (abaixo disso a criação falha)
+LLM_PREFIX_CACHE_MIN_TOKENS = int(os.getenv("LLM_PREFIX_CACHE_MIN_TOKENS", "1024"))
+
+HISTORY_HEADER = "\n\nHISTÓRICO DA CONVERSA:\n"
+
+class TransientLLMError(Exception):
+    """Falha passageira do provedor (sobrecarga, erro 5xx): vale tentar de novo."""
+
+def record_tokens(tokens_in: Optional[int], tokens_out: Optional[int], tokens_cached: Optional[int] = None) -> None:
+    """`tokens_in` inclui os `tokens_cached`, lidos do contexto em cache (cobrados com desconto)."""
+    LLM_TOKENS.labels(direction="in").inc(tokens_in or 0)
+    LLM_TOKENS.labels(direction="out").inc(tokens_out or 0)
+    LLM_TOKENS.labels(direction="cached").inc(tokens_cached or 0)
+
+@dataclass(frozen=True)
+class Prompt:
+    """
+    Prompt de um turno em partes: a instrução de sistema (fixa, o prefixo que o
+    provedor guarda em cache), o contexto dos turnos já resumidos, as mensagens
+    da janela com o papel de cada uma e uma instrução do turno (confirmação do
+    resumo, reparo do JSON).
+    """
+    system: str
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    context: str = ""
+    instruction: str = ""
+
+    def history_text(self) -> str:
+        return format_history(self.context, self.messages)
+
+    def dynamic_text(self) -> str:
+        """Tudo o que muda de um turno para outro (o prompt sem a instrução de sistema)."""
+        return self.instruction + HISTORY_HEADER + self.history_text()
+
+    def as_text(self) -> str:
+        """O prompt numa parte só, como era enviado antes da separação por papéis."""
+        return self.system + self.dynamic_text()
+
+class LLMProvider:
+    """
+    Interface dos provedores de LLM usados pelo nó chatbot: recebem o prompt do
+    turno e devolvem o texto bruto da resposta (o JSON da triagem).
+
+    Provedores com cache de contexto implementam os três métodos
+    `*_cached_prefix`, usados pelo PromptPrefixCache em `prefix_cache`.
+    """
+
+    prefix_cache: Optional[PromptPrefixCache] = None
+    # Menor instrução de sistema (em tokens) que o provedor aceita guardar em cache
+    min_cached_tokens = 0
+
+    async def generate(self, prompt: Prompt) -> str:
+        raise NotImplementedError
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        """Pedaços de texto da resposta, à medida que chegam."""
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    async def ping(self) -> None:
+        """Checagem barata de que o provedor responde (prontidão do worker); levanta exceção se não."""
+
+    async def create_cached_prefix(self, system: str, ttl: float) -> str:
+        """Registra a instrução de sistema no cache do provedor; devolve o nome do contexto."""
+        raise NotImplementedError
+
+    async def refresh_cached_prefix(self, name: str, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def delete_cached_prefix(self, name: str) -> None:
+        raise NotImplementedError
+
+    async def _cached_prefix(self, prompt: Prompt) -> Optional[str]:
+        """Nome do contexto em cache com a instrução de sistema do prompt, ou None."""
+        if self.prefix_cache is None:
+            return None
+        return await self.prefix_cache.name_for(prompt.system)
+
+class GeminiProvider(LLMProvider):
+    """
+    Google Gemini pela API assíncrona do google-genai. Com `response_schema`
+    (um modelo pydantic) a saída vem em modo JSON, restrita a esse schema.
+
+    A instrução de sistema vai em `system_instruction` ou, se o prefix_cache a
+    registrou, pelo nome do contexto em cache (`cached_content`); as mensagens
+    vão como turnos de `user` e `model`. Se o contexto em cache for recusado
+    (venceu, foi apagado), a chamada é refeita com a instrução inline.
+
+    O SDK só é importado aqui (leva ~1 s para carregar), para que processos
+    com o stub, testes e CLIs não paguem esse custo.
+    """
+
+    min_cached_tokens = LLM_PREFIX_CACHE_MIN_TOKENS
+
+    def __init__(self, model: str, api_key: Optional[str] = None, response_schema=None):
+        from google import genai
+        from google.genai import types
+
+        self.model = model
+        self.client = genai.Client(api_key=api_key or os.getenv("GOOGLE_API_KEY"))
+        self.config = types.GenerateContentConfig(
+            response_mime_type="application/json", response_schema=response_schema
+        ) if response_schema is not None else types.GenerateContentConfig()
+
+    def _contents(self, prompt: Prompt):
+        """Turnos por papel; falas seguidas do mesmo papel viram partes do mesmo turno."""
+        contents = []
+
+        def add(role: str, text: str):
+            if contents and contents[-1]["role"] == role:
+                contents[-1]["parts"].append({"text": text})
+            else:
+                contents.append({"role": role, "parts": [{"text": text}]})
+
+        if prompt.context:
+            add("user", prompt.context)
+        for msg in prompt.messages:
+            add(msg.get("sender", "user"), msg.get("text", ""))
+        if prompt.instruction:
+            add("user", prompt.instruction)
+        return contents
+
+    def _config(self, prompt: Prompt, cached: Optional[str]):
+        # Com cached_content a instrução de sistema já está no contexto e não pode ir de novo
+        if cached is not None:
+            return self.config.model_copy(update={"cached_content": cached})
+        return self.config.model_copy(update={"system_instruction": prompt.system})
+
+    def _cache_rejected(self, cached: Optional[str], error: Exception) -> bool:
+        """O erro veio do contexto em cache (vencido ou apagado)? Se sim, ele é esquecido."""
+        from google.genai import errors as genai_errors
+
+        if cached is None or not isinstance(error, genai_errors.ClientError) or error.code not in (400, 403, 404):
+            return False
+        self.prefix_cache.drop(cached)
+        return True
+
+    @staticmethod
+    def _record_usage(usage) -> None:
+        if usage is not None:
+            record_tokens(usage.prompt_token_count, usage.candidates_token_count, usage.cached_content_token_count)
+
+    async def generate(self, prompt: Prompt) -> str:
+        cached = await self._cached_prefix(prompt)
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=self.model, contents=self._contents(prompt), config=self._config(prompt, cached)
+            )
+        except Exception as e:
+            if not self._cache_rejected(cached, e):
+                raise
+            response = await self.client.aio.models.generate_content(
+                model=self.model, contents=self._contents(prompt), config=self._config(prompt, None)
+            )
+        self._record_usage(response.usage_metadata)
+        return response.text
+
+    async def _stream(self, prompt: Prompt, cached: Optional[str]) -> AsyncIterator[str]:
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model, contents=self._contents(prompt), config=self._config(prompt, cached)
+        )
+        usage = None
+        async for chunk in stream:
+            # O uso de tokens vem acumulado; vale o do último pedaço
+            usage = chunk.usage_metadata or usage
+            if chunk.text:
+                yield chunk.text
+        self._record_usage(usage)
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        cached = await self._cached_prefix(prompt)
+        emitted = False
+        try:
+            async for text in self._stream(prompt, cached):
+                emitted = True
+                yield text
+        except Exception as e:
+            if emitted or not self._cache_rejected(cached, e):
+                raise
+            async for text in self._stream(prompt, None):
+                yield text
+
+    async def ping(self) -> None:
+        # Metadados do modelo: valida chave e rede sem gerar tokens
+        await self.client.aio.models.get(model=self.model)
+
+    async def create_cached_prefix(self, system: str, ttl: float) -> str:
+        from google.genai import types
+
+        cache = await self.client.aio.caches.create(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system, ttl=f"{int(ttl)}s", display_name=f"chatbot-system-{self.model}"
+            ),
+        )
+        return cache.name
+
+    async def refresh_cached_prefix(self, name: str, ttl: float) -> None:
+        from google.genai import types
+
+        await self.client.aio.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{int(ttl)}s"))
+
+    async def delete_cached_prefix(self, name: str) -> None:
+        await self.client.aio.caches.delete(name=name)
+
+# Perguntas do stub, na ordem dos campos da triagem
+STUB_QUESTIONS = [
+    ("queixa_principal", "Olá! Sou o assistente da ClinicAI e não substituo o diagnóstico médico. Qual é a sua queixa principal?"),
+    ("sintomas_detalhados", "Pode descrever os sintomas com mais detalhes?"),
+    ("duracao_frequencia", "Há quanto tempo isso acontece e com que frequência?"),
+    ("intensidade", "De 0 a 10, qual a intensidade?"),
+    ("historico_relevante", "Tem algum histórico de saúde relevante?"),
+    ("medidas_tomadas", "Já tomou alguma medida ou medicamento?"),
+]
+STUB_SUMMARY_QUESTION = "As informações acima estão corretas, e podemos encerrar a triagem e salvar os dados?"
+_FORCED_MESSAGE = re.compile(r"'next_response': '(.+?)'\. ", re.S)
+
+class StubProvider(LLMProvider):
+    """
+    LLM local e determinístico: segue o roteiro de perguntas de STUB_QUESTIONS a
+    partir da última pergunta presente no histórico do prompt e, no fim, devolve o
+    resumo com a pergunta de confirmação. A resposta é sempre o JSON esperado
+    (`next_response` + `triagem_data`).
+
+    Cada chamada espera `latency` ± `jitter` segundos; com `seed` a sequência de
+    latências (e de falhas) se repete entre execuções.
+
+    Falhas injetadas, por fração das chamadas: `error_rate` levanta
+    TransientLLMError, `malformed_rate` devolve o JSON cortado ao meio e
+    `slow_rate` soma `slow_s` segundos à latência.
+
+    O cache de contexto é simulado em memória, com prazo: a instrução de sistema
+    em cache não entra no custo de `prefill_s_per_ktok` segundos por 1000 tokens
+    de entrada e é contada como tokens `cached`.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.1,
+        seed: Optional[int] = None,
+        chunk_size: int = 16,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_s: float = 5.0,
+        prefill_s_per_ktok: float = 0.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.slow_rate = slow_rate
+        self.slow_s = slow_s
+        self.prefill_s_per_ktok = prefill_s_per_ktok
+        self._random = random.Random(seed)
+        # Contextos em cache: nome -> (vence em, no relógio monotônico; instrução de sistema)
+        self.cached_prefixes: Dict[str, tuple[float, str]] = {}
+        self._cache_seq = 0
+
+    def _delay(self, uncached_tokens: int) -> float:
+        delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        delay += self.prefill_s_per_ktok * uncached_tokens / 1000
+        if self._random.random() < self.slow_rate:
+            delay += self.slow_s
+        return delay
+
+    def _faulty_respond(self, prompt: Prompt) -> str:
+        if self._random.random() < self.error_rate:
+            raise TransientLLMError("falha injetada no stub")
+        text = self.respond(prompt)
+        if self._random.random() < self.malformed_rate:
+            text = text[:len(text) // 2]
+        return text
+
+    def respond(self, prompt: Prompt) -> str:
+        """Resposta (JSON) para o prompt, sem latência."""
+        # Última fala de cada lado (a do modelo pode ter várias linhas, como o resumo)
+        last_model = next((m.get("text", "") for m in reversed(prompt.messages) if m.get("sender") == "model"), "")
+        last_user = next((m.get("text", "") for m in reversed(prompt.messages) if m.get("sender", "user") == "user"), "")
+        last_user = last_user.strip()
+
+        step = 0
+        for idx, (_, question) in enumerate(STUB_QUESTIONS):
+            if last_model.startswith(question):
+                step = idx + 1
+        if "podemos encerrar a triagem" in last_model:
+            step = len(STUB_QUESTIONS)
+
+        triagem = {field: "" for field, _ in STUB_QUESTIONS}
+        for field, _ in STUB_QUESTIONS[:step]:
+            triagem[field] = "informado pelo paciente"
+        if step:
+            triagem[STUB_QUESTIONS[step - 1][0]] = last_user
+        triagem["emergency_alert"] = False
+
+        forced = _FORCED_MESSAGE.search(prompt.instruction)
+        if forced:
+            next_response = forced.group(1)
+        elif step < len(STUB_QUESTIONS):
+            next_response = STUB_QUESTIONS[step][1]
+        else:
+            summary = "\n".join(f"- {field}: {value}" for field, value in triagem.items() if field != "emergency_alert")
+            next_response = f"Resumo da triagem:\n{summary}\n{STUB_SUMMARY_QUESTION}"
+
+        return json.dumps({"next_response": next_response, "triagem_data": triagem}, ensure_ascii=False)
+
+    async def _prompt_tokens(self, prompt: Prompt) -> tuple[int, int]:
+        """(tokens de entrada, dos quais em cache); um contexto vencido é recusado como no Gemini."""
+        cached = await self._cached_prefix(prompt)
+        tokens_in = estimate_tokens(prompt.as_text())
+        entry = self.cached_prefixes.get(cached) if cached is not None else None
+        if entry is None or entry[0] < time.monotonic() or entry[1] != prompt.system:
+            if cached is not None:
+                self.prefix_cache.drop(cached)
+            return tokens_in, 0
+        return tokens_in, estimate_tokens(prompt.system)
+
+    async def generate(self, prompt: Prompt) -> str:
+        tokens_in, tokens_cached = await self._prompt_tokens(prompt)
+        await asyncio.sleep(self._delay(tokens_in - tokens_cached))
+        text = self._faulty_respond(prompt)
+        record_tokens(tokens_in, estimate_tokens(text), tokens_cached)
+        return text
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        # A latência fica toda no primeiro pedaço (tempo até o primeiro token)
+        tokens_in, tokens_cached = await self._prompt_tokens(prompt)
+        await asyncio.sleep(self._delay(tokens_in - tokens_cached))
+        text = self._faulty_respond(prompt)
+        for start in range(0, len(text), self.chunk_size):
+            yield text[start:start + self.chunk_size]
+            await asyncio.sleep(0)
+        record_tokens(tokens_in, estimate_tokens(text), tokens_cached)
+
+    async def create_cached_prefix(self, system: str, ttl: float) -> str:
+        self._cache_seq += 1
+        name = f"cachedContents/stub-{self._cache_seq}"
+        self.cached_prefixes[name] = (time.monotonic() + ttl, system)
+        return name
+
+    async def refresh_cached_prefix(self, name: str, ttl: float) -> None:
+        entry = self.cached_prefixes.get(name)
+        if entry is None or entry[0] < time.monotonic():
+            raise LookupError(f"contexto em cache não encontrado: {name}")
+        self.cached_prefixes[name] = (time.monotonic() + ttl, entry[1])
+
+    async def delete_cached_prefix(self, name: str) -> None:
+        self.cached_prefixes.pop(name, None)
+
+# Resposta gravada do turno em replay (ver ReplayProvider). Fica no contexto da
+# execução, para vários chats serem refeitos ao mesmo tempo no mesmo processo.
+REPLAY_RESPONSE: ContextVar[Optional[str]] = ContextVar("replay_response", default=None)
+
+class ReplayProvider(LLMProvider):
+    """
+    LLM de replay (benchmarks.replay): devolve a resposta bruta gravada para o
+    turno em andamento, lida de REPLAY_RESPONSE, depois de `latency` segundos e
+    sem rede. Um turno sem resposta gravada recebe `next_response` vazio e é
+    contado em `misses`. `calls` e `tokens_in` acumulam as chamadas e o tamanho
+    estimado dos prompts.
+    """
+
+    def __init__(self, latency: float = 0.0, chunk_size: int = 16):
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.misses = 0
+        self.tokens_in = 0
+
+    async def _respond(self, prompt: Prompt) -> str:
+        self.calls += 1
+        tokens_in = estimate_tokens(prompt.as_text())
+        self.tokens_in += tokens_in
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = REPLAY_RESPONSE.get()
+        if text is None:
+            self.misses += 1
+            text = json.dumps({"next_response": ""})
+        record_tokens(tokens_in, estimate_tokens(text))
+        return text
+
+    async def generate(self, prompt: Prompt) -> str:
+        return await self._respond(prompt)
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        text = await self._respond(prompt)
+        for start in range(0, len(text), self.chunk_size):
+            yield text[start:start + self.chunk_size]
+            await asyncio.sleep(0)
+
+def create_llm_provider(model: str, response_schema=None) -> LLMProvider:
+    """
+    Provedor configurado em LLM_PROVIDER; `response_schema` liga o modo JSON (se
+    LLM_JSON_MODE) e LLM_PREFIX_CACHE, o cache da instrução de sistema.
+    """
+    if LLM_PROVIDER == "stub":
+        seed = int(LLM_STUB_SEED) if LLM_STUB_SEED is not None else None
+        provider = StubProvider(
+            LLM_STUB_LATENCY_S,
+            LLM_STUB_JITTER_S,
+            seed,
+            error_rate=LLM_STUB_ERROR_RATE,
+            malformed_rate=LLM_STUB_MALFORMED_RATE,
+            slow_rate=LLM_STUB_SLOW_RATE,
+            slow_s=LLM_STUB_SLOW_S,
+            prefill_s_per_ktok=LLM_STUB_PREFILL_S_PER_KTOK,
+        )
+    elif LLM_PROVIDER == "gemini":
+        provider = GeminiProvider(model, response_schema=response_schema if LLM_JSON_MODE else None)
+    else:
+        raise ValueError(f"LLM_PROVIDER desconhecido: {LLM_PROVIDER}")
+    if LLM_PREFIX_CACHE:
+        provider.prefix_cache = PromptPrefixCache(
+            provider, LLM_PREFIX_CACHE_TTL_S, LLM_PREFIX_CACHE_REFRESH_S, provider.min_cached_tokens
+        )
+    return provider
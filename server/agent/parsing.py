@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+from typing import Any, Dict
+
+import orjson
+from pydantic import TypeAdapter, ValidationError
+from pydantic_core import from_json
+
+from database.models import ModelReply
+
+# Validador compilado uma vez; valida direto do texto, sem montar um dict antes
+REPLY_ADAPTER = TypeAdapter(ModelReply)
+
+class ModelOutputError(ValueError):
+    """Resposta do LLM que não pôde ser interpretada; `reason` é api, json ou schema."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+@dataclass
+class ParsedReply:
+    reply: ModelReply
+    partial: bool = False  # recuperada de um JSON incompleto (resposta cortada)
+
+def extract_json_object(text: str) -> str:
+    """
+    Trecho do texto que contém o objeto JSON: do primeiro `{` ao último `}`,
+    descartando cercas Markdown e texto em volta. Sem `}` de fechamento (resposta
+    cortada), vai até o fim.
+    """
+    start = text.find("{")
+    if start < 0:
+        return text.strip()
+    end = text.rfind("}")
+    return text[start:end + 1] if end > start else text[start:]
+
+def parse_model_output(text: str, tolerant: bool = True) -> ParsedReply:
+    """
+    Interpreta a saída do LLM como ModelReply.
+
+    1. Caminho rápido: o texto inteiro já é o JSON (modo JSON do Gemini, stub).
+    2. Extrai o objeto de cercas Markdown/texto extra e decodifica com orjson.
+    3. Com `tolerant`, recupera o que der de um JSON cortado: strings e campos
+       incompletos são descartados, e a resposta só vale se `next_response` veio inteiro.
+    """
+    if text.startswith("{"):
+        try:
+            return ParsedReply(REPLY_ADAPTER.validate_json(text))
+        except ValidationError:
+            pass
+
+    candidate = extract_json_object(text)
+    partial = False
+    try:
+        data = orjson.loads(candidate)
+    except orjson.JSONDecodeError as e:
+        if not tolerant:
+            raise ModelOutputError("json", str(e)) from e
+        try:
+            data = from_json(candidate, allow_partial=True)
+        except ValueError:
+            raise ModelOutputError("json", str(e)) from e
+        partial = True
+
+    try:
+        return ParsedReply(REPLY_ADAPTER.validate_python(data), partial)
+    except ValidationError as e:
+        raise ModelOutputError("json" if partial else "schema", str(e)) from e
+
+def merge_triagem(previous: Dict[str, Any], parsed: ParsedReply) -> Dict[str, Any]:
+    """
+    Triagem do turno: a devolvida pelo modelo ou, se ela não veio, a anterior.
+    De uma resposta cortada só valem os campos que chegaram inteiros.
+    """
+    triagem = parsed.reply.triagem_data
+    if triagem is None:
+        return previous
+    if parsed.partial:
+        return {**previous, **triagem.model_dump(include=triagem.model_fields_set)}
+    return triagem.model_dump()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from agent.cache import prompt_version
+from agent.context import estimate_tokens
+from observability import LLM_PREFIX_CACHE_EVENTS
+
+logger = logging.getLogger(__name__)
+
+class PromptPrefixCache:
+    """
+    Ciclo de vida da instrução de sistema registrada como contexto em cache no
+    provedor (o prefixo igual em todos os turnos, que assim não é reprocessado):
+
+    - criação na primeira chamada, com validade de `ttl` segundos;
+    - renovação do prazo quando faltam menos de `refresh_margin` segundos;
+    - troca quando a versão do prompt muda (o texto foi editado): o contexto
+      antigo é apagado e um novo é criado.
+
+    Sem contexto em cache, `name_for` devolve None e a chamada segue com a
+    instrução inline: prefixos menores que `min_tokens` (o provedor recusaria)
+    e falhas na criação, que só é tentada de novo após `retry_after` segundos.
+    """
+
+    def __init__(self, provider, ttl: float, refresh_margin: float, min_tokens: int = 0, retry_after: float = 60.0):
+        self.provider = provider
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl / 2)
+        self.min_tokens = min_tokens
+        self.retry_after = retry_after
+        self.name: Optional[str] = None
+        self.version: Optional[str] = None
+        self.expires_at = 0.0
+        self._retry_at = 0.0
+        self._skipped_version: Optional[str] = None
+        self._lock = asyncio.Lock()
+
+    def _fresh(self, version: str) -> bool:
+        return self.name is not None and self.version == version and time.monotonic() < self.expires_at - self.refresh_margin
+
+    async def name_for(self, system: str) -> Optional[str]:
+        """Nome do contexto em cache com `system`, criando, renovando ou trocando se preciso."""
+        version = prompt_version(system)
+        if self._fresh(version):
+            return self.name
+        if version == self._skipped_version:
+            return None
+
+        async with self._lock:
+            if self._fresh(version):
+                return self.name
+            if self.name is not None and self.version != version:
+                await self.invalidate()
+            if self.name is not None and await self._refresh():
+                return self.name
+            if estimate_tokens(system) < self.min_tokens:
+                self._skipped_version = version
+                LLM_PREFIX_CACHE_EVENTS.labels(event="skip").inc()
+                logger.info("Instrução de sistema menor que o mínimo do cache do provedor (%d tokens); segue inline", self.min_tokens)
+                return None
+            if time.monotonic() < self._retry_at:
+                return None
+            return await self._create(system, version)
+
+    async def _create(self, system: str, version: str) -> Optional[str]:
+        try:
+            self.name = await self.provider.create_cached_prefix(system, self.ttl)
+        except Exception as e:
+            self._retry_at = time.monotonic() + self.retry_after
+            LLM_PREFIX_CACHE_EVENTS.labels(event="error").inc()
+            logger.warning("Falha ao criar o contexto em cache da instrução de sistema: %r", e)
+            return None
+        self.version = version
+        self.expires_at = time.monotonic() + self.ttl
+        LLM_PREFIX_CACHE_EVENTS.labels(event="create").inc()
+        logger.info("Instrução de sistema em cache: %s (versão %s)", self.name, version)
+        return self.name
+
+    async def _refresh(self) -> bool:
+        """Renova o prazo do contexto atual; se o provedor recusar, ele é esquecido."""
+        try:
+            await self.provider.refresh_cached_prefix(self.name, self.ttl)
+        except Exception as e:
+            LLM_PREFIX_CACHE_EVENTS.labels(event="error").inc()
+            logger.warning("Falha ao renovar o contexto em cache %s: %r", self.name, e)
+            self.name = None
+            return False
+        self.expires_at = time.monotonic() + self.ttl
+        LLM_PREFIX_CACHE_EVENTS.labels(event="refresh").inc()
+        return True
+
+    def drop(self, name: str) -> None:
+        """O provedor recusou o contexto numa chamada (venceu, foi apagado): cria outro na próxima."""
+        if self.name == name:
+            self.name = None
+            LLM_PREFIX_CACHE_EVENTS.labels(event="drop").inc()
+
+    async def invalidate(self) -> None:
+        """Apaga o contexto atual no provedor (troca de versão, encerramento do processo)."""
+        name, self.name = self.name, None
+        if name is None:
+            return
+        LLM_PREFIX_CACHE_EVENTS.labels(event="invalidate").inc()
+        try:
+            await self.provider.delete_cached_prefix(name)
+        except Exception as e:
+            # Sem o delete, o contexto some sozinho quando o prazo vence
+            logger.warning("Falha ao apagar o contexto em cache %s: %r", name, e)
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import math
+import sys
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from agent.concurrency import LLMUnavailable
+from agent.llm import LLMProvider, Prompt, TransientLLMError
+from observability import LLM_CIRCUIT_OPEN, LLM_LATENCY, LLM_RESILIENCE_EVENTS
+
+logger = logging.getLogger(__name__)
+
+def is_transient(exc: BaseException) -> bool:
+    """Erros em que vale tentar de novo: timeout, rede, sobrecarga (429) e 5xx do provedor."""
+    if isinstance(exc, (asyncio.TimeoutError, TransientLLMError, httpx.TransportError)):
+        return True
+    # O SDK do Gemini só é importado pelo GeminiProvider: se não está carregado, o erro não é dele
+    genai_errors = sys.modules.get("google.genai.errors")
+    if genai_errors is None:
+        return False
+    if isinstance(exc, genai_errors.ServerError):
+        return True
+    return isinstance(exc, genai_errors.ClientError) and exc.code == 429
+
+class LatencyTracker:
+    """Janela das latências mais recentes do LLM, para o atraso do hedge (p95)."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """None enquanto não houver amostras suficientes."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+class CircuitBreaker:
+    """
+    Depois de `failure_threshold` falhas seguidas o circuito abre e as chamadas
+    falham na hora (LLMUnavailable) por `reset_timeout` segundos. Passado o prazo,
+    uma única chamada de teste é liberada: sucesso fecha o circuito, falha
+    passageira reabre. Qualquer outro desfecho do teste (erro não passageiro,
+    cancelamento) só o encerra com `end_trial`, e a próxima chamada vira o teste.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self) -> bool:
+        """Levanta LLMUnavailable com o circuito aberto; True se esta chamada é o teste."""
+        if self.opened_at is None:
+            return False
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining <= 0 and not self._trial_in_flight:
+            # Meio aberto: esta chamada é o teste
+            self._trial_in_flight = True
+            return True
+        LLM_RESILIENCE_EVENTS.labels(event="circuit_open").inc()
+        raise LLMUnavailable(
+            "O serviço do modelo está indisponível. Tente novamente em instantes.",
+            retry_after=max(1, math.ceil(remaining)),
+        )
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        LLM_CIRCUIT_OPEN.set(0)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._trial_in_flight:
+                logger.warning("Circuit breaker do LLM aberto após %d falhas seguidas", self.failures)
+            self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+            LLM_CIRCUIT_OPEN.set(1)
+
+    def end_trial(self) -> None:
+        """Libera o teste que não terminou em sucesso nem em falha passageira (o circuito segue aberto)."""
+        self._trial_in_flight = False
+
+class LLMCallPolicy:
+    """
+    Política das chamadas ao LLM em volta de um LLMProvider:
+
+    - prazo por tentativa (`timeout`);
+    - novas tentativas com backoff exponencial e jitter (tenacity) só em erros passageiros;
+    - hedge opcional: se a primeira chamada passar do p95 recente, dispara uma
+      segunda e fica com a primeira resposta válida;
+    - uma tentativa de reparo quando a resposta não passa na validação (JSON
+      inválido), com o prompt devolvido por `repair_prompt`;
+    - circuit breaker, que corta as chamadas enquanto o provedor está fora.
+    """
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        *,
+        timeout: float,
+        max_attempts: int,
+        backoff: float,
+        backoff_max: float,
+        hedge: bool,
+        hedge_delay: float,
+        breaker: CircuitBreaker,
+        repair: bool = True,
+    ):
+        self.provider = provider
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker
+        self.repair = repair
+        self.latencies = LatencyTracker()
+
+    def _retrying(self, retry_if: Callable[[BaseException], bool]) -> AsyncRetrying:
+        def before_sleep(retry_state):
+            LLM_RESILIENCE_EVENTS.labels(event="retry").inc()
+            logger.info("Nova tentativa de chamada ao LLM (%d): %s", retry_state.attempt_number, retry_state.outcome.exception())
+
+        return AsyncRetrying(
+            stop=stop_after_attempt(self.max_attempts),
+            wait=wait_random_exponential(multiplier=self.backoff, max=self.backoff_max),
+            retry=retry_if_exception(retry_if),
+            before_sleep=before_sleep,
+            reraise=True,
+        )
+
+    def _record_failure(self, exc: BaseException, mode: str, start: float) -> None:
+        timed_out = isinstance(exc, asyncio.TimeoutError)
+        if timed_out:
+            LLM_RESILIENCE_EVENTS.labels(event="timeout").inc()
+        LLM_LATENCY.labels(mode=mode, outcome="timeout" if timed_out else "error").observe(time.perf_counter() - start)
+        if is_transient(exc):
+            self.breaker.record_failure()
+
+    async def _call(self, prompt: Prompt) -> str:
+        """Uma chamada com prazo, registrada no breaker e nas métricas."""
+        trial = self.breaker.check()
+        start = time.perf_counter()
+        try:
+            try:
+                text = await asyncio.wait_for(self.provider.generate(prompt), self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._record_failure(e, "generate", start)
+                raise
+            elapsed = time.perf_counter() - start
+            LLM_LATENCY.labels(mode="generate", outcome="ok").observe(elapsed)
+            self.latencies.record(elapsed)
+            self.breaker.record_success()
+            return text
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    def _hedge_delay(self) -> float:
+        p95 = self.latencies.percentile(95)
+        return p95 if p95 is not None else self.hedge_delay
+
+    async def _hedged_call(self, prompt: Prompt, validate: Callable[[str], bool]) -> str:
+        if not self.hedge:
+            return await self._call(prompt)
+
+        first = asyncio.create_task(self._call(prompt))
+        done, _ = await asyncio.wait({first}, timeout=self._hedge_delay())
+        if done:
+            return first.result()
+
+        LLM_RESILIENCE_EVENTS.labels(event="hedge").inc()
+        pending = {first, asyncio.create_task(self._call(prompt))}
+        fallback: Optional[str] = None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif validate(task.result()):
+                        return task.result()
+                    else:
+                        fallback = task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        if fallback is not None:
+            return fallback
+        raise error
+
+    async def generate(
+        self,
+        prompt: Prompt,
+        validate: Callable[[str], bool],
+        repair_prompt: Callable[[Prompt, str], Prompt],
+    ) -> str:
+        """Resposta do LLM para o prompt; levanta a última exceção se todas as tentativas falharem."""
+        async for attempt in self._retrying(is_transient):
+            with attempt:
+                text = await self._hedged_call(prompt, validate)
+
+        if self.repair and not validate(text):
+            LLM_RESILIENCE_EVENTS.labels(event="repair").inc()
+            try:
+                repaired = await self._call(repair_prompt(prompt, text))
+            except LLMUnavailable:
+                raise
+            except Exception as e:
+                logger.warning("Falha na chamada de reparo do JSON: %s", e)
+                return text
+            if validate(repaired):
+                return repaired
+        return text
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        """
+        Pedaços da resposta em stream. O prazo vale para a resposta inteira; nova
+        tentativa só se a falha vier antes do primeiro pedaço (depois disso o
+        texto já foi enviado ao cliente).
+        """
+        emitted = False
+        async for attempt in self._retrying(lambda e: is_transient(e) and not emitted):
+            with attempt:
+                trial = self.breaker.check()
+                try:
+                    start = time.perf_counter()
+                    deadline = start + self.timeout
+                    chunks = self.provider.stream(prompt)
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), deadline - time.perf_counter())
+                            except StopAsyncIteration:
+                                break
+                            emitted = True
+                            yield chunk
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        self._record_failure(e, "stream", start)
+                        raise
+                    finally:
+                        await chunks.aclose()
+                    elapsed = time.perf_counter() - start
+                    LLM_LATENCY.labels(mode="stream", outcome="ok").observe(elapsed)
+                    self.latencies.record(elapsed)
+                    self.breaker.record_success()
+                finally:
+                    # Cliente que desistiu do stream (GeneratorExit) também encerra o teste
+                    if trial:
+                        self.breaker.end_trial()
@@ -0,0 +1,101 @@
+import json
+import re
+
+# Trechos sem aspas nem barra invertida podem ser copiados de uma vez
+_PLAIN_RUN = re.compile(r'[^"\\]+')
+_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class JsonStringFieldStreamer:
+    """
+    Extrai incrementalmente o valor de um campo string de um objeto JSON que
+    ainda está chegando em pedaços (ex.: `next_response` na saída em stream do LLM).
+
+    Cada chamada a `feed` devolve apenas o texto novo já decodificado do campo,
+    segurando escapes incompletos até que o restante chegue.
+    """
+
+    def __init__(self, field: str):
+        self._key = json.dumps(field)
+        self._buffer = ""
+        self._pos = 0
+        self._state = "key"
+        self.value = ""
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        out = []
+        buffer = self._buffer
+
+        while self._state != "done":
+            if self._state == "key":
+                idx = buffer.find(self._key, self._pos)
+                if idx < 0:
+                    # Mantém o final do buffer: a chave pode estar cortada entre pedaços
+                    self._pos = max(self._pos, len(buffer) - len(self._key) + 1)
+                    break
+                self._pos = idx + len(self._key)
+                self._state = "colon"
+
+            elif self._state in ("colon", "open"):
+                while self._pos < len(buffer) and buffer[self._pos].isspace():
+                    self._pos += 1
+                if self._pos >= len(buffer):
+                    break
+                char = buffer[self._pos]
+                if self._state == "colon":
+                    # Sem ':' a ocorrência era um valor, não a chave; continua procurando
+                    self._state = "open" if char == ":" else "key"
+                    self._pos += 1 if char == ":" else 0
+                elif char == '"':
+                    self._state = "value"
+                    self._pos += 1
+                else:
+                    # O campo existe, mas não é uma string
+                    self._state = "done"
+
+            else:  # value
+                if self._pos >= len(buffer):
+                    break
+                match = _PLAIN_RUN.match(buffer, self._pos)
+                if match:
+                    out.append(match.group())
+                    self._pos = match.end()
+                    continue
+                char = buffer[self._pos]
+                if char == '"':
+                    self._state = "done"
+                    self._pos += 1
+                    break
+                decoded, consumed = self._decode_escape(buffer, self._pos)
+                if consumed == 0:
+                    break  # escape incompleto, espera o próximo pedaço
+                out.append(decoded)
+                self._pos += consumed
+
+        text = "".join(out)
+        self.value += text
+        return text
+
+    @staticmethod
+    def _decode_escape(buffer: str, pos: int) -> tuple[str, int]:
+        """Decodifica o escape em `pos`. Retorna (texto, caracteres consumidos); 0 se incompleto."""
+        if pos + 1 >= len(buffer):
+            return "", 0
+        kind = buffer[pos + 1]
+        if kind != "u":
+            return _SIMPLE_ESCAPES.get(kind, kind), 2
+        if pos + 6 > len(buffer):
+            return "", 0
+        code = int(buffer[pos + 2:pos + 6], 16)
+        if 0xD800 <= code < 0xDC00:
+            # Par substituto (ex.: emojis): precisa do segundo \uXXXX
+            if pos + 12 > len(buffer):
+                return "", 0
+            if buffer[pos + 6:pos + 8] == "\\u":
+                low = int(buffer[pos + 8:pos + 12], 16)
+                return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), 12
+        return chr(code), 6
@@ -0,0 +1,63 @@
+"""
+Benchmark de carga: vazão de requisições concorrentes com acesso ao banco
+bloqueante (equivalente ao MongoClient síncrono) vs. assíncrono (AsyncMongoClient).
+
+Usa o InMemoryChatRepository com latência simulada, então não precisa de
+MongoDB nem de chave de API. Rode a partir da pasta `server`:
+
+    python -m benchmarks.bench_concurrency --latency 0.005 --requests 400
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+import httpx
+
+from main import app
+from database.configurations import get_repository
+from database.memory import InMemoryChatRepository
+
+async def run_level(repo, chat_id: str, concurrency: int, total: int) -> float:
+    """Dispara `total` GETs com no máximo `concurrency` simultâneos e retorna req/s."""
+    app.dependency_overrides[get_repository] = lambda: repo
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                resp = await client.get(f"/chat-messages/{chat_id}")
+                resp.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    app.dependency_overrides.clear()
+    return total / elapsed
+
+async def main(latency: float, total: int, levels: list[int]):
+    print(f"latência simulada por operação: {latency * 1000:.1f} ms, {total} requisições por nível\n")
+    print(f"{'concorrência':>12} | {'bloqueante (req/s)':>18} | {'async (req/s)':>14} | {'ganho':>6}")
+    print("-" * 60)
+
+    for concurrency in levels:
+        results = []
+        for blocking in (True, False):
+            repo = InMemoryChatRepository(latency=latency, blocking=blocking)
+            chat_id = await repo.create_chat({"title": "bench", "messages": [{"id": 1, "text": "oi", "sender": "user"}]})
+            results.append(await run_level(repo, chat_id, concurrency, total))
+        blocking_rps, async_rps = results
+        print(f"{concurrency:>12} | {blocking_rps:>18.1f} | {async_rps:>14.1f} | {async_rps / blocking_rps:>5.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.005, help="latência simulada do Mongo em segundos")
+    parser.add_argument("--requests", type=int, default=400, help="requisições por nível de concorrência")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 10, 50, 100])
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.requests, args.levels))
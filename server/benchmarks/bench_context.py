@@ -0,0 +1,87 @@
+"""
+Medição de tokens de prompt por turno: histórico completo (antigo) vs. janela
+de contexto com resumo incremental (agent/context.py), e quanto dela fica fora
+da instrução de sistema em cache no provedor (agent/prompt_cache.py).
+
+O cache só vale se a instrução de sistema tiver ao menos o mínimo do provedor
+(LLM_PREFIX_CACHE_MIN_TOKENS, o do Gemini; --min-cached-tokens 0 simula um
+provedor sem mínimo). Abaixo dele o prompt inteiro fica fora do cache, como em
+PromptPrefixCache.
+
+Os tokens são estimados por agent.context.estimate_tokens em todos os casos. Não
+chama o LLM. Rode a partir da pasta `server`:
+
+    python -m benchmarks.bench_context --turns 15
+"""
+import argparse
+import os
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+from agent.context import estimate_tokens, format_message
+from agent.default_agent import SYSTEM_PROMPT, build_prompt
+from agent.llm import LLM_PREFIX_CACHE_MIN_TOKENS
+
+USER_TURNS = [
+    "Olá, estou com uma dor de cabeça muito forte desde segunda-feira e não melhora.",
+    "A dor fica na parte da frente da cabeça e às vezes atrás dos olhos, piora com a luz.",
+    "Começou há uns quatro dias, vem e volta várias vezes ao dia, principalmente à tarde.",
+    "Eu diria que a intensidade é 7, mas à noite chega a 8 e fica difícil dormir.",
+    "Tenho rinite e já tive enxaqueca na adolescência, mas nada tão forte quanto agora.",
+    "Tomei dipirona duas vezes por dia e tentei ficar no escuro, melhora só um pouco.",
+]
+MODEL_TEXT = (
+    "Entendi, obrigado pela informação. Para completar a triagem, pode me contar um pouco mais? "
+    "Lembre-se de que eu apenas coleto dados para agilizar a sua consulta e não substituo o médico."
+)
+
+def old_prompt_tokens(messages):
+    history = "\n".join(format_message(m) for m in messages)
+    return estimate_tokens(SYSTEM_PROMPT + "\n\nHISTÓRICO DA CONVERSA:\n" + history)
+
+def main(turns, min_cached_tokens):
+    state = {
+        "messages": [], "triagem": {"queixa_principal": "dor de cabeça"}, "resumo_confirmado": False,
+        "emergency_detected": False, "turn_count": 0, "summary": "", "summary_upto": 0,
+    }
+    totals = [0, 0, 0]
+    system_tokens = estimate_tokens(SYSTEM_PROMPT)
+    cached = system_tokens >= min_cached_tokens
+
+    print(f"{'turno':>5} | {'mensagens':>9} | {'histórico completo':>18} | {'janela + resumo':>15} | {'fora do cache':>13}")
+    print("-" * 74)
+    for turn in range(1, turns + 1):
+        messages = state["messages"] + [
+            {"id": len(state["messages"]) + 1, "text": USER_TURNS[(turn - 1) % len(USER_TURNS)], "sender": "user"}
+        ]
+        state = {**state, "messages": messages}
+
+        old = old_prompt_tokens(messages)
+        prompt, updates = build_prompt(state)
+        new = estimate_tokens(prompt.as_text())
+        uncached = estimate_tokens(prompt.dynamic_text()) if cached else new
+        totals[0] += old
+        totals[1] += new
+        totals[2] += uncached
+        print(f"{turn:>5} | {len(messages):>9} | {old:>18,} | {new:>15,} | {uncached:>13,}")
+
+        # o resumo fica salvo no estado, como no chat persistido
+        state = {**state, **updates, "messages": messages + [{"id": len(messages) + 1, "text": MODEL_TEXT, "sender": "model"}]}
+
+    print("-" * 74)
+    print(f"tokens de prompt em {turns} turnos: {totals[0]:,} -> {totals[1]:,} "
+          f"({100 * (1 - totals[1] / totals[0]):.0f}% a menos)")
+    if not cached:
+        print(f"sem cache: a instrução de sistema tem ~{system_tokens:,} tokens, abaixo do mínimo do "
+              f"provedor ({min_cached_tokens:,}); o cache de prefixo não reduz nada")
+    print(f"fora do cache: {totals[2]:,} "
+          f"({100 * (1 - totals[2] / totals[0]):.0f}% a menos que o histórico completo)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=15)
+    parser.add_argument("--min-cached-tokens", type=int, default=LLM_PREFIX_CACHE_MIN_TOKENS,
+                        help="menor instrução de sistema que o provedor guarda em cache")
+    args = parser.parse_args()
+    main(args.turns, args.min_cached_tokens)
@@ -0,0 +1,62 @@
+"""
+Micro-benchmark do detector de emergência: busca linear (`any(kw in text)`,
+como era antes) vs. KeywordMatcher compilado, variando o número de termos e o
+tamanho da mensagem. Rode a partir da pasta `server`:
+
+    python -m benchmarks.bench_emergency
+"""
+import argparse
+import json
+import os
+import random
+import string
+import timeit
+
+from agent.emergency import KeywordMatcher, normalize_text
+
+KEYWORDS_FILE = os.path.join(os.path.dirname(__file__), "..", "agent", "emergency_keywords.json")
+
+def synthetic_terms(count, rng):
+    """Termos de 2 a 4 palavras, parecidos em forma com os reais."""
+    def word():
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+    return [" ".join(word() for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+def message(length, rng):
+    """Mensagem sem nenhum termo de emergência (pior caso: percorre tudo)."""
+    words = ["estou", "com", "dor", "de", "cabeça", "há", "dias", "e", "febre", "baixa", "à", "noite"]
+    text = []
+    while sum(len(w) + 1 for w in text) < length:
+        text.append(rng.choice(words))
+    return " ".join(text)
+
+def main(term_counts, lengths, repeat):
+    rng = random.Random(42)
+    with open(KEYWORDS_FILE, encoding="utf-8") as f:
+        real_terms = [term for terms in json.load(f).values() for term in terms]
+
+    print(f"{'termos':>6} | {'mensagem':>8} | {'linear (µs)':>11} | {'compilado (µs)':>14} | {'ganho':>6}")
+    print("-" * 58)
+    for count in term_counts:
+        terms = real_terms + synthetic_terms(max(0, count - len(real_terms)), rng)
+        matcher = KeywordMatcher({"bench": terms})
+        normalized_terms = [normalize_text(term) for term in terms]
+
+        for length in lengths:
+            text = message(length, rng)
+
+            def linear():
+                lowered = normalize_text(text)
+                return any(kw in lowered for kw in normalized_terms)
+
+            linear_us = min(timeit.repeat(linear, number=repeat, repeat=3)) / repeat * 1e6
+            compiled_us = min(timeit.repeat(lambda: matcher.search(text), number=repeat, repeat=3)) / repeat * 1e6
+            print(f"{len(terms):>6} | {length:>8} | {linear_us:>11.1f} | {compiled_us:>14.1f} | {linear_us / compiled_us:>5.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--terms", type=int, nargs="+", default=[28, 300, 1000])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.terms, args.lengths, args.repeat)
@@ -0,0 +1,107 @@
+"""
+Custo por turno do histórico embutido no chat (array `messages` em chat_data,
+antigo) vs. buckets na coleção chat_messages, com 10, 100 e 1000 mensagens já
+no histórico.
+
+Um turno é o caminho de /send seguido da busca incremental do app
+(/chat-messages?since=...):
+
+- antigo: findOneAndUpdate que devolve o chat inteiro, $push da resposta e
+  leitura do trecho novo com $slice;
+- buckets: findOneAndUpdate só nos metadados, $push da mensagem no bucket,
+  $push da resposta + $set nos metadados e leitura do contador + bucket filtrado.
+
+Mede em BSON os bytes devolvidos ao app, os bytes dos documentos reescritos pelo
+MongoDB (cada atualização regrava o documento inteiro) e o número de operações,
+na média dos turnos que enchem um bucket (o custo dos buckets depende de quão
+cheio está o bucket atual). Não precisa de MongoDB. Rode a partir da pasta `server`:
+
+    python -m benchmarks.bench_messages --sizes 10 100 1000
+"""
+import argparse
+
+import bson
+from bson import ObjectId
+
+from database.repository import MESSAGES_BUCKET_SIZE, bucket_seq
+
+USER_TEXT = "Estou com dor de cabeça forte há três dias, piora à noite e com a luz. " * 2
+MODEL_TEXT = "Entendi. Numa escala de 0 a 10, qual a intensidade da dor? Você tomou algum remédio? " * 2
+TRIAGEM = {
+    "queixa_principal": "dor de cabeça", "sintomas_detalhados": "latejante, piora com luz",
+    "duracao_frequencia": "3 dias", "intensidade": "7", "historico_relevante": "rinite",
+    "medidas_tomadas": "dipirona", "emergency_alert": False,
+}
+
+def message(msg_id):
+    return {"id": msg_id, "text": USER_TEXT if msg_id % 2 else MODEL_TEXT, "sender": "user" if msg_id % 2 else "model"}
+
+def metadata(chat_id, size):
+    return {
+        "_id": chat_id, "title": "Triagem", "is_completed": False, "creation": 1700000000,
+        "triagem": TRIAGEM, "turn_count": size // 2, "summary": "", "summary_upto": 0,
+        "message_seq": size, "lastMessage": message(size)["text"],
+    }
+
+def embedded_turn(size):
+    """(bytes lidos, bytes reescritos, operações) de um turno com o histórico no chat."""
+    chat_id = ObjectId()
+    chat = {**metadata(chat_id, size), "messages": [message(i) for i in range(1, size + 1)]}
+    user, reply = message(size + 1), message(size + 2)
+
+    after_append = {**chat, "messages": chat["messages"] + [user], "message_seq": size + 1}
+    after_turn = {**after_append, "messages": after_append["messages"] + [reply], "message_seq": size + 2}
+    read = len(bson.encode(after_append))  # findOneAndUpdate devolve o chat inteiro
+    read += len(bson.encode({"message_seq": size + 2, "messages": [reply]}))  # $slice da busca incremental
+    rewritten = len(bson.encode(after_append)) + len(bson.encode(after_turn))
+    return read, rewritten, 3
+
+def bucket_doc(chat_id, seq, last_id):
+    first = seq * MESSAGES_BUCKET_SIZE + 1
+    messages = [message(i) for i in range(first, last_id + 1)]
+    return {"_id": ObjectId(), "chat_id": chat_id, "seq": seq, "count": len(messages), "messages": messages}
+
+def bucketed_turn(size):
+    """(bytes lidos, bytes reescritos, operações) de um turno com o histórico em buckets."""
+    chat_id = ObjectId()
+    user_id, reply_id = size + 1, size + 2
+    after_append = {**metadata(chat_id, size), "message_seq": user_id, "lastMessage": USER_TEXT}
+    after_turn = {**after_append, "message_seq": reply_id, "lastMessage": MODEL_TEXT}
+
+    read = len(bson.encode(after_append))  # findOneAndUpdate devolve só os metadados
+    read += len(bson.encode({"message_seq": reply_id}))  # contador da busca incremental
+    read += len(bson.encode({"messages": [message(reply_id)]}))  # bucket filtrado pelo since
+
+    rewritten = len(bson.encode(bucket_doc(chat_id, bucket_seq(user_id), user_id)))
+    rewritten += len(bson.encode(bucket_doc(chat_id, bucket_seq(reply_id), reply_id)))
+    rewritten += len(bson.encode(after_append)) + len(bson.encode(after_turn))
+    return read, rewritten, 6
+
+def averaged(turn, size):
+    """Média de um turno ao longo dos turnos que enchem um bucket, a partir de `size` mensagens."""
+    costs = [turn(start) for start in range(size, size + MESSAGES_BUCKET_SIZE, 2)]
+    return tuple(sum(cost[i] for cost in costs) / len(costs) for i in range(3))
+
+def main(sizes):
+    print(f"{'mensagens':>9} | {'layout':<9} | {'lidos/turno (B)':>15} | {'reescritos/turno (B)':>20} | "
+          f"{'ops/turno':>9} | {'maior doc (B)':>13}")
+    print("-" * 92)
+    for size in sizes:
+        chat_id = ObjectId()
+        embedded_doc = len(bson.encode({**metadata(chat_id, size), "messages": [message(i) for i in range(1, size + 1)]}))
+        largest_bucket = max(
+            len(bson.encode(bucket_doc(chat_id, seq, min(size, (seq + 1) * MESSAGES_BUCKET_SIZE))))
+            for seq in range(bucket_seq(max(size, 1)) + 1)
+        )
+        for layout, turn, largest in (
+            ("embutido", embedded_turn, embedded_doc),
+            ("buckets", bucketed_turn, max(largest_bucket, len(bson.encode(metadata(chat_id, size))))),
+        ):
+            read, rewritten, ops = averaged(turn, size)
+            print(f"{size:>9} | {layout:<9} | {read:>15,.0f} | {rewritten:>20,.0f} | {ops:>9.0f} | {largest:>13,}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+    main(args.sizes)
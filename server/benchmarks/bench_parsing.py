@@ -0,0 +1,88 @@
+"""
+Interpretação da saída do LLM: caminho antigo (remove a cerca ```json na mão,
+json.loads e .get) vs. agent.parsing (validador pydantic compilado, orjson e
+recuperação de JSON cortado), sobre o corpus em benchmarks/corpus/llm_responses.jsonl.
+
+O corpus tem as respostas do roteiro da triagem em JSON puro e nas formas
+problemáticas que aparecem na saída do modelo: cercas Markdown, texto antes ou
+depois, intensidade como número, campos faltando e respostas cortadas.
+
+Mostra, por tipo de resposta, quantas viram turno perdido (mensagem de erro ao
+paciente) em cada caminho e o custo médio por resposta. Rode a partir da pasta `server`:
+
+    python -m benchmarks.bench_parsing
+"""
+import argparse
+import json
+import os
+import timeit
+from collections import defaultdict
+
+from agent.parsing import ModelOutputError, parse_model_output
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), "corpus", "llm_responses.jsonl")
+
+def old_clean_json_string(text):
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+def old_parse(text):
+    """Como era: turno perdido se o JSON não decodifica ou se falta `next_response`."""
+    try:
+        data = json.loads(old_clean_json_string(text))
+        return "next_response" in data
+    except Exception:
+        return False
+
+def new_parse(text):
+    try:
+        return not parse_model_output(text).partial or "partial"
+    except ModelOutputError:
+        return False
+
+def main(repeat):
+    with open(CORPUS_FILE, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f]
+
+    by_kind = defaultdict(list)
+    for row in corpus:
+        by_kind[row["kind"]].append(row["text"])
+
+    print(f"{'tipo':<22} | {'n':>3} | {'perdidos antes':>14} | {'perdidos agora':>14} | {'recuperados':>11} | "
+          f"{'antes (µs)':>10} | {'agora (µs)':>10}")
+    print("-" * 106)
+    totals = [0, 0, 0]
+    for kind, texts in by_kind.items():
+        old_lost = sum(not old_parse(text) for text in texts)
+        results = [new_parse(text) for text in texts]
+        new_lost = sum(result is False for result in results)
+        partial = sum(result == "partial" for result in results)
+        totals[0] += old_lost
+        totals[1] += new_lost
+        totals[2] += partial
+
+        def run_old():
+            for text in texts:
+                old_parse(text)
+
+        def run_new():
+            for text in texts:
+                new_parse(text)
+
+        old_us = min(timeit.repeat(run_old, number=repeat, repeat=3)) / repeat / len(texts) * 1e6
+        new_us = min(timeit.repeat(run_new, number=repeat, repeat=3)) / repeat / len(texts) * 1e6
+        print(f"{kind:<22} | {len(texts):>3} | {old_lost:>14} | {new_lost:>14} | {partial:>11} | "
+              f"{old_us:>10.1f} | {new_us:>10.1f}")
+
+    print("-" * 106)
+    print(f"{'total':<22} | {len(corpus):>3} | {totals[0]:>14} | {totals[1]:>14} | {totals[2]:>11} |")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+    main(args.repeat)
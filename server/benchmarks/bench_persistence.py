@@ -0,0 +1,169 @@
+"""
+Benchmark de escrita por turno: bytes do documento de atualização enviado ao
+MongoDB com o $set do histórico completo (antigo) vs. o $push incremental.
+
+A segunda tabela roda os turnos no grafo de verdade (com o stub no lugar do
+Gemini) e mede o que o MongoCheckpointSaver grava nas coleções `checkpoints`,
+`checkpoint_blobs` e `checkpoint_writes`: bytes e operações por turno e o que
+fica guardado por chat. Os deletes da poda entram só na contagem de operações.
+
+O tamanho é medido em BSON, o mesmo formato que trafega na rede e vai para o
+oplog. Não precisa de MongoDB. Rode a partir da pasta `server`:
+
+    python -m benchmarks.bench_persistence --turns 100
+"""
+import argparse
+import os
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.update(LLM_PROVIDER="stub", LLM_STUB_LATENCY_S="0", LLM_STUB_JITTER_S="0", LLM_CACHE_ENABLED="false")
+
+import asyncio
+from collections import Counter
+
+import bson
+
+from agent import default_agent
+from agent.default_agent import build_turn_delta, build_update_fields
+from database.checkpoints import MongoCheckpointSaver
+from database.memory import InMemoryChatRepository, InMemoryCheckpointSaver
+
+USER_TEXT = "Estou com dor de cabeça forte há três dias, piora à noite e com a luz. " * 2
+MODEL_TEXT = "Entendi. Numa escala de 0 a 10, qual a intensidade da dor? Você tomou algum remédio? " * 2
+
+def simulate_turn(state, turn):
+    """Produz o estado após um turno: mensagem do usuário + resposta do modelo + triagem."""
+    messages = state["messages"]
+    next_id = len(messages) + 1
+    return {
+        **state,
+        "messages": messages + [
+            {"id": next_id, "text": USER_TEXT, "sender": "user"},
+            {"id": next_id + 1, "text": MODEL_TEXT, "sender": "model"},
+        ],
+        "triagem": {**state["triagem"], "intensidade": str(turn % 10)},
+        "turn_count": turn,
+    }
+
+def full_update_size(after):
+    return len(bson.encode({"$set": build_update_fields(after)}))
+
+def delta_update_size(before, after):
+    new_messages, fields = build_turn_delta(before, after)
+    update = {"$push": {"messages": {"$each": new_messages}}, "$max": {"message_seq": new_messages[-1]["id"]}}
+    if fields:
+        update["$set"] = fields
+    return len(bson.encode(update))
+
+class RecordingCollection:
+    """Coleção que só soma os bytes (BSON) das escritas que receberia."""
+
+    def __init__(self, name, written):
+        self.name = name
+        self.written = written
+
+    async def bulk_write(self, requests, ordered=True):
+        # UpdateOne não expõe o filtro e a atualização publicamente
+        self.written[self.name] += sum(len(bson.encode({"q": op._filter, "u": op._doc})) for op in requests)
+
+    async def update_one(self, filter, update, upsert=False):
+        self.written[self.name] += len(bson.encode({"q": filter, "u": update}))
+
+    async def find_one(self, *args, **kwargs):
+        # Sem o pai, o MongoCheckpointSaver não poda aqui: a poda é feita pelo checkpointer em memória
+        return None
+
+class MeasuredCheckpointSaver(InMemoryCheckpointSaver):
+    """
+    Checkpointer em memória que passa cada escrita também por um
+    MongoCheckpointSaver sobre coleções de gravação, para medir os documentos
+    que ele mandaria ao MongoDB. `ops` conta as operações (poda incluída).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.written: Counter = Counter()
+        self.mongo = MongoCheckpointSaver(
+            {name: RecordingCollection(name, self.written) for name in ("checkpoints", "checkpoint_blobs", "checkpoint_writes")},
+            serde=self.serde,
+        )
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        await self.mongo.aput(config, checkpoint, metadata, new_versions)
+        return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await self.mongo.aput_writes(config, writes, task_id, task_path)
+        await super().aput_writes(config, writes, task_id, task_path)
+
+    def stored_bytes(self, thread_id):
+        """Bytes serializados guardados para o chat (checkpoints + metadados, blobs, escritas)."""
+        checkpoints = sum(
+            len(checkpoint[1]) + len(metadata[1])
+            for checkpoint, metadata, _ in self.storage[thread_id][""].values()
+        )
+        blobs = sum(len(value[1]) for key, value in self.blobs.items() if key[0] == thread_id)
+        writes = sum(
+            len(write[2][1]) for key, task_writes in self.writes.items() if key[0] == thread_id
+            for write in task_writes.values()
+        )
+        return checkpoints + blobs + writes
+
+async def checkpoint_run(turns, report_every):
+    """Roda os turnos no grafo e imprime, por turno, o que vai para as coleções de checkpoint."""
+    saver = MeasuredCheckpointSaver()
+    default_agent.get_checkpointer = lambda: saver
+    repo = InMemoryChatRepository()
+    chat_id = await repo.create_chat({"title": "benchmark"})
+
+    print(f"{'turno':>6} | {'checkpoints (B)':>15} | {'blobs (B)':>10} | {'writes (B)':>10} | {'operações':>9} | {'guardado (B)':>12}")
+    print("-" * 78)
+    previous, previous_ops = Counter(), 0
+    for turn in range(1, turns + 1):
+        await default_agent.run_agent(chat_id, USER_TEXT, repo)
+        if turn == 1 or turn % report_every == 0:
+            written = saver.written - previous
+            ops = sum(saver.ops.values()) - previous_ops
+            print(
+                f"{turn:>6} | {written['checkpoints']:>15,} | {written['checkpoint_blobs']:>10,} | "
+                f"{written['checkpoint_writes']:>10,} | {ops:>9} | {saver.stored_bytes(chat_id):>12,}"
+            )
+        previous, previous_ops = Counter(saver.written), sum(saver.ops.values())
+
+    print("-" * 78)
+    total = sum(saver.written.values())
+    print(f"total escrito nas coleções de checkpoint em {turns} turnos: {total:,} B "
+          f"({total // turns:,} B por turno), {sum(saver.ops.values()):,} operações")
+    return total
+
+def main(turns, report_every):
+    state = {"messages": [], "triagem": {}, "resumo_confirmado": False, "emergency_detected": False, "turn_count": 0}
+    totals = [0, 0]
+
+    print(f"{'turno':>6} | {'mensagens':>9} | {'$set completo (B)':>17} | {'$push delta (B)':>15}")
+    print("-" * 58)
+    for turn in range(1, turns + 1):
+        after = simulate_turn(state, turn)
+        full, delta = full_update_size(after), delta_update_size(state, after)
+        totals[0] += full
+        totals[1] += delta
+        if turn == 1 or turn % report_every == 0:
+            print(f"{turn:>6} | {len(after['messages']):>9} | {full:>17,} | {delta:>15,}")
+        state = after
+
+    print("-" * 58)
+    print(f"total escrito em {turns} turnos: $set {totals[0]:,} B, delta {totals[1]:,} B "
+          f"({totals[0] / totals[1]:.1f}x menos)")
+
+    print()
+    checkpoints = asyncio.run(checkpoint_run(turns, report_every))
+    print(f"por turno, com os checkpoints: delta {(totals[1] + checkpoints) // turns:,} B "
+          f"(chat_data {totals[1] // turns:,} B + checkpoints {checkpoints // turns:,} B)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--report-every", type=int, default=10)
+    args = parser.parse_args()
+    main(args.turns, args.report_every)
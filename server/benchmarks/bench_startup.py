@@ -0,0 +1,107 @@
+"""
+Tempo de partida de um worker, cada medida num processo Python novo:
+
+- import de `main` (o que o uvicorn faz antes de aceitar conexões);
+- import + aquecimento (provedor do LLM e grafo compilado), o que antes era
+  feito no import;
+- `uvicorn main:app` até o /healthz responder (o worker já recebe sondas) e até
+  o /readyz responder 200 (pronto para o balanceador; exige MongoDB) e o tempo
+  de encerramento após SIGTERM.
+
+Use LLM_PROVIDER=gemini (com a chave em GOOGLE_API_KEY) para incluir o SDK do
+Gemini; sem MONGO_URI a coluna do /readyz fica vazia. Rode a partir da pasta `server`:
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+WARM_SNIPPET = (
+    "import time; t = time.perf_counter(); import main; "
+    "from agent.default_agent import get_agent_app, get_llm_policy; get_llm_policy(); get_agent_app(); "
+    "print(time.perf_counter() - t)"
+)
+
+def timed_snippet(snippet: str, env) -> float:
+    out = subprocess.run([sys.executable, "-c", snippet], env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def wait_for(url: str, deadline: float) -> bool:
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(url, timeout=0.5).status_code == 200:
+                return True
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    return False
+
+def uvicorn_run(port: int, env, ready_timeout: float):
+    """(s até /healthz, s até /readyz ou None, s de encerramento) de um `uvicorn main:app`."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        live = wait_for(f"http://127.0.0.1:{port}/healthz", start + 30)
+        live_s = time.perf_counter() - start if live else None
+        ready = live and wait_for(f"http://127.0.0.1:{port}/readyz", time.perf_counter() + ready_timeout)
+        ready_s = time.perf_counter() - start if ready else None
+    finally:
+        stop = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=60)
+    return live_s, ready_s, time.perf_counter() - stop
+
+def summary(values) -> str:
+    values = [v for v in values if v is not None]
+    if not values:
+        return f"{'—':>17}"
+    return f"{statistics.median(values) * 1000:>8.0f} ({min(values) * 1000:>5.0f})"
+
+def main(runs: int, port: int, ready_timeout: float):
+    env = {
+        **os.environ,
+        "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY", "benchmark"),
+        "MONGO_URI": os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+        "LLM_PROVIDER": os.getenv("LLM_PROVIDER", "stub"),
+        "PYTHONWARNINGS": "ignore",
+    }
+    results = {name: [] for name in ("import", "warm", "live", "ready", "shutdown")}
+    for _ in range(runs):
+        results["import"].append(timed_snippet(IMPORT_SNIPPET, env))
+        results["warm"].append(timed_snippet(WARM_SNIPPET, env))
+        live, ready, shutdown = uvicorn_run(port, env, ready_timeout)
+        results["live"].append(live)
+        results["ready"].append(ready)
+        results["shutdown"].append(shutdown)
+
+    print(f"LLM_PROVIDER={env['LLM_PROVIDER']}, {runs} execuções; mediana (mínimo) em ms\n")
+    labels = {
+        "import": "import main",
+        "warm": "import + provedor e grafo",
+        "live": "uvicorn até /healthz 200",
+        "ready": "uvicorn até /readyz 200",
+        "shutdown": "encerramento (SIGTERM)",
+    }
+    for name, label in labels.items():
+        print(f"{label:<28} | {summary(results[name])}")
+    if not any(results["ready"]):
+        print("\n/readyz não ficou pronto (MongoDB inacessível?); defina MONGO_URI para medir.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-timeout", type=float, default=5.0, help="espera máxima pelo /readyz, em segundos")
+    args = parser.parse_args()
+    main(args.runs, args.port, args.ready_timeout)
@@ -0,0 +1,215 @@
+"""
+Teste de carga ponta a ponta: muitos pacientes simulados fazendo a triagem
+completa ao mesmo tempo contra a API FastAPI, com o LLM local (StubProvider),
+o InMemoryChatRepository e o checkpointer em memória no lugar do MongoDB.
+
+Cada paciente cria o chat, abre a lista de chats e responde às perguntas até a
+triagem terminar (confirma o resumo com "sim"); uma fração relata um sintoma de
+emergência no meio. Depois de cada turno o cliente busca as mensagens novas,
+como o app faz. Mostra vazão, p50/p95/p99 por endpoint e operações de MongoDB
+por turno. Rode a partir da pasta `server`:
+
+    python -m benchmarks.load_test --patients 200 --concurrency 50 --llm-latency 0.3
+
+Com --error-rate, --malformed-rate e --slow-rate o stub injeta falhas, para ver
+a política de chamadas ao LLM (novas tentativas, reparo, hedge) sob carga.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter, defaultdict
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("CHECKPOINTER", "memory")
+
+import httpx
+
+from main import app
+from agent import default_agent
+from database.configurations import get_checkpointer, get_repository
+from database.memory import InMemoryChatRepository
+from observability import LLM_PARSE_FAILURES, LLM_RESILIENCE_EVENTS
+
+ANSWERS = [
+    "Estou com dor de cabeça",
+    "É uma dor latejante do lado direito, com enjoo",
+    "Começou há três dias e vem todas as tardes",
+    "Uns 7",
+    "Tenho enxaqueca desde a adolescência",
+    "Tomei dipirona, melhorou um pouco",
+]
+EMERGENCY_ANSWER = "Agora estou com dor no peito e falta de ar"
+CONFIRMATION = "Sim, está correto"
+MAX_TURNS = 20
+
+def percentile(values: list[float], pct: float) -> float:
+    """Percentil por posição mais próxima (valores já ordenados)."""
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, max(0, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[idx]
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+
+    async def call(self, name: str, request):
+        start = time.perf_counter()
+        resp = await request
+        self.latencies[name].append(time.perf_counter() - start)
+        if resp.status_code >= 400:
+            self.errors[f"{name} {resp.status_code}"] += 1
+        return resp
+
+async def send_stream(client, recorder: Recorder, chat_id: str, text: str) -> dict:
+    """Mensagem por /send-user e resposta por SSE em /send-model-stream."""
+    await recorder.call("POST /send-user/{chat_id}", client.post(f"/send-user/{chat_id}", json={"text": text, "sender": "user"}))
+
+    # O ASGITransport do httpx entrega o corpo inteiro de uma vez, então só o tempo total é medido
+    name = "POST /send-model-stream/{chat_id}"
+    start = time.perf_counter()
+    done = {}
+    async with client.stream("POST", f"/send-model-stream/{chat_id}") as resp:
+        event = None
+        async for line in resp.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event in ("done", "error"):
+                done = json.loads(line[6:])
+                if event == "error":
+                    recorder.errors[f"{name} {done.get('status_code')}"] += 1
+    recorder.latencies[name].append(time.perf_counter() - start)
+    return done
+
+async def patient(client, recorder: Recorder, idx: int, rng: random.Random, emergency_rate: float, stream: bool) -> int:
+    """Uma triagem completa. Retorna o número de turnos."""
+    await recorder.call("GET /chats", client.get("/chats", params={"limit": 20}))
+    resp = await recorder.call("POST /criar-chat", client.post("/criar-chat", json={"title": f"Paciente {idx}"}))
+    chat_id = resp.json()["_id"]
+
+    emergency_turn = 2 if rng.random() < emergency_rate else None
+    last_id, etag, agent_text = 0, None, ""
+    turns = 0
+    while turns < MAX_TURNS:
+        if turns == emergency_turn:
+            text = EMERGENCY_ANSWER
+        elif "podemos encerrar a triagem" in agent_text:
+            text = CONFIRMATION
+        else:
+            text = ANSWERS[min(turns, len(ANSWERS) - 1)]
+        turns += 1
+
+        if stream:
+            result = await send_stream(client, recorder, chat_id, text)
+        else:
+            resp = await recorder.call(
+                "POST /send/{chat_id}", client.post(f"/send/{chat_id}", json={"text": text, "sender": "user"})
+            )
+            result = resp.json() if resp.status_code == 200 else {}
+        if not result.get("agent_message"):
+            continue
+        agent_text = result["agent_message"]["text"]
+
+        # Busca incremental das mensagens, como a tela do chat
+        headers = {"If-None-Match": etag} if etag else {}
+        resp = await recorder.call(
+            "GET /chat-messages/{chat_id}",
+            client.get(f"/chat-messages/{chat_id}", params={"since": last_id}, headers=headers),
+        )
+        if resp.status_code == 200:
+            etag = resp.headers.get("ETag")
+            last_id = max([last_id] + [msg["id"] for msg in resp.json()])
+
+        if result.get("is_completed"):
+            break
+    return turns
+
+async def main(args):
+    repo = InMemoryChatRepository(latency=args.db_latency)
+    checkpointer = get_checkpointer()
+    checkpointer.latency = args.db_latency
+    llm_policy = default_agent.get_llm_policy()
+    llm_policy.provider.latency = args.llm_latency
+    llm_policy.provider.jitter = args.llm_jitter
+    llm_policy.provider.error_rate = args.error_rate
+    llm_policy.provider.malformed_rate = args.malformed_rate
+    llm_policy.provider.slow_rate = args.slow_rate
+    llm_policy.provider.slow_s = args.slow_s
+    llm_policy.hedge = args.hedge
+    app.dependency_overrides[get_repository] = lambda: repo
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=120) as client:
+        async def one(idx: int):
+            async with semaphore:
+                return await patient(client, recorder, idx, random.Random(rng.random()), args.emergency_rate, args.stream)
+
+        start = time.perf_counter()
+        turns = sum(await asyncio.gather(*(one(idx) for idx in range(args.patients))))
+        elapsed = time.perf_counter() - start
+
+    app.dependency_overrides.clear()
+
+    requests = sum(len(values) for values in recorder.latencies.values())
+    print(f"{args.patients} pacientes, concorrência {args.concurrency}, LLM {args.llm_latency * 1000:.0f}±{args.llm_jitter * 1000:.0f} ms, "
+          f"Mongo {args.db_latency * 1000:.1f} ms/op, modo {'stream' if args.stream else '/send'}\n")
+    print(f"tempo total: {elapsed:.1f} s | {requests / elapsed:.1f} req/s | {turns / elapsed:.1f} turnos/s | {turns} turnos\n")
+
+    print(f"{'endpoint':<46} | {'n':>6} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'p99 (ms)':>9}")
+    print("-" * 90)
+    for name, values in sorted(recorder.latencies.items()):
+        values.sort()
+        print(f"{name:<46} | {len(values):>6} | {percentile(values, 50) * 1000:>9.1f} | "
+              f"{percentile(values, 95) * 1000:>9.1f} | {percentile(values, 99) * 1000:>9.1f}")
+
+    ops = repo.ops + getattr(checkpointer, "ops", Counter())
+    print(f"\noperações de MongoDB por turno: {sum(ops.values()) / turns:.1f}")
+    for op, count in sorted(ops.items()):
+        print(f"  {op:<40} {count / turns:>6.2f}")
+
+    events = {
+        sample.labels["event"]: sample.value
+        for metric in LLM_RESILIENCE_EVENTS.collect() for sample in metric.samples
+        if sample.name.endswith("_total")
+    }
+    parse_failures = sum(
+        sample.value for metric in LLM_PARSE_FAILURES.collect() for sample in metric.samples
+        if sample.name.endswith("_total")
+    )
+    if events or parse_failures:
+        print("\npolítica de chamadas ao LLM:")
+        for event, count in sorted(events.items()):
+            print(f"  {event:<40} {count:>6.0f}")
+        print(f"  {'respostas não interpretadas':<40} {parse_failures:>6.0f}")
+
+    if recorder.errors:
+        print("\nerros:")
+        for error, count in recorder.errors.most_common():
+            print(f"  {error}: {count}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=200, help="total de pacientes simulados")
+    parser.add_argument("--concurrency", type=int, default=50, help="pacientes em triagem ao mesmo tempo")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="latência média do LLM stub em segundos")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="variação da latência do LLM stub em segundos")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="latência simulada por operação do Mongo")
+    parser.add_argument("--emergency-rate", type=float, default=0.05, help="fração de pacientes com emergência")
+    parser.add_argument("--stream", action="store_true", help="usa /send-user + /send-model-stream em vez de /send")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração das chamadas ao stub que falham (erro passageiro)")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fração das respostas do stub com JSON cortado")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fração das chamadas ao stub com latência extra")
+    parser.add_argument("--slow-s", type=float, default=5.0, help="latência extra das chamadas lentas em segundos")
+    parser.add_argument("--hedge", action="store_true", help="liga o hedge das chamadas ao LLM")
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,401 @@
+"""
+Replay offline de conversas gravadas: mede o efeito de mudanças no grafo
+(prompt, roteamento em router_emergency/router_end, parsing) em latência,
+número de turnos e acerto, sem chamar o modelo.
+
+As conversas vêm de um arquivo JSONL (--fixture) ou da coleção chat_data
+(--from-mongo, com MONGO_URI; --save-fixture grava o que foi lido para replays
+futuros). Cada uma é refeita turno a turno pelo grafo, como em /send, com o
+ReplayProvider devolvendo a resposta gravada do turno, o InMemoryChatRepository
+e o checkpointer em memória, divididas entre --workers processos. Cada
+conversa é refeita --repeat vezes e os tempos são a mediana entre as repetições.
+
+O relatório sai em JSON (stdout ou --output): tempo de cada nó do grafo (só a
+função do nó) e de cada turno (com o checkpointer e o framework),
+turnos até a conclusão, chamadas e tokens de entrada do LLM, precisão e
+revocação da detecção de emergência, preenchimento dos campos da triagem e os
+chats cujo desfecho mudou em relação ao gravado. Com --baseline (um relatório
+anterior) as métricas são comparadas e o processo sai com código 1 se alguma
+piorou (os tempos, além de --tolerance). Rode a partir da pasta `server`:
+
+    python -m benchmarks.replay --output replay.json
+    python -m benchmarks.replay --baseline replay.json
+    python -m benchmarks.replay --from-mongo --limit 500 --save-fixture conversas.jsonl
+
+Cada linha do JSONL é um chat:
+
+    {"id": "...", "messages": [{"sender": "user" | "model", "text": "...", "raw": "..."}],
+     "triagem": {...}, "status": "TRIAGE_COMPLETED" | "EMERGENCY_ALERT" | null, "emergency": true}
+
+`raw` (opcional) é a saída bruta do LLM naquele turno; sem ela, a resposta é
+montada com o texto da mensagem e, no último turno antes da confirmação, com a
+triagem gravada. `emergency` é o rótulo esperado (padrão: status EMERGENCY_ALERT).
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# O replay nunca chama o modelo nem grava no MongoDB, e o cache de respostas
+# pularia as chamadas ao LLM: estes valores não seguem o .env
+os.environ.update(LLM_PROVIDER="stub", CHECKPOINTER="memory", LLM_CACHE_ENABLED="false", LLM_PREFIX_CACHE="false")
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from bson import ObjectId
+
+from agent import default_agent
+from agent.default_agent import (
+    CONFIRMATION_MESSAGE,
+    build_turn_delta,
+    build_update_fields,
+    run_graph_turn,
+)
+from agent.llm import REPLAY_RESPONSE, ReplayProvider
+from database.memory import InMemoryChatRepository
+from database.models import Triagem
+from observability import node_timings
+
+FIXTURE_FILE = os.path.join(os.path.dirname(__file__), "corpus", "conversations.jsonl")
+TRIAGE_FIELDS = [name for name in Triagem.model_fields if name != "emergency_alert"]
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil por posição mais próxima."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[idx]
+
+def ms_summary(seconds: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(seconds),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 3) if seconds else 0.0,
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 3),
+    }
+
+def repeated_summary(samples_by_repeat: List[List[float]]) -> Dict[str, Any]:
+    """Mediana, entre as repetições, do resumo de cada uma (menos sensível ao ruído da máquina)."""
+    summaries = [ms_summary(samples) for samples in samples_by_repeat]
+    return {key: statistics.median(summary[key] for summary in summaries) for key in summaries[0]}
+
+def ratio(num: int, den: int) -> Optional[float]:
+    return round(num / den, 4) if den else None
+
+# --- Entrada ---
+
+def expected_emergency(conversation: Dict[str, Any]) -> bool:
+    if conversation.get("emergency") is not None:
+        return bool(conversation["emergency"])
+    return conversation.get("status") == "EMERGENCY_ALERT"
+
+def recorded_turns(conversation: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Tuple[List[str], Optional[str]]]]:
+    """
+    (mensagens antes da primeira fala do paciente, turnos). Cada turno são as
+    falas seguidas do paciente e a resposta bruta gravada que as seguiu (None se
+    a conversa acaba sem resposta).
+    """
+    messages = conversation.get("messages", [])
+    first_user = next((idx for idx, msg in enumerate(messages) if msg.get("sender") == "user"), len(messages))
+    initial = messages[:first_user]
+
+    turns: List[Tuple[List[str], Optional[Dict[str, Any]]]] = []
+    for msg in messages[first_user:]:
+        if msg.get("sender") == "user":
+            if not turns or turns[-1][1] is not None:
+                turns.append(([], None))
+            turns[-1][0].append(msg["text"])
+        elif turns and turns[-1][1] is None:
+            turns[-1] = (turns[-1][0], msg)
+
+    # A triagem gravada é a do último turno que passou pelo LLM (a confirmação não passa)
+    triagem_turn = max(
+        (idx for idx, (_, reply) in enumerate(turns) if reply is not None and reply.get("text") != CONFIRMATION_MESSAGE),
+        default=None,
+    )
+    replayed = []
+    for idx, (user_texts, reply) in enumerate(turns):
+        raw = None
+        if reply is not None:
+            raw = reply.get("raw")
+            if raw is None:
+                output: Dict[str, Any] = {"next_response": reply.get("text", "")}
+                if idx == triagem_turn and conversation.get("triagem"):
+                    output["triagem_data"] = conversation["triagem"]
+                raw = json.dumps(output, ensure_ascii=False)
+        replayed.append((user_texts, raw))
+    return initial, replayed
+
+def load_fixture(path: str, limit: Optional[int]) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        conversations = [json.loads(line) for line in f if line.strip()]
+    return conversations[:limit] if limit else conversations
+
+async def load_from_mongo(limit: Optional[int], status: Optional[str]) -> List[Dict[str, Any]]:
+    """Chats do chat_data, do mais novo para o mais antigo, com o histórico completo."""
+    from database.configurations import close_client, get_repository
+
+    repo = get_repository()
+    conversations: List[Dict[str, Any]] = []
+    after = None
+    try:
+        while limit is None or len(conversations) < limit:
+            page = await repo.list_chats(200, after=after, status=status)
+            if not page:
+                break
+            after = (page[-1].get("creation"), page[-1]["_id"])
+            for item in page:
+                chat = await repo.get_chat(item["_id"])
+                history = await repo.get_messages(item["_id"])
+                if chat is None or history is None:
+                    continue
+                conversations.append({
+                    "id": str(chat["_id"]),
+                    "title": chat.get("title"),
+                    "messages": [{k: msg[k] for k in ("id", "sender", "text") if k in msg} for msg in history["messages"]],
+                    "triagem": chat.get("triagem") or {},
+                    "status": chat.get("status"),
+                })
+    finally:
+        await close_client()
+    return conversations[:limit] if limit else conversations
+
+# --- Replay (nos processos do pool) ---
+
+async def replay_conversation(conversation: Dict[str, Any], repo, provider: ReplayProvider) -> Dict[str, Any]:
+    """Refaz a conversa turno a turno até ela acabar ou a triagem ser concluída."""
+    initial, turns = recorded_turns(conversation)
+    chat_id = await repo.create_chat({"title": conversation.get("title") or "replay", "messages": initial})
+    obj_id = ObjectId(chat_id)
+    calls, tokens_in, misses = provider.calls, provider.tokens_in, provider.misses
+
+    node_seconds: Dict[str, List[float]] = defaultdict(list)
+    turn_seconds: List[float] = []
+    state: Dict[str, Any] = {}
+    completed_turn = None
+    for number, (user_texts, raw) in enumerate(turns, start=1):
+        for text in user_texts:
+            chat = await repo.append_message(obj_id, {"text": text, "sender": "user"})
+
+        token = REPLAY_RESPONSE.set(raw)
+        start = time.perf_counter()
+        try:
+            with node_timings() as timings:
+                state = await run_graph_turn(chat_id, chat, repo)
+        finally:
+            REPLAY_RESPONSE.reset(token)
+        turn_seconds.append(time.perf_counter() - start)
+        for name, seconds in timings:
+            node_seconds[name].append(seconds)
+
+        await repo.save_turn(obj_id, *build_turn_delta(chat, state))
+        if state.get("resumo_confirmado"):
+            completed_turn = number
+            break
+
+    fields = build_update_fields(state)
+    return {
+        "id": conversation.get("id"),
+        "recorded_turns": len(turns),
+        "replayed_turns": len(turn_seconds),
+        "turns_to_completion": completed_turn,
+        "recorded_status": conversation.get("status"),
+        "status": fields.get("status"),
+        "emergency_expected": expected_emergency(conversation),
+        "emergency_detected": bool(fields["emergency_detected"]),
+        "emergency_category": fields["emergency_category"],
+        "triagem": fields["triagem"],
+        "llm_calls": provider.calls - calls,
+        "llm_misses": provider.misses - misses,
+        "llm_tokens_in": provider.tokens_in - tokens_in,
+        "turn_seconds": turn_seconds,
+        "node_seconds": dict(node_seconds),
+    }
+
+async def replay_batch(conversations: List[Dict[str, Any]], llm_latency: float, repeat: int) -> List[Dict[str, Any]]:
+    provider = ReplayProvider(llm_latency)
+    default_agent.get_llm_policy().provider = provider
+    repo = InMemoryChatRepository()
+    # Aquecimento fora da medida (grafo compilado, imports e caches do primeiro turno)
+    await replay_conversation(conversations[0], repo, provider)
+    # Uma conversa por vez no processo: os tempos por nó não disputam o event loop
+    results = []
+    for conversation in conversations:
+        runs = [await replay_conversation(conversation, repo, provider) for _ in range(repeat)]
+        # O replay é determinístico: o desfecho é o mesmo em todas as repetições, só os tempos mudam
+        result = runs[-1]
+        result["turn_seconds"] = [run["turn_seconds"] for run in runs]
+        result["node_seconds"] = [run["node_seconds"] for run in runs]
+        results.append(result)
+    return results
+
+def replay_worker(conversations: List[Dict[str, Any]], llm_latency: float, repeat: int) -> List[Dict[str, Any]]:
+    return asyncio.run(replay_batch(conversations, llm_latency, repeat))
+
+def replay_all(conversations: List[Dict[str, Any]], workers: int, llm_latency: float, repeat: int) -> List[Dict[str, Any]]:
+    if workers <= 1:
+        return replay_worker(conversations, llm_latency, repeat)
+    # spawn: processos limpos, sem herdar event loop nem cliente do MongoDB do processo principal
+    chunks = [chunk for chunk in (conversations[idx::workers] for idx in range(workers)) if chunk]
+    with ProcessPoolExecutor(len(chunks), mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = pool.map(replay_worker, chunks, [llm_latency] * len(chunks), [repeat] * len(chunks))
+        return [item for chunk in results for item in chunk]
+
+# --- Relatório ---
+
+def build_report(results: List[Dict[str, Any]], wall_seconds: float, workers: int, repeat: int) -> Dict[str, Any]:
+    node_names = sorted({name for r in results for run in r["node_seconds"] for name in run})
+    turn_samples = [[s for r in results for s in r["turn_seconds"][rep]] for rep in range(repeat)]
+    node_samples = {
+        name: [[s for r in results for s in r["node_seconds"][rep].get(name, [])] for rep in range(repeat)]
+        for name in node_names
+    }
+
+    completed = [r["turns_to_completion"] for r in results if r["turns_to_completion"] is not None]
+    tp = sum(r["emergency_expected"] and r["emergency_detected"] for r in results)
+    fp = sum(not r["emergency_expected"] and r["emergency_detected"] for r in results)
+    fn = sum(r["emergency_expected"] and not r["emergency_detected"] for r in results)
+
+    # Preenchimento só nas triagens concluídas sem emergência (as de emergência param no meio)
+    triages = [r["triagem"] for r in results if r["status"] == "TRIAGE_COMPLETED"]
+    filled = {name: ratio(sum(bool(str(t.get(name) or "").strip()) for t in triages), len(triages)) for name in TRIAGE_FIELDS}
+    llm_calls = sum(r["llm_calls"] for r in results)
+
+    return {
+        "conversations": len(results),
+        "workers": workers,
+        "repeat": repeat,
+        "wall_seconds": round(wall_seconds, 3),
+        "turn_latency": repeated_summary(turn_samples),
+        "nodes": {name: repeated_summary(samples) for name, samples in node_samples.items()},
+        "turns_to_completion": {
+            "completed": len(completed),
+            "completion_rate": ratio(len(completed), len(results)),
+            "mean": round(sum(completed) / len(completed), 3) if completed else None,
+            "p50": percentile(completed, 50) if completed else None,
+            "max": max(completed, default=None),
+        },
+        "llm": {
+            "calls": llm_calls,
+            "calls_per_conversation": ratio(llm_calls, len(results)),
+            "tokens_in_per_call": ratio(sum(r["llm_tokens_in"] for r in results), llm_calls),
+            "misses": sum(r["llm_misses"] for r in results),
+        },
+        "emergency": {
+            "true_positives": tp,
+            "false_positives": fp,
+            "false_negatives": fn,
+            "precision": ratio(tp, tp + fp),
+            "recall": ratio(tp, tp + fn),
+        },
+        "triage_fill_rate": {
+            "triages": len(triages),
+            "overall": round(sum(filled.values()) / len(filled), 4) if triages else None,
+            "fields": filled,
+        },
+        "outcome_changes": [
+            {"id": r["id"], "recorded": r["recorded_status"], "replayed": r["status"]}
+            for r in results if r["recorded_status"] != r["status"]
+        ],
+    }
+
+# Sentido de cada métrica comparada com a baseline
+LOWER_IS_BETTER, HIGHER_IS_BETTER = 1, -1
+
+def tracked_metrics(report: Dict[str, Any]) -> Dict[str, Tuple[Optional[float], int]]:
+    """Métricas comparadas com a baseline: valor e sentido em que ela melhora."""
+    metrics = {
+        "turn_latency.p50_ms": (report["turn_latency"]["p50_ms"], LOWER_IS_BETTER),
+        "turns_to_completion.mean": (report["turns_to_completion"]["mean"], LOWER_IS_BETTER),
+        "llm.calls_per_conversation": (report["llm"]["calls_per_conversation"], LOWER_IS_BETTER),
+        "llm.tokens_in_per_call": (report["llm"]["tokens_in_per_call"], LOWER_IS_BETTER),
+        "emergency.precision": (report["emergency"]["precision"], HIGHER_IS_BETTER),
+        "emergency.recall": (report["emergency"]["recall"], HIGHER_IS_BETTER),
+        "triage_fill_rate.overall": (report["triage_fill_rate"]["overall"], HIGHER_IS_BETTER),
+    }
+    for name, summary in report["nodes"].items():
+        metrics[f"nodes.{name}.p50_ms"] = (summary["p50_ms"], LOWER_IS_BETTER)
+    return metrics
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_ms: float) -> List[Dict[str, Any]]:
+    """
+    Métricas piores que na baseline. Os tempos (`*_ms`) têm a folga relativa
+    `tolerance`, com no mínimo `min_ms` (ruído de nós de microssegundos); o resto
+    é determinístico no replay e qualquer piora conta.
+    """
+    regressions = []
+    old_metrics = tracked_metrics(baseline)
+    for name, (new, direction) in tracked_metrics(report).items():
+        old = old_metrics.get(name, (None,))[0]
+        if old is None or new is None:
+            continue
+        allowed = max(abs(old) * tolerance, min_ms) if name.endswith("_ms") else 1e-9
+        if (new - old) * direction > allowed:
+            regressions.append({"metric": name, "baseline": old, "current": new})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--fixture", default=FIXTURE_FILE, help="JSONL com as conversas (padrão: o corpus do repositório)")
+    source.add_argument("--from-mongo", action="store_true", help="lê as conversas do chat_data (MONGO_URI)")
+    parser.add_argument("--status", help="com --from-mongo, só chats com este status")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--save-fixture", help="grava as conversas lidas neste JSONL")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--repeat", type=int, default=3, help="repetições de cada conversa; os tempos são a mediana entre elas")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="latência simulada de cada chamada ao LLM, em segundos")
+    parser.add_argument("--output", help="grava o relatório neste arquivo (padrão: stdout)")
+    parser.add_argument("--details", action="store_true", help="inclui o resultado de cada conversa no relatório")
+    parser.add_argument("--baseline", help="relatório anterior para comparar; sai com código 1 se houver regressão")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="piora relativa aceita nos tempos")
+    parser.add_argument("--min-ms", type=float, default=0.05, help="piora absoluta aceita nos tempos, em ms")
+    args = parser.parse_args()
+
+    if args.from_mongo:
+        conversations = asyncio.run(load_from_mongo(args.limit, args.status))
+    else:
+        conversations = load_fixture(args.fixture, args.limit)
+    if args.save_fixture:
+        with open(args.save_fixture, "w", encoding="utf-8") as f:
+            for conversation in conversations:
+                f.write(json.dumps(conversation, ensure_ascii=False, default=str) + "\n")
+    if not conversations:
+        parser.error("nenhuma conversa para refazer")
+
+    workers = max(1, min(args.workers, len(conversations)))
+    start = time.perf_counter()
+    repeat = max(1, args.repeat)
+    results = replay_all(conversations, workers, args.llm_latency, repeat)
+    report = build_report(results, time.perf_counter() - start, workers, repeat)
+    if args.details:
+        report["details"] = results
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_ms)
+        report["regressions"] = regressions
+        for item in regressions:
+            print(f"regressão: {item['metric']} {item['baseline']} -> {item['current']}", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
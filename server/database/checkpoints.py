@@ -0,0 +1,261 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+from pymongo import UpdateOne
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+class MongoCheckpointSaver(BaseCheckpointSaver):
+    """
+    Checkpointer do LangGraph sobre o driver assíncrono do PyMongo, com uma
+    thread por chat (thread_id = id do chat).
+
+    Os valores dos canais do estado ficam em `checkpoint_blobs`, um documento por
+    (canal, versão): cada checkpoint grava só os canais que mudaram no passo, e o
+    documento do checkpoint guarda apenas as versões. O canal que muda é gravado
+    inteiro: `messages` é regravado a cada passo que acrescenta mensagens, mas
+    guarda só as mensagens recentes (STATE_MAX_MESSAGES, em agent/context), não o
+    histórico, que fica em chat_messages. As escritas pendentes de cada nó
+    (`checkpoint_writes`) permitem retomar um turno interrompido sem repetir os nós
+    que já terminaram, como a chamada ao LLM.
+
+    Uma vez por turno (no checkpoint de entrada) são apagados os checkpoints
+    anteriores ao fim do turno anterior, com as suas escritas e as versões dos
+    canais que só eles usavam: cada chat guarda poucos checkpoints, não um por passo.
+
+    Só a API assíncrona é implementada; os métodos síncronos da base levantam
+    NotImplementedError.
+    """
+
+    def __init__(self, db, *, serde=None):
+        super().__init__(serde=serde)
+        self.db = db
+        self.checkpoints = db["checkpoints"]
+        self.blobs = db["checkpoint_blobs"]
+        self.writes = db["checkpoint_writes"]
+
+    async def ensure_indexes(self) -> None:
+        await self.checkpoints.create_index(
+            [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1)], unique=True
+        )
+        await self.blobs.create_index(
+            [("thread_id", 1), ("checkpoint_ns", 1), ("channel", 1), ("version", 1)], unique=True
+        )
+        await self.writes.create_index(
+            [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", 1), ("task_id", 1), ("idx", 1)],
+            unique=True,
+        )
+
+    async def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> Dict[str, Any]:
+        """Valores dos canais nas versões pedidas, numa única consulta."""
+        if not versions:
+            return {}
+        cursor = self.blobs.find({
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "$or": [{"channel": channel, "version": version} for channel, version in versions.items()],
+        })
+        values = {}
+        async for blob in cursor:
+            if blob["type"] != "empty":
+                values[blob["channel"]] = self.serde.loads_typed((blob["type"], blob["value"]))
+        return values
+
+    async def _to_tuple(self, doc: Dict[str, Any]) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id = doc["thread_id"], doc["checkpoint_ns"], doc["checkpoint_id"]
+        checkpoint = self.serde.loads_typed((doc["type"], doc["checkpoint"]))
+        cursor = self.writes.find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+        ).sort([("task_id", 1), ("idx", 1)])
+        pending_writes = [
+            (write["task_id"], write["channel"], self.serde.loads_typed((write["type"], write["value"])))
+            async for write in cursor
+        ]
+        parent_id = doc.get("parent_checkpoint_id")
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint={
+                **checkpoint,
+                "channel_values": await self._load_blobs(thread_id, checkpoint_ns, checkpoint["channel_versions"]),
+            },
+            metadata=self.serde.loads_typed((doc["metadata_type"], doc["metadata"])),
+            parent_config=(
+                {"configurable": {
+                    "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id,
+                }}
+                if parent_id else None
+            ),
+            pending_writes=pending_writes,
+        )
+
+    async def aget_tuple(self, config) -> Optional[CheckpointTuple]:
+        """Checkpoint pedido em `config` ou, sem checkpoint_id, o mais recente da thread."""
+        query = {
+            "thread_id": config["configurable"]["thread_id"],
+            "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+        }
+        if checkpoint_id := get_checkpoint_id(config):
+            query["checkpoint_id"] = checkpoint_id
+        # Os ids de checkpoint (uuid6) crescem com o tempo
+        doc = await self.checkpoints.find_one(query, sort=[("checkpoint_id", -1)])
+        return await self._to_tuple(doc) if doc else None
+
+    async def alist(
+        self,
+        config,
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before=None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        query: Dict[str, Any] = {}
+        if config:
+            query["thread_id"] = config["configurable"]["thread_id"]
+            if "checkpoint_ns" in config["configurable"]:
+                query["checkpoint_ns"] = config["configurable"]["checkpoint_ns"]
+            if checkpoint_id := get_checkpoint_id(config):
+                query["checkpoint_id"] = checkpoint_id
+        if before and (before_id := get_checkpoint_id(before)):
+            query["checkpoint_id"] = {"$lt": before_id}
+
+        # Os metadados são serializados, então o filtro é aplicado aqui
+        count = 0
+        async for doc in self.checkpoints.find(query).sort([("checkpoint_id", -1)]):
+            if filter:
+                metadata = self.serde.loads_typed((doc["metadata_type"], doc["metadata"]))
+                if any(metadata.get(key) != value for key, value in filter.items()):
+                    continue
+            yield await self._to_tuple(doc)
+            count += 1
+            if limit is not None and count >= limit:
+                break
+
+    async def aput(
+        self,
+        config,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ):
+        """Grava o checkpoint e, dos canais, só as versões novas deste passo."""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+
+        blob_ops = []
+        for channel, version in new_versions.items():
+            type_, value = self.serde.dumps_typed(values[channel]) if channel in values else ("empty", b"")
+            key = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "channel": channel, "version": version}
+            blob_ops.append(UpdateOne(key, {"$setOnInsert": {**key, "type": type_, "value": value}}, upsert=True))
+        if blob_ops:
+            await self.blobs.bulk_write(blob_ops, ordered=False)
+
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        key = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}
+        await self.checkpoints.update_one(
+            key,
+            {"$set": {
+                **key,
+                "parent_checkpoint_id": config["configurable"].get("checkpoint_id"),
+                "type": type_,
+                "checkpoint": serialized,
+                "metadata_type": metadata_type,
+                "metadata": serialized_metadata,
+            }},
+            upsert=True,
+        )
+
+        # Checkpoint de entrada: um turno começa a partir do fim do anterior (o pai)
+        parent_id = config["configurable"].get("checkpoint_id")
+        if parent_id and metadata.get("source") == "input":
+            await self._prune(thread_id, checkpoint_ns, parent_id)
+        return {"configurable": key}
+
+    async def _prune(self, thread_id: str, checkpoint_ns: str, parent_id: str) -> None:
+        """
+        Apaga os checkpoints anteriores a `parent_id` e as suas escritas pendentes,
+        e de cada canal as versões anteriores à que `parent_id` usa (as versões só
+        crescem). Ficam o pai e os checkpoints do turno atual.
+        """
+        parent = await self.checkpoints.find_one(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id},
+            {"type": 1, "checkpoint": 1},
+        )
+        if parent is None:
+            return
+        versions = self.serde.loads_typed((parent["type"], parent["checkpoint"]))["channel_versions"]
+        older = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": {"$lt": parent_id}}
+        await self.checkpoints.delete_many(older)
+        await self.writes.delete_many(older)
+        if versions:
+            await self.blobs.delete_many({
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "$or": [{"channel": channel, "version": {"$lt": version}} for channel, version in versions.items()],
+            })
+
+    async def aput_writes(
+        self,
+        config,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """
+        Escritas de um nó que terminou, ligadas ao checkpoint em que ele rodou.
+        Escritas normais não são sobrescritas (o nó pode ser reexecutado); as
+        especiais (erro, interrupção) ficam com o valor mais recente.
+        """
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        ops = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized = self.serde.dumps_typed(value)
+            key = {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+                "task_id": task_id,
+                "idx": WRITES_IDX_MAP.get(channel, idx),
+            }
+            fields = {**key, "task_path": task_path, "channel": channel, "type": type_, "value": serialized}
+            operator = "$set" if channel in WRITES_IDX_MAP else "$setOnInsert"
+            ops.append(UpdateOne(key, {operator: fields}, upsert=True))
+        if ops:
+            await self.writes.bulk_write(ops, ordered=False)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        """Apaga todo o histórico de checkpoints de um chat."""
+        for collection in (self.checkpoints, self.blobs, self.writes):
+            await collection.delete_many({"thread_id": thread_id})
+
+    async def adelete_threads(self, thread_ids: List[str]) -> None:
+        """Apaga os checkpoints de um lote de chats, um delete_many por coleção (retenção)."""
+        if not thread_ids:
+            return
+        for collection in (self.checkpoints, self.blobs, self.writes):
+            await collection.delete_many({"thread_id": {"$in": thread_ids}})
+
+    async def athread_ids(self, after: Optional[str], limit: int) -> List[str]:
+        """Até `limit` thread_ids com checkpoints depois de `after`, em ordem (varredura de órfãos)."""
+        match: Dict[str, Any] = {"thread_id": {"$gt": after}} if after is not None else {}
+        cursor = await self.checkpoints.aggregate([
+            {"$match": match},
+            {"$sort": {"thread_id": 1}},
+            {"$group": {"_id": "$thread_id"}},
+            {"$sort": {"_id": 1}},
+            {"$limit": limit},
+        ])
+        return [doc["_id"] for doc in await cursor.to_list(length=limit)]
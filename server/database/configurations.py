@@ -1,16 +1,65 @@
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from dotenv import load_dotenv
+import functools
 import os
 
-# Carrega variáveis do .env
-load_dotenv()
+from pymongo import AsyncMongoClient
+from pymongo.server_api import ServerApi
+
+from database.checkpoints import MongoCheckpointSaver
+from database.memory import InMemoryCheckpointSaver
+from database.repository import ChatRepository
+from observability import MongoCommandMetrics
+
+# Configuração do pool de conexões e timeouts (ajustável pelo .env, carregado em main.py)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+
+# Onde o LangGraph guarda o estado de cada chat: "mongo" ou "memory" (testes e benchmarks)
+CHECKPOINTER = os.getenv("CHECKPOINTER", "mongo")
+
+# Os clientes são criados no primeiro uso e compartilhados pelo worker: importar
+# os módulos não abre conexão nem exige MONGO_URI (testes, benchmarks, CLIs).
+
+@functools.cache
+def get_client() -> AsyncMongoClient:
+    """Cliente assíncrono do PyMongo do worker. A conexão só é aberta no primeiro comando."""
+    return AsyncMongoClient(
+        os.getenv("MONGO_URI"),
+        server_api=ServerApi('1'),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        # Latência de cada comando por coleção/operação, exposta em /metrics
+        event_listeners=[MongoCommandMetrics()],
+    )
+
+def get_db():
+    return get_client().chat_db
+
+@functools.cache
+def get_repository() -> ChatRepository:
+    """Dependência do FastAPI. Nos testes, sobrescreva com um InMemoryChatRepository."""
+    return ChatRepository(get_db())
 
-# Pega o URI do .env
-uri = os.getenv("MONGO_URI")
+@functools.cache
+def get_checkpointer():
+    """Checkpoints do grafo, uma thread por chat."""
+    return MongoCheckpointSaver(get_db()) if CHECKPOINTER == "mongo" else InMemoryCheckpointSaver()
 
-# Cria cliente e conecta
-client = MongoClient(uri, server_api=ServerApi('1'))
+async def ping_mongo() -> None:
+    """Levanta exceção se o MongoDB não responder ao ping."""
+    await get_client().admin.command("ping")
 
-db = client.chat_db
-collection = db["chat_data"]
+async def close_client() -> None:
+    """Fecha o cliente do worker, se ele chegou a ser criado."""
+    if get_client.cache_info().currsize:
+        await get_client().close()
+        get_client.cache_clear()
@@ -0,0 +1,389 @@
+import asyncio
+import copy
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from bson import ObjectId
+from langgraph.checkpoint.memory import InMemorySaver
+
+from database.repository import COMPLETED_STATUSES, EXPORT_PROJECTION, IDEMPOTENCY_COLLECTION, INCOMPLETE_STATUS, LISTING_PROJECTION, MAX_MESSAGES_SLICE, MESSAGES_COLLECTION, RETENTION_JOBS_COLLECTION, bucket_seq, group_by_bucket
+
+class InMemoryChatRepository:
+    """
+    Implementação em memória do ChatRepository, para testes e benchmarks sem MongoDB.
+
+    `latency` simula o tempo de ida e volta ao banco em cada operação. Com
+    `blocking=True` a espera usa time.sleep, reproduzindo um driver síncrono
+    (como o PyMongo) chamado de dentro de uma rota async. `ops` conta as operações
+    que o ChatRepository faria no MongoDB, por "coleção.operação". As mensagens
+    ficam em `buckets`, por (chat_id, seq), como na coleção chat_messages, e as
+    chaves de idempotência em `idempotency`, por (chat_id, key).
+    """
+
+    def __init__(self, latency: float = 0.0, blocking: bool = False):
+        self.latency = latency
+        self.blocking = blocking
+        self.chats: Dict[ObjectId, Dict[str, Any]] = {}
+        self.buckets: Dict[Tuple[ObjectId, int], List[Dict[str, Any]]] = {}
+        self.idempotency: Dict[Tuple[ObjectId, str], Dict[str, Any]] = {}
+        self.retention_jobs: Dict[str, Dict[str, Any]] = {}
+        # Prazo do índice TTL dos chats abandonados (a remoção automática não é simulada)
+        self.abandoned_ttl: Optional[float] = None
+        self.ops: Counter = Counter()
+
+    async def _roundtrip(self, op: str, collection: str = "chat_data") -> None:
+        self.ops[f"{collection}.{op}"] += 1
+        if not self.latency:
+            return
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+    async def list_chats(
+        self,
+        limit: int,
+        after: Optional[Tuple[int, ObjectId]] = None,
+        is_completed: Optional[bool] = None,
+        status: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        await self._roundtrip("find")
+        chats = [
+            chat for chat in self.chats.values()
+            if (is_completed is None or chat.get("is_completed") == is_completed)
+            and (status is None or chat.get("status") == status)
+            and (after is None or (chat.get("creation"), chat["_id"]) < after)
+        ]
+        chats.sort(key=lambda chat: (chat.get("creation"), chat["_id"]), reverse=True)
+        page = []
+        for chat in chats[:limit]:
+            item = {key: copy.deepcopy(chat[key]) for key in LISTING_PROJECTION if key in chat}
+            item["_id"] = chat["_id"]
+            page.append(item)
+        return page
+
+    async def iter_completed_triages(
+        self,
+        batch_size: int,
+        completed_since: Optional[datetime] = None,
+        statuses: Tuple[str, ...] = COMPLETED_STATUSES,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        chats = [
+            chat for chat in self.chats.values()
+            if chat.get("status") in statuses
+            and (completed_since is None or (chat.get("completed_at") and chat["completed_at"] > completed_since))
+        ]
+        # Como no MongoDB, sem completed_at vem primeiro
+        chats.sort(key=lambda chat: (chat.get("completed_at") is not None, chat.get("completed_at") or 0, chat["_id"]))
+        for start in range(0, len(chats), batch_size):
+            await self._roundtrip("find" if start == 0 else "getMore")
+            yield [
+                {"_id": chat["_id"], **{key: copy.deepcopy(chat[key]) for key in EXPORT_PROJECTION if key in chat}}
+                for chat in chats[start:start + batch_size]
+            ]
+
+    async def get_chat(self, chat_id: ObjectId) -> Optional[Dict[str, Any]]:
+        await self._roundtrip("find_one")
+        chat = self.chats.get(chat_id)
+        return copy.deepcopy(chat) if chat else None
+
+    async def get_messages(self, chat_id: ObjectId, since: int = 0) -> Optional[Dict[str, Any]]:
+        await self._roundtrip("find_one")
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            return None
+        version = chat.get("message_seq", 0)
+        if since >= version:
+            return {"version": version, "messages": []}
+
+        await self._roundtrip("find", MESSAGES_COLLECTION)
+        seqs = sorted(seq for (bucket_chat, seq) in self.buckets if bucket_chat == chat_id and seq >= bucket_seq(since + 1))
+        messages = [
+            copy.deepcopy(msg) for seq in seqs for msg in self.buckets[(chat_id, seq)]
+            if (msg.get("id") or 0) > since
+        ][:MAX_MESSAGES_SLICE]
+        return {"version": max([since] + [msg.get("id") or 0 for msg in messages]), "messages": messages}
+
+    async def _push_messages(self, chat_id: ObjectId, messages: List[Dict[str, Any]]) -> None:
+        await self._roundtrip("bulk_write", MESSAGES_COLLECTION)
+        for seq, group in group_by_bucket(messages):
+            bucket = self.buckets.setdefault((chat_id, seq), [])
+            bucket.extend(copy.deepcopy(group))
+            bucket.sort(key=lambda msg: msg.get("id") or 0)
+
+    async def create_chat(self, chat: Dict[str, Any]) -> str:
+        await self._roundtrip("insert_one")
+        chat_id = ObjectId()
+        messages = chat.get("messages") or []
+        self.chats[chat_id] = {
+            "_id": chat_id,
+            **{key: copy.deepcopy(value) for key, value in chat.items() if key != "messages"},
+            "updated_at": datetime.now(timezone.utc),
+            "message_seq": max((msg.get("id") or 0 for msg in messages), default=0),
+            "lastMessage": messages[-1]["text"] if messages else None,
+        }
+        if messages:
+            await self._push_messages(chat_id, messages)
+        return str(chat_id)
+
+    async def append_message(self, chat_id: ObjectId, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        await self._roundtrip("find_one_and_update")
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            return None
+        chat["message_seq"] = chat.get("message_seq", 0) + 1
+        chat["lastMessage"] = message["text"]
+        chat["updated_at"] = datetime.now(timezone.utc)
+        stored = {"id": chat["message_seq"], "text": message["text"], "sender": message["sender"]}
+        await self._push_messages(chat_id, [stored])
+        return {**copy.deepcopy(chat), "message": copy.deepcopy(stored)}
+
+    async def allocate_message_id(self, chat_id: ObjectId) -> Optional[int]:
+        await self._roundtrip("find_one_and_update")
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            return None
+        chat["message_seq"] = chat.get("message_seq", 0) + 1
+        return chat["message_seq"]
+
+    async def save_turn(self, chat_id: ObjectId, new_messages: List[Dict[str, Any]], fields: Dict[str, Any]) -> None:
+        if not new_messages and not fields:
+            return
+        if new_messages:
+            await self._push_messages(chat_id, new_messages)
+        await self._roundtrip("update_one")
+        chat = self.chats.get(chat_id)
+        if chat is not None:
+            chat.update(copy.deepcopy(fields))
+            if new_messages:
+                chat["lastMessage"] = new_messages[-1]["text"]
+            last_id = max((msg.get("id") or 0 for msg in new_messages), default=0)
+            chat["message_seq"] = max(chat.get("message_seq", 0), last_id)
+            chat["updated_at"] = datetime.now(timezone.utc)
+
+    async def update_chat(self, chat_id: ObjectId, fields: Dict[str, Any]) -> None:
+        await self._roundtrip("update_one")
+        chat = self.chats.get(chat_id)
+        if chat is not None:
+            chat.update(copy.deepcopy(fields))
+
+    async def acquire_turn_lease(self, chat_id: ObjectId, owner: str, ttl: float) -> Optional[Dict[str, Any]]:
+        await self._roundtrip("find_one_and_update")
+        chat = self.chats.get(chat_id)
+        now = datetime.now(timezone.utc)
+        if chat is None or (chat.get("turn_lease") and chat["turn_lease"]["expires_at"] > now):
+            return None
+        chat["turn_lease"] = {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}
+        return copy.deepcopy(chat)
+
+    async def release_turn_lease(self, chat_id: ObjectId, owner: str) -> None:
+        await self._roundtrip("update_one")
+        chat = self.chats.get(chat_id)
+        if chat is not None and (chat.get("turn_lease") or {}).get("owner") == owner:
+            del chat["turn_lease"]
+
+    async def reserve_idempotency_key(
+        self, chat_id: ObjectId, key: str, fingerprint: str, lease_ttl: float, ttl: float
+    ) -> Tuple[bool, Dict[str, Any]]:
+        await self._roundtrip("find_one_and_update", IDEMPOTENCY_COLLECTION)
+        now = datetime.now(timezone.utc)
+        existing = self.idempotency.get((chat_id, key))
+        message = None
+        if existing is not None and existing["expires_at"] > now:
+            free = existing["fingerprint"] == fingerprint and existing["response"] is None and existing["locked_until"] <= now
+            if not free:
+                await self._roundtrip("find_one", IDEMPOTENCY_COLLECTION)
+                return False, copy.deepcopy({field: existing.get(field) for field in ("fingerprint", "response", "message")})
+            message = existing.get("message")
+        self.idempotency[(chat_id, key)] = {
+            "fingerprint": fingerprint,
+            "response": None,
+            "message": message,
+            "locked_until": now + timedelta(seconds=lease_ttl),
+            "expires_at": now + timedelta(seconds=ttl),
+        }
+        return True, {"fingerprint": fingerprint, "response": None, "message": copy.deepcopy(message)}
+
+    async def record_idempotent_message(self, chat_id: ObjectId, key: str, message: Dict[str, Any]) -> None:
+        await self._roundtrip("update_one", IDEMPOTENCY_COLLECTION)
+        record = self.idempotency.get((chat_id, key))
+        if record is not None:
+            record["message"] = copy.deepcopy(message)
+
+    async def complete_idempotency_key(self, chat_id: ObjectId, key: str, response: Dict[str, Any], ttl: float) -> None:
+        await self._roundtrip("update_one", IDEMPOTENCY_COLLECTION)
+        record = self.idempotency.get((chat_id, key))
+        if record is not None:
+            record["response"] = copy.deepcopy(response)
+            record["expires_at"] = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+
+    async def release_idempotency_key(self, chat_id: ObjectId, key: str) -> None:
+        await self._roundtrip("update_one", IDEMPOTENCY_COLLECTION)
+        record = self.idempotency.get((chat_id, key))
+        if record is not None and record["response"] is None:
+            record["locked_until"] = datetime.now(timezone.utc)
+
+    # --- Retenção ---
+
+    async def ensure_abandoned_chat_ttl(self, ttl: float) -> None:
+        self.abandoned_ttl = ttl
+
+    async def drop_abandoned_chat_ttl(self) -> None:
+        self.abandoned_ttl = None
+
+    def _purgeable(self, chat: Dict[str, Any], statuses: Tuple[str, ...], created_before: Optional[int]) -> bool:
+        lease = chat.get("turn_lease")
+        return (
+            (chat.get("status") in statuses or (INCOMPLETE_STATUS in statuses and chat.get("is_completed") is False))
+            and (created_before is None or (chat.get("creation") is not None and chat["creation"] < created_before))
+            and (not lease or lease["expires_at"] <= datetime.now(timezone.utc))
+        )
+
+    async def count_purgeable_chats(self, statuses: Tuple[str, ...], created_before: Optional[int]) -> int:
+        await self._roundtrip("count_documents")
+        return sum(self._purgeable(chat, statuses, created_before) for chat in self.chats.values())
+
+    async def find_purgeable_chats(
+        self, statuses: Tuple[str, ...], created_before: Optional[int], limit: int
+    ) -> List[ObjectId]:
+        await self._roundtrip("find")
+        return sorted(chat_id for chat_id, chat in self.chats.items() if self._purgeable(chat, statuses, created_before))[:limit]
+
+    async def delete_chats(self, chat_ids: List[ObjectId]) -> int:
+        if not chat_ids:
+            return 0
+        await self._roundtrip("delete_many", MESSAGES_COLLECTION)
+        await self._roundtrip("delete_many", IDEMPOTENCY_COLLECTION)
+        await self._roundtrip("delete_many")
+        targets = set(chat_ids)
+        for key in [key for key in self.buckets if key[0] in targets]:
+            del self.buckets[key]
+        for key in [key for key in self.idempotency if key[0] in targets]:
+            del self.idempotency[key]
+        return sum(self.chats.pop(chat_id, None) is not None for chat_id in chat_ids)
+
+    async def find_orphan_chat_ids(
+        self, after: Optional[ObjectId], limit: int
+    ) -> Tuple[List[ObjectId], Optional[ObjectId]]:
+        await self._roundtrip("aggregate", MESSAGES_COLLECTION)
+        chat_ids = sorted({chat_id for chat_id, _ in self.buckets if after is None or chat_id > after})[:limit]
+        if not chat_ids:
+            return [], None
+        existing = await self.existing_chat_ids(chat_ids)
+        return [chat_id for chat_id in chat_ids if chat_id not in existing], chat_ids[-1]
+
+    async def existing_chat_ids(self, chat_ids: List[ObjectId]) -> set:
+        await self._roundtrip("find")
+        return {chat_id for chat_id in chat_ids if chat_id in self.chats}
+
+    async def drop_all(self, keep: Tuple[str, ...] = (RETENTION_JOBS_COLLECTION,)) -> List[str]:
+        await self._roundtrip("drop")
+        self.chats.clear()
+        self.buckets.clear()
+        self.idempotency.clear()
+        return ["chat_data", MESSAGES_COLLECTION, IDEMPOTENCY_COLLECTION]
+
+    # --- Jobs de retenção ---
+
+    async def start_retention_job(self, job: Dict[str, Any], heartbeat_after: datetime) -> Optional[Dict[str, Any]]:
+        await self._roundtrip("update_many", RETENTION_JOBS_COLLECTION)
+        for other in self.retention_jobs.values():
+            if other.get("state") == "running" and other["heartbeat_at"] <= heartbeat_after:
+                other.update(state="failed", error="sem sinal de vida do worker", finished_at=job["created_at"])
+        await self._roundtrip("insert_one", RETENTION_JOBS_COLLECTION)
+        # O índice único parcial: um só job "running"
+        running = next((other for other in self.retention_jobs.values() if other.get("state") == "running"), None)
+        if running is not None:
+            await self._roundtrip("find_one", RETENTION_JOBS_COLLECTION)
+            return copy.deepcopy(running)
+        self.retention_jobs[job["_id"]] = copy.deepcopy(job)
+        return None
+
+    async def update_retention_job(self, job_id: str, fields: Dict[str, Any], inc: Optional[Dict[str, int]] = None) -> None:
+        await self._roundtrip("update_one", RETENTION_JOBS_COLLECTION)
+        job = self.retention_jobs.get(job_id)
+        if job is not None:
+            job.update(copy.deepcopy(fields))
+            for key, value in (inc or {}).items():
+                job[key] = job.get(key, 0) + value
+
+    async def get_retention_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        await self._roundtrip("find_one", RETENTION_JOBS_COLLECTION)
+        job = self.retention_jobs.get(job_id)
+        return copy.deepcopy(job) if job else None
+
+class InMemoryCheckpointSaver(InMemorySaver):
+    """
+    Checkpointer em memória com a mesma interface do MongoCheckpointSaver.
+    Conta em `ops` as operações que o MongoCheckpointSaver faria e, com `latency`,
+    simula o tempo de cada uma.
+    """
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.ops: Counter = Counter()
+
+    async def _roundtrip(self, *ops: str) -> None:
+        self.ops.update(ops)
+        if self.latency:
+            await asyncio.sleep(self.latency * len(ops))
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+    async def aget_tuple(self, config):
+        await self._roundtrip("checkpoints.find_one", "checkpoint_writes.find", "checkpoint_blobs.find")
+        return self.get_tuple(config)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        ops = ["checkpoint_blobs.bulk_write"] if new_versions else []
+        await self._roundtrip(*ops, "checkpoints.update_one")
+        saved = self.put(config, checkpoint, metadata, new_versions)
+        # Como o MongoCheckpointSaver: no checkpoint de entrada, apaga o que é anterior ao pai
+        parent_id = config["configurable"].get("checkpoint_id")
+        if parent_id and metadata.get("source") == "input":
+            await self._roundtrip(
+                "checkpoints.find_one", "checkpoints.delete_many", "checkpoint_writes.delete_many", "checkpoint_blobs.delete_many"
+            )
+            self._prune(config["configurable"]["thread_id"], config["configurable"].get("checkpoint_ns", ""), parent_id)
+        return saved
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, parent_id: str) -> None:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if parent_id not in checkpoints:
+            return
+        versions = self.serde.loads_typed(checkpoints[parent_id][0])["channel_versions"]
+        for checkpoint_id in [checkpoint_id for checkpoint_id in checkpoints if checkpoint_id < parent_id]:
+            del checkpoints[checkpoint_id]
+        for key in [key for key in self.writes if key[:2] == (thread_id, checkpoint_ns) and key[2] < parent_id]:
+            del self.writes[key]
+        for key in [
+            key for key in self.blobs
+            if key[:2] == (thread_id, checkpoint_ns) and key[2] in versions and key[3] < versions[key[2]]
+        ]:
+            del self.blobs[key]
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        if writes:
+            await self._roundtrip("checkpoint_writes.bulk_write")
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self._roundtrip("checkpoints.delete_many", "checkpoint_blobs.delete_many", "checkpoint_writes.delete_many")
+        self.delete_thread(thread_id)
+
+    async def adelete_threads(self, thread_ids: List[str]) -> None:
+        if not thread_ids:
+            return
+        await self._roundtrip("checkpoints.delete_many", "checkpoint_blobs.delete_many", "checkpoint_writes.delete_many")
+        for thread_id in thread_ids:
+            self.delete_thread(thread_id)
+
+    async def athread_ids(self, after: Optional[str], limit: int) -> List[str]:
+        await self._roundtrip("checkpoints.aggregate")
+        return sorted(thread_id for thread_id in self.storage if after is None or thread_id > after)[:limit]
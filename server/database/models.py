@@ -1,7 +1,9 @@
-from pydantic import BaseModel
-from typing import List, Dict, Any, TypedDict
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Annotated, List, Dict, Any, Literal, Optional, TypedDict
 from datetime import datetime
 
+from agent.context import recent_messages
+
 class Message(BaseModel):
     id: int
     text: str
@@ -12,6 +14,9 @@ class MessageInput(BaseModel):
     sender: str
 
 class Triagem(BaseModel):
+    # O modelo às vezes devolve a intensidade como número
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
     queixa_principal: str = ""
     sintomas_detalhados: str = ""
     duracao_frequencia: str = ""
@@ -20,16 +25,30 @@ class Triagem(BaseModel):
     medidas_tomadas: str = ""
     emergency_alert: bool = False
 
+class ModelReply(BaseModel):
+    """Saída estruturada do LLM a cada turno (também é o response_schema pedido ao Gemini)."""
+    next_response: str
+    triagem_data: Optional[Triagem] = None
+
 class Chat(BaseModel):
     title: str
     is_completed: bool = False
-    creation: int = int(datetime.timestamp(datetime.now()))
+    creation: int = Field(default_factory=lambda: int(datetime.timestamp(datetime.now())))
     messages: List[Message] = []  # histórico de mensagens
     triagem: Triagem = Triagem()  # preenchido ao final
 
+class RetentionJobRequest(BaseModel):
+    kind: Literal["purge", "orphans", "reset"]
+    # Só para `purge`: INCOMPLETE são os chats não concluídos
+    statuses: List[Literal["INCOMPLETE", "TRIAGE_COMPLETED", "EMERGENCY_ALERT"]] = []
+    older_than_days: Optional[float] = Field(default=None, ge=0)
+
 class State(TypedDict):
-    messages: List[Dict[str, str]]        # Histórico da conversa
+    messages: Annotated[List[Dict[str, Any]], recent_messages]  # Mensagens recentes (nós devolvem só as novas; o histórico fica em chat_messages)
     triagem: Dict[str, Any]               # Triagem estruturada
     resumo_confirmado: bool               # Flag de confirmação do resumo (gatilho de END)
     emergency_detected: bool              # Flag para protocolo de emergência
+    emergency_category: Optional[str]     # Categoria da palavra-chave de emergência (ou "llm")
     turn_count: int                       # Contador de turnos para segurança
+    summary: str                          # Resumo incremental das mensagens fora da janela de contexto
+    summary_upto: int                     # Id da última mensagem incluída no resumo
@@ -0,0 +1,475 @@
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+# Campos trazidos na listagem de chats
+LISTING_PROJECTION = {
+    "title": 1,
+    "is_completed": 1,
+    "status": 1,
+    "creation": 1,
+    "lastMessage": 1,
+}
+
+# Status de triagem concluída e campos levados na exportação (sem o histórico)
+COMPLETED_STATUSES = ("TRIAGE_COMPLETED", "EMERGENCY_ALERT")
+EXPORT_PROJECTION = {
+    "status": 1,
+    "creation": 1,
+    "completed_at": 1,
+    "emergency_category": 1,
+    "triagem": 1,
+}
+
+# Limite de mensagens devolvidas por leitura incremental
+MAX_MESSAGES_SLICE = 1000
+
+# Histórico fora do documento do chat: coleção própria, em buckets de tamanho fixo.
+# A mensagem de id N fica no bucket seq = (N - 1) // MESSAGES_BUCKET_SIZE; mudar o
+# tamanho exige migrar os buckets existentes.
+MESSAGES_COLLECTION = "chat_messages"
+MESSAGES_BUCKET_SIZE = 50
+
+# Respostas por chave de idempotência ({_id: {chat_id, key}, fingerprint, response,
+# expires_at}); o índice TTL em expires_at remove as vencidas
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+
+# Jobs de retenção (progresso lido por qualquer worker); sobrevive ao reset completo
+RETENTION_JOBS_COLLECTION = "retention_jobs"
+# Status usado nos filtros de retenção para os chats ainda sem conclusão
+INCOMPLETE_STATUS = "INCOMPLETE"
+# Índice TTL dos chats abandonados: só chats não concluídos, pela última atividade
+ABANDONED_TTL_INDEX = "abandoned_chat_ttl"
+# Índice único parcial que deixa um só job de retenção em andamento
+RUNNING_RETENTION_JOB_INDEX = "one_running_retention_job"
+
+def bucket_seq(message_id: Optional[int]) -> int:
+    """Número do bucket de uma mensagem pelo id (ids começam em 1)."""
+    return max(0, (message_id or 1) - 1) // MESSAGES_BUCKET_SIZE
+
+def group_by_bucket(messages: List[Dict[str, Any]]) -> List[Tuple[int, List[Dict[str, Any]]]]:
+    """Agrupa mensagens por bucket, em ordem de id."""
+    ordered = sorted(messages, key=lambda msg: msg.get("id") or 0)
+    return [(seq, list(group)) for seq, group in groupby(ordered, key=lambda msg: bucket_seq(msg.get("id")))]
+
+class ChatRepository:
+    """
+    Camada de acesso a dados dos chats sobre o driver assíncrono do PyMongo (AsyncMongoClient).
+    Nenhuma chamada aqui bloqueia o event loop.
+
+    O documento do chat (`chat_data`) guarda só os metadados, a triagem e o
+    contador `message_seq`; as mensagens ficam em `chat_messages`, em buckets de
+    MESSAGES_BUCKET_SIZE mensagens por chat ({chat_id, seq, count, messages}).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db["chat_data"]
+        self.messages = db[MESSAGES_COLLECTION]
+        self.idempotency = db[IDEMPOTENCY_COLLECTION]
+
+    async def ensure_indexes(self) -> None:
+        """Índices da listagem paginada (chave (creation, _id) e filtros) e dos buckets de mensagens."""
+        await self.collection.create_index([("creation", -1), ("_id", -1)])
+        await self.collection.create_index([("is_completed", 1), ("creation", -1), ("_id", -1)])
+        await self.collection.create_index([("status", 1), ("creation", -1), ("_id", -1)])
+        await self.collection.create_index([("status", 1), ("completed_at", 1), ("_id", 1)])
+        await self.messages.create_index([("chat_id", 1), ("seq", 1)], unique=True)
+        await self.idempotency.create_index("expires_at", expireAfterSeconds=0)
+        await self.db[RETENTION_JOBS_COLLECTION].create_index(
+            "state", name=RUNNING_RETENTION_JOB_INDEX, unique=True, partialFilterExpression={"state": "running"}
+        )
+
+    async def list_chats(
+        self,
+        limit: int,
+        after: Optional[Tuple[int, ObjectId]] = None,
+        is_completed: Optional[bool] = None,
+        status: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Página de chats do mais novo para o mais antigo, por keyset em (creation, _id).
+        `after` é a chave do último chat da página anterior. Só os campos da listagem
+        são trazidos.
+        """
+        query: Dict[str, Any] = {}
+        if is_completed is not None:
+            query["is_completed"] = is_completed
+        if status is not None:
+            query["status"] = status
+        if after is not None:
+            creation, last_id = after
+            query["$or"] = [
+                {"creation": {"$lt": creation}},
+                {"creation": creation, "_id": {"$lt": last_id}},
+            ]
+
+        cursor = self.collection.find(query, LISTING_PROJECTION).sort([("creation", -1), ("_id", -1)]).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def iter_completed_triages(
+        self,
+        batch_size: int,
+        completed_since: Optional[datetime] = None,
+        statuses: Tuple[str, ...] = COMPLETED_STATUSES,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Triagens concluídas em ordem de conclusão, em lotes de `batch_size`, por um
+        único cursor no servidor (só os campos de EXPORT_PROJECTION). Com
+        `completed_since`, só as concluídas depois desse instante; chats concluídos
+        antes de existir `completed_at` só saem na exportação completa.
+        """
+        query: Dict[str, Any] = {"status": {"$in": list(statuses)}}
+        if completed_since is not None:
+            query["completed_at"] = {"$gt": completed_since}
+        cursor = self.collection.find(query, EXPORT_PROJECTION, batch_size=batch_size).sort(
+            [("completed_at", 1), ("_id", 1)]
+        )
+        try:
+            while batch := await cursor.to_list(batch_size):
+                yield batch
+        finally:
+            await cursor.close()
+
+    async def get_chat(self, chat_id: ObjectId) -> Optional[Dict[str, Any]]:
+        """Metadados e triagem do chat, sem o histórico (ver get_messages)."""
+        return await self.collection.find_one({"_id": chat_id})
+
+    async def get_messages(self, chat_id: ObjectId, since: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        Mensagens com id > `since` e a versão do histórico.
+        Lê o contador no chat e, só se houver mensagens novas, os buckets a partir
+        do que contém `since + 1`, já filtrados no servidor. Retorna None se o chat não existe.
+
+        O contador `message_seq` avança quando um id é reservado, antes de a mensagem
+        chegar ao bucket (a resposta do agente tem o id reservado durante o turno).
+        Por isso a versão devolvida é o maior id de fato lido: um cliente que guardou
+        o ETag não recebe 304 enquanto a mensagem reservada ainda não foi gravada.
+        """
+        chat = await self.collection.find_one({"_id": chat_id}, {"_id": 0, "message_seq": 1})
+        if chat is None:
+            return None
+        version = chat.get("message_seq", 0)
+        if since >= version:
+            return {"version": version, "messages": []}
+
+        cursor = self.messages.find(
+            {"chat_id": chat_id, "seq": {"$gte": bucket_seq(since + 1)}},
+            {"_id": 0, "messages": {"$filter": {"input": "$messages", "cond": {"$gt": ["$$this.id", since]}}}},
+        ).sort("seq", 1).limit(MAX_MESSAGES_SLICE // MESSAGES_BUCKET_SIZE + 1)
+        messages = [msg async for bucket in cursor for msg in bucket.get("messages", [])][:MAX_MESSAGES_SLICE]
+        return {"version": max([since] + [msg.get("id") or 0 for msg in messages]), "messages": messages}
+
+    async def _push_messages(self, chat_id: ObjectId, messages: List[Dict[str, Any]]) -> None:
+        """
+        Acrescenta mensagens aos buckets do chat (um upsert por bucket, num único
+        comando). Em cada bucket o array fica ordenado por id, mesmo com escritas
+        concorrentes. Se dois workers criarem o mesmo bucket ao mesmo tempo, o
+        índice único rejeita um dos upserts, que é repetido e vira um $push comum.
+        """
+        requests = [
+            UpdateOne(
+                {"chat_id": chat_id, "seq": seq},
+                {"$push": {"messages": {"$each": group, "$sort": {"id": 1}}}, "$inc": {"count": len(group)}},
+                upsert=True,
+            )
+            for seq, group in group_by_bucket(messages)
+        ]
+        try:
+            await self.messages.bulk_write(requests, ordered=True)
+        except BulkWriteError as e:
+            failed = e.details["writeErrors"][0]
+            if failed["code"] != 11000:
+                raise
+            # Os anteriores ao que falhou já foram gravados
+            await self.messages.bulk_write(requests[failed["index"]:], ordered=True)
+
+    async def create_chat(self, chat: Dict[str, Any]) -> str:
+        messages = chat.get("messages") or []
+        chat = {key: value for key, value in chat.items() if key != "messages"}
+        chat["updated_at"] = datetime.now(timezone.utc)
+        chat["message_seq"] = max((msg.get("id") or 0 for msg in messages), default=0)
+        chat["lastMessage"] = messages[-1]["text"] if messages else None
+        resp = await self.collection.insert_one(chat)
+        if messages:
+            await self._push_messages(resp.inserted_id, messages)
+        return str(resp.inserted_id)
+
+    async def append_message(self, chat_id: ObjectId, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Adiciona uma mensagem com id tirado do contador `message_seq` do chat,
+        incrementado de forma atômica, e a grava no bucket correspondente.
+        Devolve o chat já atualizado, com a mensagem gravada em `message`.
+        Retorna None se o chat não existe.
+        """
+        chat = await self.collection.find_one_and_update(
+            {"_id": chat_id},
+            {"$inc": {"message_seq": 1}, "$set": {"lastMessage": message["text"], "updated_at": datetime.now(timezone.utc)}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if chat is None:
+            return None
+        stored = {"id": chat["message_seq"], "text": message["text"], "sender": message["sender"]}
+        await self._push_messages(chat_id, [stored])
+        return {**chat, "message": stored}
+
+    async def allocate_message_id(self, chat_id: ObjectId) -> Optional[int]:
+        """
+        Reserva o próximo id de mensagem do chat no contador `message_seq` (o mesmo
+        $inc de append_message), para a resposta do agente. Envios concorrentes no
+        mesmo chat nunca recebem o mesmo id. Retorna None se o chat não existe.
+        """
+        chat = await self.collection.find_one_and_update(
+            {"_id": chat_id},
+            {"$inc": {"message_seq": 1}},
+            projection={"_id": 0, "message_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return chat["message_seq"] if chat else None
+
+    async def save_turn(self, chat_id: ObjectId, new_messages: List[Dict[str, Any]], fields: Dict[str, Any]) -> None:
+        """
+        Persiste o resultado de um turno do agente: as mensagens novas nos buckets e
+        $set só dos campos que mudaram (mais lastMessage e o contador) no chat.
+        As mensagens vão antes, para que a versão do histórico nunca aponte para
+        mensagens ainda não gravadas.
+        """
+        update: Dict[str, Any] = {}
+        if new_messages:
+            await self._push_messages(chat_id, new_messages)
+            update["$max"] = {"message_seq": max(msg.get("id") or 0 for msg in new_messages)}
+            # Mantém a última mensagem denormalizada para a listagem
+            fields = {**fields, "lastMessage": new_messages[-1]["text"]}
+        if update or fields:
+            # updated_at marca a última atividade (prazo do TTL dos chats abandonados)
+            update["$set"] = {**fields, "updated_at": datetime.now(timezone.utc)}
+            await self.collection.update_one({"_id": chat_id}, update)
+
+    async def update_chat(self, chat_id: ObjectId, fields: Dict[str, Any]) -> None:
+        await self.collection.update_one({"_id": chat_id}, {"$set": fields})
+
+    async def acquire_turn_lease(self, chat_id: ObjectId, owner: str, ttl: float) -> Optional[Dict[str, Any]]:
+        """
+        Reserva o chat para um turno do agente por `ttl` segundos, numa única
+        escrita condicional: só pega o lease se não houver outro ou se o outro já
+        venceu (worker que caiu no meio do turno). Devolve o chat (como get_chat),
+        lido depois da reserva, ou None se ele está ocupado ou não existe.
+        """
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"_id": chat_id, "$or": [{"turn_lease": None}, {"turn_lease.expires_at": {"$lte": now}}]},
+            {"$set": {"turn_lease": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def release_turn_lease(self, chat_id: ObjectId, owner: str) -> None:
+        """Libera o lease, se ainda for de `owner` (depois de vencido, outro turno pode tê-lo pego)."""
+        await self.collection.update_one({"_id": chat_id, "turn_lease.owner": owner}, {"$unset": {"turn_lease": ""}})
+
+    async def reserve_idempotency_key(
+        self, chat_id: ObjectId, key: str, fingerprint: str, lease_ttl: float, ttl: float
+    ) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Reserva a chave para esta chamada por `lease_ttl` segundos, num único
+        find_one_and_update. Devolve (True, registro) se a reserva é desta chamada,
+        ou (False, registro existente) se a chave está com outra chamada, já tem
+        resposta ou foi usada com outra requisição. O registro é
+        {fingerprint, response, message}: response None enquanto não termina;
+        message é a mensagem do usuário já gravada por uma tentativa anterior que
+        falhou (ou cujo worker caiu), reaproveitada em vez de gravada de novo.
+
+        A chave fica livre para a mesma requisição quando a reserva vence ou é
+        liberada (release_idempotency_key), e para qualquer uma quando o registro
+        passa de `ttl` segundos (um registro vencido que o índice TTL ainda não
+        removeu é reaproveitado sem a mensagem).
+        """
+        now = datetime.now(timezone.utc)
+        doc_id = {"chat_id": chat_id, "key": key}
+        try:
+            record = await self.idempotency.find_one_and_update(
+                {"_id": doc_id, "$or": [
+                    {"expires_at": {"$lte": now}},
+                    {"fingerprint": fingerprint, "response": None, "locked_until": {"$lte": now}},
+                ]},
+                [{"$set": {
+                    "message": {"$cond": [{"$gt": ["$expires_at", now]}, "$message", "$$REMOVE"]},
+                    "fingerprint": fingerprint,
+                    "response": None,
+                    "locked_until": now + timedelta(seconds=lease_ttl),
+                    "expires_at": now + timedelta(seconds=ttl),
+                }}],
+                projection={"fingerprint": 1, "response": 1, "message": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            return True, record
+        except DuplicateKeyError:
+            # Registro válido de outra chamada: o upsert tentou inserir o mesmo _id
+            existing = await self.idempotency.find_one({"_id": doc_id}, {"fingerprint": 1, "response": 1, "message": 1})
+            return False, existing or {"fingerprint": fingerprint, "response": None}
+
+    async def record_idempotent_message(self, chat_id: ObjectId, key: str, message: Dict[str, Any]) -> None:
+        """Guarda na chave a mensagem do usuário gravada pela chamada, para uma repetição não gravá-la de novo."""
+        await self.idempotency.update_one({"_id": {"chat_id": chat_id, "key": key}}, {"$set": {"message": message}})
+
+    async def complete_idempotency_key(self, chat_id: ObjectId, key: str, response: Dict[str, Any], ttl: float) -> None:
+        """Guarda a resposta da chave, devolvida às repetições pelos próximos `ttl` segundos."""
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        await self.idempotency.update_one(
+            {"_id": {"chat_id": chat_id, "key": key}}, {"$set": {"response": response, "expires_at": expires_at}}
+        )
+
+    async def release_idempotency_key(self, chat_id: ObjectId, key: str) -> None:
+        """
+        Libera a reserva de uma chamada que falhou, para a repetição processar o
+        turno. O registro fica (com a mensagem já gravada, se houver) até vencer.
+        """
+        await self.idempotency.update_one(
+            {"_id": {"chat_id": chat_id, "key": key}, "response": None},
+            {"$set": {"locked_until": datetime.now(timezone.utc)}},
+        )
+
+    # --- Retenção ---
+
+    async def ensure_abandoned_chat_ttl(self, ttl: float) -> None:
+        """
+        Índice TTL que apaga chats não concluídos sem atividade há `ttl` segundos
+        (campo updated_at). Só o documento do chat some; mensagens e checkpoints
+        ficam órfãos até a varredura de retenção. Mudar o prazo altera o índice
+        existente (collMod) em vez de recriá-lo.
+        """
+        try:
+            await self.collection.create_index(
+                "updated_at",
+                name=ABANDONED_TTL_INDEX,
+                expireAfterSeconds=int(ttl),
+                partialFilterExpression={"is_completed": False},
+            )
+        except OperationFailure as e:
+            if e.code != 85:  # IndexOptionsConflict: o índice existe com outro prazo
+                raise
+            await self.db.command(
+                "collMod", self.collection.name, index={"name": ABANDONED_TTL_INDEX, "expireAfterSeconds": int(ttl)}
+            )
+
+    async def drop_abandoned_chat_ttl(self) -> None:
+        """Remove o índice TTL dos chats abandonados, se existir (TTL desligado)."""
+        try:
+            await self.collection.drop_index(ABANDONED_TTL_INDEX)
+        except OperationFailure as e:
+            if e.code != 27:  # IndexNotFound
+                raise
+
+    def _retention_query(self, statuses: Tuple[str, ...], created_before: Optional[int]) -> Dict[str, Any]:
+        """Chats com um dos `statuses` (INCOMPLETE = não concluídos), criados antes de `created_before` e sem turno em andamento."""
+        by_status: List[Dict[str, Any]] = []
+        finished = [status for status in statuses if status != INCOMPLETE_STATUS]
+        if finished:
+            by_status.append({"status": {"$in": finished}})
+        if INCOMPLETE_STATUS in statuses:
+            by_status.append({"is_completed": False})
+        query: Dict[str, Any] = {"$and": [
+            {"$or": by_status},
+            {"$or": [{"turn_lease": None}, {"turn_lease.expires_at": {"$lte": datetime.now(timezone.utc)}}]},
+        ]}
+        if created_before is not None:
+            query["creation"] = {"$lt": created_before}
+        return query
+
+    async def count_purgeable_chats(self, statuses: Tuple[str, ...], created_before: Optional[int]) -> int:
+        return await self.collection.count_documents(self._retention_query(statuses, created_before))
+
+    async def find_purgeable_chats(
+        self, statuses: Tuple[str, ...], created_before: Optional[int], limit: int
+    ) -> List[ObjectId]:
+        """Ids do próximo lote de chats a apagar pela política de retenção."""
+        cursor = self.collection.find(self._retention_query(statuses, created_before), {"_id": 1}).sort("_id", 1).limit(limit)
+        return [doc["_id"] for doc in await cursor.to_list(length=limit)]
+
+    async def delete_chats(self, chat_ids: List[ObjectId]) -> int:
+        """
+        Apaga um lote de chats com as mensagens e as chaves de idempotência. Os
+        filhos vão antes: se o job cair no meio, o chat continua lá e volta no
+        próximo lote, em vez de deixar órfãos. Os checkpoints são do checkpointer.
+        """
+        if not chat_ids:
+            return 0
+        await self.messages.delete_many({"chat_id": {"$in": chat_ids}})
+        await self.idempotency.delete_many({"_id.chat_id": {"$in": chat_ids}})
+        result = await self.collection.delete_many({"_id": {"$in": chat_ids}})
+        return result.deleted_count
+
+    async def find_orphan_chat_ids(
+        self, after: Optional[ObjectId], limit: int
+    ) -> Tuple[List[ObjectId], Optional[ObjectId]]:
+        """
+        Varre, em ordem, até `limit` chat_ids com mensagens em chat_messages depois
+        de `after` e devolve (os que não têm mais chat, o último visto; None no fim).
+        """
+        match: Dict[str, Any] = {"chat_id": {"$gt": after}} if after is not None else {}
+        cursor = await self.messages.aggregate([
+            {"$match": match},
+            {"$sort": {"chat_id": 1}},
+            {"$group": {"_id": "$chat_id"}},
+            {"$sort": {"_id": 1}},
+            {"$limit": limit},
+        ])
+        chat_ids = [doc["_id"] for doc in await cursor.to_list(length=limit)]
+        if not chat_ids:
+            return [], None
+        existing = await self.existing_chat_ids(chat_ids)
+        return [chat_id for chat_id in chat_ids if chat_id not in existing], chat_ids[-1]
+
+    async def existing_chat_ids(self, chat_ids: List[ObjectId]) -> set:
+        """Quais destes chats ainda existem (varredura de órfãos nos checkpoints)."""
+        docs = await self.collection.find({"_id": {"$in": chat_ids}}, {"_id": 1}).to_list(length=len(chat_ids))
+        return {doc["_id"] for doc in docs}
+
+    async def drop_all(self, keep: Tuple[str, ...] = (RETENTION_JOBS_COLLECTION,)) -> List[str]:
+        """
+        Reset completo: descarta as coleções inteiras (menos `keep`), sem apagar
+        documento por documento. Os índices precisam ser recriados depois.
+        Devolve as coleções descartadas.
+        """
+        dropped = []
+        for collection_name in await self.db.list_collection_names():
+            if collection_name in keep or collection_name.startswith("system."):
+                continue
+            await self.db.drop_collection(collection_name)
+            dropped.append(collection_name)
+        return dropped
+
+    # --- Jobs de retenção ---
+
+    async def start_retention_job(self, job: Dict[str, Any], heartbeat_after: datetime) -> Optional[Dict[str, Any]]:
+        """
+        Grava `job` em andamento se nenhum outro estiver. A exclusão é do próprio
+        MongoDB (índice único parcial nos jobs "running"): de duas chamadas
+        simultâneas, só uma insere. Um job em andamento sem sinal de vida desde
+        `heartbeat_after` (worker que caiu) é dado como "failed" antes, liberando a
+        vaga. Devolve None se o job foi gravado, ou o job que está em andamento.
+        """
+        jobs = self.db[RETENTION_JOBS_COLLECTION]
+        await jobs.update_many(
+            {"state": "running", "heartbeat_at": {"$lte": heartbeat_after}},
+            {"$set": {"state": "failed", "error": "sem sinal de vida do worker", "finished_at": job["created_at"]}},
+        )
+        try:
+            await jobs.insert_one(job)
+            return None
+        except DuplicateKeyError:
+            running = await jobs.find_one({"state": "running"})
+            return running or {"_id": None, "state": "running"}
+
+    async def update_retention_job(self, job_id: str, fields: Dict[str, Any], inc: Optional[Dict[str, int]] = None) -> None:
+        update: Dict[str, Any] = {"$set": fields}
+        if inc:
+            update["$inc"] = inc
+        await self.db[RETENTION_JOBS_COLLECTION].update_one({"_id": job_id}, update)
+
+    async def get_retention_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db[RETENTION_JOBS_COLLECTION].find_one({"_id": job_id})
+
@@ -1,18 +1,40 @@
+import base64
 from bson import ObjectId
 
 def individual_chat(chat):
-    messages = chat.get("messages", [])  # lista de mensagens
-    last_message = messages[-1]["text"] if messages else None
-
+    """Dados do chat, sem o histórico (que fica em /chat-messages)."""
     return {
         "chat_id": str(chat["_id"]),  # converte ObjectId em string
         "title": chat.get("title"),
         "is_completed": chat.get("is_completed", False),
         "creation": chat.get("creation"),
-        "lastMessage": last_message,
+        "lastMessage": chat.get("lastMessage"),
         "triagem": chat.get("triagem", {}),
     }
 
+def chat_summary(chat):
+    """Item da listagem de chats: só os campos exibidos na lista, sem o histórico."""
+    return {
+        "chat_id": str(chat["_id"]),
+        "title": chat.get("title"),
+        "is_completed": chat.get("is_completed", False),
+        "status": chat.get("status"),
+        "creation": chat.get("creation"),
+        "lastMessage": chat.get("lastMessage"),
+    }
+
 def all_chats(chats):
-    return [individual_chat(chat) for chat in chats]
+    return [chat_summary(chat) for chat in chats]
+
+def encode_cursor(chat) -> str:
+    """Cursor opaco de paginação a partir da chave (creation, _id) do último chat da página."""
+    raw = f"{chat.get('creation') or 0}:{chat['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
+def decode_cursor(cursor: str) -> tuple[int, ObjectId]:
+    """Inverso de encode_cursor. Levanta ValueError se o cursor for inválido."""
+    try:
+        creation, chat_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return int(creation), ObjectId(chat_id)
+    except Exception as e:
+        raise ValueError("cursor inválido") from e
@@ -0,0 +1,19 @@
+from typing import Optional
+
+class RetryableHTTPError(Exception):
+    """
+    Recusa passageira de uma requisição: a rota responde `status_code` com o
+    header Retry-After (`retry_after` segundos) para o cliente tentar de novo.
+    Subclasses fixam o motivo: LLM sobrecarregado, turno em andamento no chat,
+    worker encerrando.
+    """
+    status_code = 503
+    retry_after = 5
+
+    def __init__(self, detail: str, status_code: Optional[int] = None, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.detail = detail
+        if status_code is not None:
+            self.status_code = status_code
+        if retry_after is not None:
+            self.retry_after = retry_after
@@ -0,0 +1,79 @@
+import csv
+import io
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List
+
+import orjson
+import zstandard
+
+from database.models import Triagem
+
+# Documentos por lote do cursor da exportação (e por pedaço da resposta)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+EXPORT_ZSTD_LEVEL = int(os.getenv("EXPORT_ZSTD_LEVEL", "3"))
+
+TRIAGE_FIELDS = list(Triagem.model_fields)
+CSV_COLUMNS = ["chat_id", "status", "creation", "completed_at", "emergency_category", *TRIAGE_FIELDS]
+
+def isoformat_utc(value: datetime) -> str:
+    """O driver devolve datas em UTC sem fuso; a exportação sempre leva o fuso explícito."""
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+
+def export_record(chat: Dict[str, Any]) -> Dict[str, Any]:
+    """Registro exportado de um chat: identificação, conclusão e os campos da triagem."""
+    triagem = chat.get("triagem") or {}
+    completed_at = chat.get("completed_at")
+    return {
+        "chat_id": str(chat["_id"]),
+        "status": chat.get("status"),
+        "creation": chat.get("creation"),
+        "completed_at": isoformat_utc(completed_at) if completed_at else None,
+        "emergency_category": chat.get("emergency_category"),
+        "triagem": {field: triagem.get(field) for field in TRIAGE_FIELDS},
+    }
+
+async def ndjson_chunks(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """Um objeto JSON por linha; um pedaço da resposta por lote do cursor."""
+    async for batch in batches:
+        yield b"".join(orjson.dumps(export_record(chat)) + b"\n" for chat in batch)
+
+async def csv_chunks(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """CSV com cabeçalho e os campos da triagem em colunas; um pedaço por lote do cursor."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    # O cabeçalho sai antes do primeiro lote: exportação vazia ainda é um CSV válido
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    async for batch in batches:
+        for chat in batch:
+            record = export_record(chat)
+            writer.writerow([
+                *(record[column] for column in CSV_COLUMNS[:5]),
+                *(record["triagem"][field] for field in TRIAGE_FIELDS),
+            ])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+async def zstd_chunks(chunks: AsyncIterator[bytes], level: int = EXPORT_ZSTD_LEVEL) -> AsyncIterator[bytes]:
+    """
+    Comprime o stream num único frame zstd. Cada pedaço fecha um bloco, para o
+    cliente começar a descomprimir sem esperar o fim da exportação.
+    """
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    async for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def accepts_zstd(accept_encoding: str) -> bool:
+    """O cliente aceita zstd em Accept-Encoding (e não o recusou com q=0)?"""
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() == "zstd":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
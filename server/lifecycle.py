@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from errors import RetryableHTTPError
+
+logger = logging.getLogger(__name__)
+
+# Espera máxima pelos turnos em andamento no encerramento do worker
+SHUTDOWN_DRAIN_TIMEOUT_S = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT_S", "30"))
+# Prazo de cada checagem do /readyz e validade da checagem do LLM (não chama o provedor a cada sonda)
+READINESS_TIMEOUT_S = float(os.getenv("READINESS_TIMEOUT_S", "2"))
+READINESS_LLM_CHECK_S = float(os.getenv("READINESS_LLM_CHECK_S", "30"))
+# Intervalo entre tentativas de aquecimento (índices, clientes) quando uma dependência está fora
+WARMUP_RETRY_S = float(os.getenv("WARMUP_RETRY_S", "2"))
+
+class ServiceDraining(RetryableHTTPError):
+    """O worker está encerrando: turnos novos são recusados para irem a outra instância."""
+    status_code = 503
+    retry_after = 1
+
+class TurnTracker:
+    """
+    Turnos do agente em andamento no worker. No encerramento, `drain` recusa os
+    novos (ServiceDraining) e espera os atuais terminarem, para nenhum turno ser
+    cortado no meio da chamada ao LLM ou da gravação.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.draining = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def check_open(self) -> None:
+        if self.draining:
+            raise ServiceDraining("Servidor encerrando; tente novamente")
+
+    @asynccontextmanager
+    async def turn(self):
+        self.check_open()
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Recusa turnos novos e espera os em andamento; False se o prazo acabou antes."""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+class WorkerLifecycle:
+    """
+    Estado do worker para o balanceador: aquecimento em segundo plano (o processo
+    já responde ao /healthz enquanto isso), turnos em andamento e prontidão, que
+    exige aquecimento concluído, MongoDB respondendo e o LLM alcançável.
+    """
+
+    def __init__(self):
+        self.turns = TurnTracker()
+        self.started_at = time.monotonic()
+        self.ready_after: Optional[float] = None  # segundos do início até o fim do aquecimento
+        self.warmup_error: Optional[str] = None
+        self._llm_checked_at = float("-inf")
+        self._llm_status = "unchecked"
+
+    @property
+    def warmed_up(self) -> bool:
+        return self.ready_after is not None
+
+    async def warm_up(self, steps: Callable[[], Awaitable[None]]) -> None:
+        """Roda `steps` até conseguir, com nova tentativa a cada WARMUP_RETRY_S segundos."""
+        while True:
+            try:
+                await steps()
+            except Exception as e:
+                self.warmup_error = repr(e)
+                logger.warning("Aquecimento do worker falhou (nova tentativa em %.0f s): %r", WARMUP_RETRY_S, e)
+                await asyncio.sleep(WARMUP_RETRY_S)
+                continue
+            self.warmup_error = None
+            self.ready_after = time.monotonic() - self.started_at
+            logger.info("Worker pronto em %.2f s", self.ready_after)
+            return
+
+    async def _check(self, probe: Callable[[], Awaitable[None]]) -> str:
+        try:
+            await asyncio.wait_for(probe(), READINESS_TIMEOUT_S)
+        except Exception as e:
+            return f"erro: {e!r}"
+        return "ok"
+
+    async def readiness(
+        self, mongo: Callable[[], Awaitable[None]], get_llm_policy: Callable[[], Any]
+    ) -> tuple[bool, Dict[str, Any]]:
+        """(pronto?, relatório por dependência) para o /readyz."""
+        report: Dict[str, Any] = {"warmed_up": self.warmed_up, "draining": self.turns.draining,
+                                  "in_flight_turns": self.turns.in_flight}
+        if not self.warmed_up:
+            report["warmup_error"] = self.warmup_error
+            return False, report
+
+        report["mongo"] = await self._check(mongo)
+        policy = get_llm_policy()
+        if policy.breaker.is_open:
+            report["llm"] = "circuit_open"
+        else:
+            if time.monotonic() - self._llm_checked_at >= READINESS_LLM_CHECK_S or self._llm_status != "ok":
+                self._llm_status = await self._check(policy.provider.ping)
+                self._llm_checked_at = time.monotonic()
+            report["llm"] = self._llm_status
+
+        ready = not self.turns.draining and report["mongo"] == "ok" and report["llm"] == "ok"
+        return ready, report
@@ -1,160 +1,486 @@
-from fastapi import FastAPI, APIRouter, HTTPException
-from database.configurations import collection, db
-from database.schemas import all_chats, individual_chat
-from bson import ObjectId
-from database.models import Chat, Message, MessageInput
 from dotenv import load_dotenv
-from agent.default_agent import app as agent_app
 
-# carrega o .env
+# Carrega o .env uma única vez, antes dos módulos que leem a configuração ao serem importados
 load_dotenv()
 
-app = FastAPI()
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Literal, Optional
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from database.configurations import close_client, get_checkpointer, get_repository, ping_mongo
+from database.repository import COMPLETED_STATUSES, ChatRepository
+from database.schemas import all_chats, decode_cursor, encode_cursor, individual_chat
+from bson import ObjectId
+from database.models import Chat, Message, MessageInput, RetentionJobRequest
+from errors import RetryableHTTPError
+from export import EXPORT_BATCH_SIZE, accepts_zstd, csv_chunks, ndjson_chunks, zstd_chunks
+from lifecycle import SHUTDOWN_DRAIN_TIMEOUT_S, WorkerLifecycle
+from turns import IdempotentRequest, TurnLease
+from retention import RETENTION_SWEEP_INTERVAL_S, RetentionEngine, RetentionJobRunning, public_job
+from observability import PrometheusMiddleware, configure_logging
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from agent.default_agent import (
+    build_turn_delta,
+    build_update_fields,
+    get_agent_app,
+    get_llm_cache,
+    get_llm_policy,
+    llm_limiter,
+    merge_update,
+    prepare_turn,
+    router_entry,
+    run_graph_turn,
+    thread_config,
+)
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+async def warm_up():
+    """Cria os clientes e o grafo e garante os índices antes de o worker se declarar pronto."""
+    # O SDK do LLM leva ~1 s para carregar: numa thread, para o /healthz seguir respondendo
+    await asyncio.to_thread(get_llm_policy)
+    get_agent_app()
+    await ensure_indexes(get_repository())
+
+async def ensure_indexes(repo: ChatRepository):
+    """Índices da listagem paginada, dos checkpoints do grafo, do cache de respostas e da retenção (TTL)."""
+    await repo.ensure_indexes()
+    await get_checkpointer().ensure_indexes()
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        await llm_cache.ensure_indexes()
+    await retention.ensure_ttl(repo)
+
+# Jobs de retenção deste worker; o reset recria os índices depois de descartar as coleções
+retention = RetentionEngine(ensure_indexes)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    lifecycle: WorkerLifecycle = app.state.lifecycle
+    # O worker aceita conexões na hora (/healthz); o /readyz só responde 200 depois do aquecimento
+    warmup = asyncio.create_task(lifecycle.warm_up(warm_up))
+    sweep = asyncio.create_task(retention.run_periodic(get_repository)) if RETENTION_SWEEP_INTERVAL_S > 0 else None
+    yield
+    warmup.cancel()
+    if sweep is not None:
+        sweep.cancel()
+    if not await lifecycle.turns.drain(SHUTDOWN_DRAIN_TIMEOUT_S):
+        logger.warning("Encerrando com %d turno(s) ainda em andamento", lifecycle.turns.in_flight)
+    await retention.shutdown()
+    # Apaga a instrução de sistema em cache no provedor (senão ela só some quando o prazo vence)
+    if get_llm_policy.cache_info().currsize:
+        prefix_cache = get_llm_policy().provider.prefix_cache
+        if prefix_cache is not None:
+            await prefix_cache.invalidate()
+    await close_client()
+
 router = APIRouter()
 
+def get_lifecycle(request: Request) -> WorkerLifecycle:
+    return request.app.state.lifecycle
+
+async def retryable_error_handler(request, exc: RetryableHTTPError):
+    # Recusa passageira (LLM saturado, turno em andamento no chat, worker encerrando): o cliente tenta de novo
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @router.get("/chats")
-async def get_all_chats():
-    data = collection.find()
+async def get_all_chats(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    is_completed: Optional[bool] = None,
+    status: Optional[str] = None,
+    repo: ChatRepository = Depends(get_repository),
+):
+    """
+    Lista os chats do mais novo para o mais antigo, uma página por vez.
+    Se houver mais resultados, o cursor da próxima página vem no header `X-Next-Cursor`.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido")
+
+    # Busca um a mais para saber se existe próxima página
+    data = await repo.list_chats(limit + 1, after=after, is_completed=is_completed, status=status)
+    if len(data) > limit:
+        data = data[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(data[-1])
     return all_chats(data)
 
 @router.get("/chat/{chat_id}")
-async def get_chat(chat_id: str):
+async def get_chat(chat_id: str, repo: ChatRepository = Depends(get_repository)):
     try:
         obj_id = ObjectId(chat_id)
     except Exception:
         raise HTTPException(status_code=400, detail="ID de chat inválido")
 
-    data = collection.find_one({"_id": obj_id})
+    data = await repo.get_chat(obj_id)
     if not data:
         raise HTTPException(status_code=404, detail="Chat não encontrado")
 
     return individual_chat(data)
 
 @router.post("/criar-chat")
-async def create_chat(new_chat: Chat):
+async def create_chat(new_chat: Chat, repo: ChatRepository = Depends(get_repository)):
     try:
         # Converte o Pydantic model inteiro em dict serializável
         chat_dict = new_chat.model_dump()
-        resp = collection.insert_one(chat_dict)
-        return {"status_code": 200, "message": "Chat criado com sucesso!", "_id": str(resp.inserted_id)}
+        inserted_id = await repo.create_chat(chat_dict)
+        return {"status_code": 200, "message": "Chat criado com sucesso!", "_id": inserted_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro ao criar o chat: {e}")
     
 @router.get("/chat-messages/{chat_id}", response_model=list[Message])
-async def get_chat_messages(chat_id: str):
+async def get_chat_messages(
+    chat_id: str,
+    response: Response,
+    since: int = Query(0, ge=0),
+    if_none_match: Optional[str] = Header(None),
+    repo: ChatRepository = Depends(get_repository),
+):
+    """
+    Mensagens do chat com id > `since` (todas, por padrão).
+    A resposta traz um ETag com a versão do histórico; se o cliente enviar o mesmo
+    valor em If-None-Match e nada mudou, a resposta é 304 sem corpo.
+    """
     try:
         obj_id = ObjectId(chat_id)
     except Exception:
         raise HTTPException(status_code=400, detail="ID de chat inválido")
 
-    chat = collection.find_one({"_id": obj_id})
-    if not chat:
+    data = await repo.get_messages(obj_id, since)
+    if data is None:
         raise HTTPException(status_code=404, detail="Chat não encontrado")
 
-    return chat.get("messages", [])
+    etag = f'W/"{data["version"]}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return data["messages"]
     
 @router.post("/send-user/{chat_id}")
-async def send_message(chat_id: str, message: MessageInput):
+async def send_message(chat_id: str, message: MessageInput, repo: ChatRepository = Depends(get_repository)):
+    """
+    Grava a mensagem do usuário sem gerar resposta. Também reserva o chat: com um
+    turno rodando, a mensagem entraria no meio dele (409 em vez disso).
+    """
     try:
-        chat = collection.find_one({"_id": ObjectId(chat_id)})
-        # calcular próximo id
-        next_id = len(chat.get("messages", [])) + 1
-        collection.update_one(
-            {"_id": ObjectId(chat_id)}, 
-            {"$push": {"messages": {"id": next_id, "text": message.text, "sender": "user"}}}
-        )
-        return {"status_code": 200, "message": "Mensagem enviada com sucesso!"}
+        obj_id = ObjectId(chat_id)
     except Exception:
         raise HTTPException(status_code=404, detail="Chat não encontrado")
 
-@router.post("/send-model/{chat_id}")
-async def send_model(chat_id: str):    
-    chat = collection.find_one({"_id": ObjectId(chat_id)})
+    async with TurnLease(repo, obj_id):
+        # o id da mensagem vem do contador do próprio documento (atômico)
+        chat = await repo.append_message(obj_id, {"text": message.text, "sender": "user"})
     if not chat:
         raise HTTPException(status_code=404, detail="Chat não encontrado")
+    return {"status_code": 200, "message": "Mensagem enviada com sucesso!"}
 
-    # 1. Monta estado 
-    state = {
-        "messages": chat.get("messages", []),
-        "triagem": chat.get("triagem", {}),
-        "resumo_confirmado": chat.get("resumo_confirmado", False),
-        "emergency_detected": chat.get("emergency_detected", False),
-        "turn_count": chat.get("turn_count", 0) 
-    }
-    
-    # 2. Executa LangGraph usando STREAM para rodar APENAS UM TURNO
-    final_state = state.copy()
-
-    for s in agent_app.stream(state):
-        final_state.update(s)
-        
-        # Interrompe o ciclo após o primeiro ciclo completo, ou se atingir END
-        if "__end__" in s or "end_or_continue" in s or "emergency_protocol" in s: 
-            break
-            
-    updated_state = final_state
-
-    # Encontra a chave do último nó que executou 
-    last_node_key = [k for k in final_state if k not in state][0] if [k for k in final_state if k not in state] else None
-
-    if last_node_key:
-        state_from_last_node = final_state[last_node_key]
-        updated_state["messages"] = state_from_last_node.get("messages", [])
-        updated_state["triagem"] = state_from_last_node.get("triagem", {})
-        updated_state["resumo_confirmado"] = state_from_last_node.get("resumo_confirmado", False)
-        updated_state["emergency_detected"] = state_from_last_node.get("emergency_detected", False)
-        updated_state["turn_count"] = state_from_last_node.get("turn_count", 0)
-
-    # 3. Prepara os dados de atualização para o DB
-    is_confirmed = updated_state.get("resumo_confirmado", False)
-    is_emergency = updated_state.get("emergency_detected", False)
-    
-    update_fields = {
-        "messages": updated_state.get("messages", []),
-        "triagem": updated_state.get("triagem", {}),
-        "resumo_confirmado": is_confirmed,
-        "emergency_detected": is_emergency,
-        "turn_count": updated_state.get("turn_count", 0),
-        "is_completed": False
-    }
+@router.post("/send/{chat_id}")
+async def send_and_reply(
+    chat_id: str,
+    message: MessageInput,
+    idempotency_key: Optional[str] = Header(None),
+    repo: ChatRepository = Depends(get_repository),
+    lifecycle: WorkerLifecycle = Depends(get_lifecycle),
+):
+    """
+    Envia a mensagem do usuário e devolve a resposta do agente numa única chamada
+    (substitui o par /send-user + /send-model). A mensagem entra no histórico de forma
+    atômica, já com o documento atualizado de volta, e a resposta é salva numa única escrita.
+    Um turno por chat (409 se outro está rodando); com `Idempotency-Key`, a repetição
+    do envio recebe a resposta já dada.
+    """
+    try:
+        obj_id = ObjectId(chat_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="ID de chat inválido")
+
+    idempotent = IdempotentRequest(repo, obj_id, idempotency_key, "send", message.text)
+    async with idempotent as stored:
+        if stored is not None:
+            return stored
+
+        async with lifecycle.turns.turn(), TurnLease(repo, obj_id) as leased:
+            if idempotent.message is not None:
+                # Repetição de um envio que falhou depois de gravar a mensagem: não a grava de novo
+                chat = {**leased, "message": idempotent.message}
+            else:
+                chat = await repo.append_message(obj_id, {"text": message.text, "sender": "user"})
+                if not chat:
+                    raise HTTPException(status_code=404, detail="Chat não encontrado")
+                await idempotent.record_message(chat["message"])
+
+            updated_state = await run_graph_turn(chat_id, chat, repo)
+            update_fields = build_update_fields(updated_state)
+            await repo.save_turn(obj_id, *build_turn_delta(chat, updated_state))
+
+        response = {
+            "status_code": 200,
+            "user_message": chat["message"],
+            "agent_message": updated_state["messages"][-1],
+            "is_completed": update_fields["is_completed"],
+        }
+        await idempotent.complete(response)
+    return response
+
+@router.post("/send-model/{chat_id}")
+async def send_model(
+    chat_id: str,
+    idempotency_key: Optional[str] = Header(None),
+    repo: ChatRepository = Depends(get_repository),
+    lifecycle: WorkerLifecycle = Depends(get_lifecycle),
+):
+    try:
+        obj_id = ObjectId(chat_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="ID de chat inválido")
 
-    # 4. Lógica de Salvamento Final
-    if is_confirmed:
-        print("DEBUG 4.1 - CONDIÇÃO ATINGIDA: is_confirmed é True. Salvando conclusão!")
-        
-        # Se a triagem foi confirmada (pelo usuário ou emergência), salva os campos de conclusão
-        update_fields["is_completed"] = True
-        
-        update_fields["triagem"] = updated_state.get("triagem", {}) 
-        
-        if is_emergency:
-            update_fields["status"] = "EMERGENCY_ALERT"
-        else:
-            update_fields["status"] = "TRIAGE_COMPLETED"
+    idempotent = IdempotentRequest(repo, obj_id, idempotency_key, "send-model")
+    async with idempotent as stored:
+        if stored is not None:
+            return stored
+
+        # O chat é lido junto com a reserva do turno: um segundo envio no mesmo chat recebe 409
+        async with lifecycle.turns.turn(), TurnLease(repo, obj_id) as chat:
+            # 1. Executa LangGraph rodando APENAS UM TURNO (retoma do checkpoint do chat)
+            updated_state = await run_graph_turn(chat_id, chat, repo)
+
+            # 2. Prepara os dados de atualização para o DB
+            update_fields = build_update_fields(updated_state)
+
+            # 3. Lógica de Salvamento Final
+            if update_fields["is_completed"]:
+                logger.info("Chat %s: triagem concluída (%s)", chat_id, update_fields["status"])
+            else:
+                logger.debug("Chat %s: triagem continua", chat_id)
+
+            await repo.save_turn(obj_id, *build_turn_delta(chat, updated_state))
+
+        # 4. Retorna a última mensagem do agente
+        agent_message = updated_state["messages"][-1]
+
+        response = {
+            "status_code": 200,
+            "agent_message": agent_message
+        }
+        await idempotent.complete(response)
+    return response
+
+def sse_event(event: str, data: dict) -> str:
+    """Formata um evento Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/send-model-stream/{chat_id}")
+async def send_model_stream(
+    chat_id: str,
+    idempotency_key: Optional[str] = Header(None),
+    repo: ChatRepository = Depends(get_repository),
+    lifecycle: WorkerLifecycle = Depends(get_lifecycle),
+):
+    """
+    Variante em stream de /send-model: envia o texto de `next_response` por SSE
+    (eventos `delta`) enquanto o JSON ainda está chegando do LLM. Ao final persiste
+    o turno exatamente como /send-model e envia o evento `done` com a mensagem final.
+    A repetição com a mesma `Idempotency-Key` recebe só o evento `done` guardado.
+    """
+    try:
+        obj_id = ObjectId(chat_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="ID de chat inválido")
+
+    sse_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    idempotent = IdempotentRequest(repo, obj_id, idempotency_key, "send-model-stream")
+    stored = await idempotent.begin()
+    if stored is not None:
+        return StreamingResponse(iter([sse_event("done", stored)]), media_type="text/event-stream", headers=sse_headers)
+
+    # O lease vai da reserva (antes de abrir o stream, para o 409 sair como resposta
+    # HTTP) até o fim do gerador, que libera o chat e a chave
+    lease = TurnLease(repo, obj_id)
+    try:
+        async with lifecycle.turns.turn():
+            chat = await lease.acquire()
+            turn_input, graph_state = await prepare_turn(chat_id, chat, repo)
+
+        # Emergência e confirmação têm resposta fixa e não passam pelo LLM; nos demais
+        # turnos, com a fila do LLM cheia, rejeita antes de abrir o stream (429 em vez de 200)
+        if turn_input is not None and router_entry(merge_update(graph_state, turn_input)) == "chatbot":
+            llm_limiter.check_capacity()
+    except BaseException:
+        await lease.release()
+        await idempotent.abandon()
+        raise
+
+    async def events():
+        updated_state = graph_state
+        try:
+            async with lifecycle.turns.turn():
+                if turn_input is not None:
+                    async for mode, chunk in get_agent_app().astream(
+                        turn_input,
+                        thread_config(chat_id, repo, stream_tokens=True),
+                        stream_mode=["custom", "values"],
+                        durability="sync",
+                    ):
+                        if mode == "custom":
+                            yield sse_event("delta", {"text": chunk["delta"]})
+                        else:
+                            updated_state = chunk
+
+                # O texto final pode diferir do que foi transmitido (erro de parsing ou emergência)
+                update_fields = build_update_fields(updated_state)
+                await repo.save_turn(obj_id, *build_turn_delta(chat, updated_state))
+            await lease.release()
+
+            done = {
+                "agent_message": updated_state["messages"][-1],
+                "is_completed": update_fields["is_completed"],
+                "status": update_fields.get("status"),
+            }
+            await idempotent.complete(done)
+        except RetryableHTTPError as e:
+            # O turno não foi processado (LLM saturado ou o worker começou a encerrar); nada é persistido
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+            return
+        finally:
+            await lease.release()
+            await idempotent.abandon()
+
+        yield sse_event("done", done)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=sse_headers)
+
+@router.get("/export/triagens")
+async def export_triagens(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    completed_since: Optional[datetime] = None,
+    status: Optional[Literal["TRIAGE_COMPLETED", "EMERGENCY_ALERT"]] = None,
+    accept_encoding: Optional[str] = Header(None),
+    repo: ChatRepository = Depends(get_repository),
+):
+    """
+    Exporta as triagens concluídas (TRIAGE_COMPLETED e EMERGENCY_ALERT) em ordem de
+    conclusão, como NDJSON (padrão) ou CSV, em stream: os chats vêm do MongoDB em
+    lotes de um único cursor e cada lote é enviado assim que chega, com memória
+    constante qualquer que seja o total. `completed_since` (ISO 8601; sem fuso,
+    UTC) traz só as concluídas depois desse instante, para exportações incrementais.
+    Com `Accept-Encoding: zstd` a resposta vem comprimida.
+    """
+    if completed_since is not None and completed_since.tzinfo is None:
+        completed_since = completed_since.replace(tzinfo=timezone.utc)
+    statuses = (status,) if status else COMPLETED_STATUSES
+
+    batches = repo.iter_completed_triages(EXPORT_BATCH_SIZE, completed_since, statuses)
+    if format == "csv":
+        body, media_type = csv_chunks(batches), "text/csv; charset=utf-8"
     else:
-        print("DEBUG 4.1 - CONDIÇÃO IGNORADA: is_confirmed é False. Continua a triagem.")
+        body, media_type = ndjson_chunks(batches), "application/x-ndjson"
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="triagens.{format}"',
+        "Vary": "Accept-Encoding",
+    }
+    if accepts_zstd(accept_encoding or ""):
+        body = zstd_chunks(body)
+        headers["Content-Encoding"] = "zstd"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: o processo responde. Não checa dependências (reiniciar o worker não as conserta)."""
+    return {"status": "ok"}
 
-    collection.update_one(
-        {"_id": ObjectId(chat_id)},
-        {"$set": update_fields}
+@router.get("/readyz")
+async def readyz(lifecycle: WorkerLifecycle = Depends(get_lifecycle)):
+    """
+    Readiness para o balanceador: 200 só com o aquecimento concluído, o MongoDB
+    respondendo ao ping e o LLM alcançável (circuit breaker fechado e checagem
+    do provedor, refeita a cada READINESS_LLM_CHECK_S). Durante o encerramento, 503.
+    """
+    ready, report = await lifecycle.readiness(ping_mongo, get_llm_policy)
+    return JSONResponse(status_code=200 if ready else 503, content={"status": "ready" if ready else "not_ready", **report})
+
+@router.get("/metrics")
+async def metrics():
+    """Métricas no formato do Prometheus: nós do grafo, LLM, MongoDB e rotas."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def retention_job_response(job: dict, **content) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content=jsonable_encoder({**content, **public_job(job)}),
+        headers={"Location": f"/retention/jobs/{job['_id']}"},
     )
 
-    # 5. Retorna a última mensagem do agente
-    agent_message = updated_state["messages"][-1]
-        
-    return {
-        "status_code": 200,
-        "agent_message": agent_message
-    }
+@router.post("/retention/jobs")
+async def create_retention_job(request: RetentionJobRequest, repo: ChatRepository = Depends(get_repository)):
+    """
+    Dispara um job de retenção em segundo plano e responde 202 na hora, com o
+    job em `Location`. `purge` apaga os chats com os `statuses` pedidos (e, com
+    `older_than_days`, só os criados antes disso), em lotes com teto de vazão;
+    `orphans` limpa mensagens e checkpoints de chats que não existem mais; `reset`
+    descarta tudo. Um job por vez: outro em andamento é 409.
+    """
+    if request.kind == "purge" and not request.statuses:
+        raise HTTPException(status_code=422, detail="Informe os status a apagar (statuses)")
+    try:
+        job = await retention.start(repo, request.kind, tuple(request.statuses), request.older_than_days)
+    except RetentionJobRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return retention_job_response(job)
+
+@router.get("/retention/jobs/{job_id}")
+async def get_retention_job(job_id: str, repo: ChatRepository = Depends(get_repository)):
+    """Estado e progresso do job (`total`, `deleted_chats`, `deleted_orphans`, `batches`)."""
+    job = await repo.get_retention_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return public_job(job)
+
+@router.delete("/retention/jobs/{job_id}")
+async def cancel_retention_job(job_id: str, repo: ChatRepository = Depends(get_repository)):
+    """Pede o cancelamento; o job para ao fim do lote atual (o que já foi apagado não volta)."""
+    job = await retention.cancel(repo, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return retention_job_response(job)
 
 @router.delete("/apagar-tudo")
-async def delete_all_data():
+async def delete_all_data(repo: ChatRepository = Depends(get_repository)):
+    """
+    Apaga todos os dados descartando as coleções (em vez de apagar documento por
+    documento) e recriando os índices, num job de retenção `reset`. Responde 202
+    com o job para acompanhar em /retention/jobs/{job_id}.
+    """
     try:
-        # apaga todos os documentos de todas as coleções
-        for collection_name in db.list_collection_names():
-            db[collection_name].delete_many({})
-        return {"status": "sucesso", "message": "Todos os dados foram apagados!"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao apagar dados: {e}")
+        job = await retention.start(repo, "reset")
+    except RetentionJobRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return retention_job_response(job, status="agendado", message="Os dados estão sendo apagados")
+
+def create_app() -> FastAPI:
+    """
+    Fábrica da aplicação. Nada aqui abre conexão: os clientes (MongoDB, LLM) e o
+    grafo são criados no aquecimento do lifespan ou no primeiro uso.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.state.lifecycle = WorkerLifecycle()
+    app.add_middleware(PrometheusMiddleware)
+    app.add_exception_handler(RetryableHTTPError, retryable_error_handler)
+    app.include_router(router)
+    return app
 
-app.include_router(router)
+app = create_app()
@@ -0,0 +1,77 @@
+"""
+Migração do histórico: move o array `messages` de cada documento de chat_data
+para a coleção chat_messages, em buckets de MESSAGES_BUCKET_SIZE mensagens
+(o formato lido e gravado pelo ChatRepository).
+
+Pode ser repetida e retomada: só passa pelos chats que ainda têm o array, os
+buckets são gravados por substituição e o array só é removido se não mudou
+desde a leitura (chats alterados no meio ficam para a próxima execução).
+Rode a partir da pasta `server`, de preferência com a API parada:
+
+    python -m migrations.bucket_messages --dry-run
+    python -m migrations.bucket_messages
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+
+from pymongo import ReplaceOne
+
+from database.configurations import get_db
+from database.repository import ChatRepository, group_by_bucket
+
+async def migrate_chat(repo: ChatRepository, chat, dry_run: bool) -> bool:
+    """Migra um chat; False se ele mudou durante a migração e foi pulado."""
+    original = chat["messages"]
+    # Chats muito antigos têm mensagens sem id: o id vira a posição no histórico
+    messages = [{**msg, "id": msg.get("id") or idx} for idx, msg in enumerate(original, start=1)]
+    if dry_run:
+        return True
+
+    if messages:
+        await repo.messages.bulk_write([
+            ReplaceOne(
+                {"chat_id": chat["_id"], "seq": seq},
+                {"chat_id": chat["_id"], "seq": seq, "count": len(group), "messages": group},
+                upsert=True,
+            )
+            for seq, group in group_by_bucket(messages)
+        ])
+
+    result = await repo.collection.update_one(
+        {"_id": chat["_id"], "messages": {"$size": len(original)}},
+        {
+            "$unset": {"messages": ""},
+            "$max": {"message_seq": max((msg["id"] for msg in messages), default=0)},
+            "$set": {"lastMessage": chat.get("lastMessage") or (messages[-1]["text"] if messages else None)},
+        },
+    )
+    return result.matched_count == 1
+
+async def main(batch_size: int, dry_run: bool):
+    repo = ChatRepository(get_db())
+    await repo.ensure_indexes()
+
+    migrated = skipped = moved = 0
+    cursor = repo.collection.find({"messages": {"$exists": True}}, batch_size=batch_size)
+    async for chat in cursor:
+        if await migrate_chat(repo, chat, dry_run):
+            migrated += 1
+            moved += len(chat["messages"])
+        else:
+            skipped += 1
+        if (migrated + skipped) % batch_size == 0:
+            print(f"{migrated + skipped} chats processados...")
+
+    action = "a migrar" if dry_run else "migrados"
+    print(f"chats {action}: {migrated} ({moved} mensagens) | alterados durante a migração (rode de novo): {skipped}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="chats lidos por lote do cursor")
+    parser.add_argument("--dry-run", action="store_true", help="só conta os chats e mensagens a migrar")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
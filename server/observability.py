@@ -0,0 +1,179 @@
+import functools
+import inspect
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+
+# --- CONFIGURAÇÃO DE LOG ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Fração dos logs DEBUG/INFO emitidos (WARNING em diante sai sempre)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# Baldes em segundos: de operações de banco (ms) até chamadas ao LLM (dezenas de s)
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+NODE_LATENCY = Histogram(
+    "chatbot_graph_node_seconds", "Duração de cada nó do grafo", ["node"], buckets=_LATENCY_BUCKETS
+)
+LLM_LATENCY = Histogram(
+    "chatbot_llm_request_seconds", "Duração das chamadas ao LLM (sem a espera na fila)",
+    ["mode", "outcome"], buckets=_LATENCY_BUCKETS,
+)
+LLM_QUEUE_WAIT = Histogram(
+    "chatbot_llm_queue_wait_seconds", "Espera por uma vaga no limitador de chamadas ao LLM", buckets=_LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens_total", "Tokens enviados e recebidos do LLM (cached: parte dos enviados lida do cache)",
+    ["direction"],
+)
+LLM_PREFIX_CACHE_EVENTS = Counter(
+    "chatbot_llm_prefix_cache_events_total",
+    "Ciclo de vida da instrução de sistema em cache no provedor (create, refresh, invalidate, drop, skip, error)",
+    ["event"],
+)
+LLM_PARSE_FAILURES = Counter(
+    "chatbot_llm_parse_failures_total", "Respostas do LLM que não puderam ser interpretadas", ["reason"]
+)
+LLM_RESILIENCE_EVENTS = Counter(
+    "chatbot_llm_resilience_events_total",
+    "Eventos da política de chamadas ao LLM (retry, timeout, hedge, repair, partial_json, circuit_open)",
+    ["event"],
+)
+LLM_CIRCUIT_OPEN = Gauge("chatbot_llm_circuit_open", "1 se o circuit breaker do LLM está aberto")
+MONGO_LATENCY = Histogram(
+    "chatbot_mongo_operation_seconds", "Duração dos comandos enviados ao MongoDB",
+    ["collection", "operation", "outcome"], buckets=_LATENCY_BUCKETS,
+)
+LLM_CACHE_REQUESTS = Counter(
+    "chatbot_llm_cache_requests_total", "Consultas ao cache de respostas do LLM", ["tier", "result"]
+)
+HTTP_LATENCY = Histogram(
+    "chatbot_http_request_seconds", "Duração das requisições HTTP até o fim da resposta",
+    ["method", "route", "status"], buckets=_LATENCY_BUCKETS,
+)
+
+class SamplingFilter(logging.Filter):
+    """Deixa passar só uma fração `rate` dos registros abaixo de WARNING."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+def configure_logging() -> None:
+    """Configura o log da aplicação a partir de LOG_LEVEL e LOG_SAMPLE_RATE."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+# Durações dos nós coletadas por execução (ver node_timings); None fora de uma coleta
+_NODE_TIMINGS: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("node_timings", default=None)
+
+@contextmanager
+def node_timings():
+    """
+    Coleta (nó, segundos) de cada nó executado neste contexto, além do
+    histograma, para medir execuções isoladas (replay de conversas gravadas).
+    """
+    timings: List[Tuple[str, float]] = []
+    token = _NODE_TIMINGS.set(timings)
+    try:
+        yield timings
+    finally:
+        _NODE_TIMINGS.reset(token)
+
+def _observe_node(name: str, histogram, seconds: float) -> None:
+    histogram.observe(seconds)
+    timings = _NODE_TIMINGS.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+def timed_node(name: str, node):
+    """Envolve um nó do grafo (síncrono ou assíncrono) medindo sua duração em NODE_LATENCY."""
+    histogram = NODE_LATENCY.labels(node=name)
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await node(*args, **kwargs)
+            finally:
+                _observe_node(name, histogram, time.perf_counter() - start)
+    else:
+        @functools.wraps(node)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return node(*args, **kwargs)
+            finally:
+                _observe_node(name, histogram, time.perf_counter() - start)
+    return wrapper
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Listener de comandos do PyMongo: mede cada comando por coleção e operação.
+    Cobre tudo que passa pelo cliente (repositório e checkpointer) sem tocar nas chamadas.
+    """
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def _observe(self, event, outcome: str) -> None:
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_LATENCY.labels(collection=collection, operation=event.command_name, outcome=outcome).observe(
+            event.duration_micros / 1_000_000
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._observe(event, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._observe(event, "error")
+
+class PrometheusMiddleware:
+    """
+    Middleware ASGI que mede cada requisição HTTP até o último byte da resposta
+    (inclui o tempo das respostas em stream). A rota é o template do FastAPI
+    (ex.: /send/{chat_id}), não o caminho, para manter poucas séries.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_LATENCY.labels(
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status["code"]),
+            ).observe(time.perf_counter() - start)
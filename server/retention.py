@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from bson import ObjectId
+
+from database.configurations import get_checkpointer
+from database.repository import COMPLETED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Chats não concluídos sem atividade há este prazo são apagados pelo índice TTL do MongoDB.
+# Opcional: sem a variável (ou com 0) não há índice, e um índice criado antes é removido
+ABANDONED_CHAT_TTL_DAYS = float(os.getenv("ABANDONED_CHAT_TTL_DAYS", "0"))
+# Tamanho dos lotes e teto de chats apagados por segundo, para a limpeza não disputar o banco com o tráfego
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_MAX_CHATS_PER_S = float(os.getenv("RETENTION_MAX_CHATS_PER_S", "1000"))
+# Intervalo da varredura em segundo plano (política abaixo e órfãos do TTL); 0 desliga
+RETENTION_SWEEP_INTERVAL_S = float(os.getenv("RETENTION_SWEEP_INTERVAL_S", "3600"))
+# Triagens concluídas mais antigas que isto são apagadas pela varredura; 0 guarda para sempre
+RETENTION_COMPLETED_MAX_AGE_DAYS = float(os.getenv("RETENTION_COMPLETED_MAX_AGE_DAYS", "0"))
+# Um job em andamento sem sinal de vida há mais que isto ficou de um worker que caiu
+RETENTION_JOB_STALE_S = float(os.getenv("RETENTION_JOB_STALE_S", "60"))
+
+class RetentionJobCancelled(Exception):
+    """Cancelamento pedido pela API (possivelmente em outro worker)."""
+
+class RetentionJobRunning(Exception):
+    """Já há um job de retenção em andamento (neste ou em outro worker)."""
+
+    def __init__(self, job_id: str):
+        super().__init__(f"Já há um job de retenção em andamento: {job_id}")
+        self.job_id = job_id
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job de retenção como devolvido pela API."""
+    return {"job_id": job["_id"], **{key: value for key, value in job.items() if key != "_id"}}
+
+class RetentionEngine:
+    """
+    Retenção dos dados dos chats, sem apagar documento por documento nem
+    bloquear o tráfego:
+
+    - chats abandonados (não concluídos, sem atividade) saem pelo índice TTL do
+      MongoDB, sem trabalho da API, se ABANDONED_CHAT_TTL_DAYS estiver definido;
+    - jobs em segundo plano, um por vez entre os workers (garantido por um
+      índice único parcial no MongoDB), apagam em lotes de
+      RETENTION_BATCH_SIZE com teto de RETENTION_MAX_CHATS_PER_S: `purge` filtra
+      por status e idade, `orphans` limpa mensagens e checkpoints de chats que já
+      não existem (como os removidos pelo TTL) e `reset` descarta as coleções
+      inteiras e recria os índices;
+    - o progresso de cada job fica na coleção retention_jobs, legível de qualquer
+      worker.
+    """
+
+    def __init__(self, ensure_indexes: Callable[[Any], Awaitable[None]]):
+        self.ensure_indexes = ensure_indexes
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def ensure_ttl(self, repo) -> None:
+        if ABANDONED_CHAT_TTL_DAYS > 0:
+            await repo.ensure_abandoned_chat_ttl(ABANDONED_CHAT_TTL_DAYS * 86400)
+        else:
+            await repo.drop_abandoned_chat_ttl()
+
+    async def start(
+        self, repo, kind: str, statuses: Tuple[str, ...] = (), older_than_days: Optional[float] = None, source: str = "api"
+    ) -> Dict[str, Any]:
+        """Registra e dispara um job; RetentionJobRunning se outro job está em andamento."""
+        now = datetime.now(timezone.utc)
+        job = {
+            "_id": uuid.uuid4().hex,
+            "kind": kind,
+            "statuses": list(statuses),
+            "older_than_days": older_than_days,
+            "source": source,
+            "state": "running",
+            "created_at": now,
+            "heartbeat_at": now,
+            "finished_at": None,
+            "total": None,
+            "deleted_chats": 0,
+            "deleted_orphans": 0,
+            "batches": 0,
+            "cancel_requested": False,
+            "error": None,
+        }
+        running = await repo.start_retention_job(job, now - timedelta(seconds=RETENTION_JOB_STALE_S))
+        if running is not None:
+            raise RetentionJobRunning(running["_id"])
+        task = asyncio.create_task(self._run(repo, job))
+        self.tasks[job["_id"]] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job["_id"], None))
+        return job
+
+    async def cancel(self, repo, job_id: str) -> Optional[Dict[str, Any]]:
+        """Pede o cancelamento; o job para no fim do lote atual, em qualquer worker."""
+        job = await repo.get_retention_job(job_id)
+        if job is not None and job["state"] == "running":
+            await repo.update_retention_job(job_id, {"cancel_requested": True})
+            job["cancel_requested"] = True
+        return job
+
+    async def _run(self, repo, job: Dict[str, Any]) -> None:
+        state, error = "done", None
+        try:
+            if job["kind"] == "purge":
+                await self._purge(repo, job)
+            elif job["kind"] == "orphans":
+                await self._sweep_orphans(repo, job)
+            else:
+                await self._reset(repo, job)
+        except (RetentionJobCancelled, asyncio.CancelledError):
+            state = "cancelled"
+        except Exception as e:
+            state, error = "failed", repr(e)
+            logger.exception("Job de retenção %s (%s) falhou", job["_id"], job["kind"])
+        finally:
+            now = datetime.now(timezone.utc)
+            # shield: o estado final é gravado mesmo quando o worker cancela o job ao encerrar
+            await asyncio.shield(repo.update_retention_job(
+                job["_id"], {"state": state, "error": error, "finished_at": now, "heartbeat_at": now}
+            ))
+            logger.info("Job de retenção %s (%s): %s", job["_id"], job["kind"], state)
+
+    async def _batch_done(self, repo, job: Dict[str, Any], started: float, count: int, **inc: int) -> None:
+        """Progresso e sinal de vida do lote, checagem de cancelamento e pausa até o teto de chats/s."""
+        await repo.update_retention_job(job["_id"], {"heartbeat_at": datetime.now(timezone.utc)}, {"batches": 1, **inc})
+        current = await repo.get_retention_job(job["_id"])
+        # Cancelado pela API, ou dado como morto por falta de sinal de vida (outro job já pode ter começado)
+        if current is not None and (current.get("cancel_requested") or current["state"] != "running"):
+            raise RetentionJobCancelled()
+        await asyncio.sleep(max(0.0, count / RETENTION_MAX_CHATS_PER_S - (time.monotonic() - started)))
+
+    async def _purge(self, repo, job: Dict[str, Any]) -> None:
+        statuses = tuple(job["statuses"])
+        created_before = None
+        if job["older_than_days"] is not None:
+            # `creation` é o timestamp (s) de criação do chat
+            created_before = int(time.time() - job["older_than_days"] * 86400)
+        total = await repo.count_purgeable_chats(statuses, created_before)
+        await repo.update_retention_job(job["_id"], {"total": total})
+
+        checkpointer = get_checkpointer()
+        while True:
+            started = time.monotonic()
+            chat_ids = await repo.find_purgeable_chats(statuses, created_before, RETENTION_BATCH_SIZE)
+            if not chat_ids:
+                return
+            await checkpointer.adelete_threads([str(chat_id) for chat_id in chat_ids])
+            deleted = await repo.delete_chats(chat_ids)
+            await self._batch_done(repo, job, started, len(chat_ids), deleted_chats=deleted)
+
+    async def _sweep_orphans(self, repo, job: Dict[str, Any]) -> None:
+        checkpointer = get_checkpointer()
+        # Mensagens (e chaves de idempotência) de chats que não existem mais
+        after: Optional[ObjectId] = None
+        while True:
+            started = time.monotonic()
+            orphans, after = await repo.find_orphan_chat_ids(after, RETENTION_BATCH_SIZE)
+            if after is None:
+                break
+            await checkpointer.adelete_threads([str(chat_id) for chat_id in orphans])
+            await repo.delete_chats(orphans)
+            await self._batch_done(repo, job, started, len(orphans), deleted_orphans=len(orphans))
+
+        # Checkpoints de chats que não existem mais (thread_id = id do chat)
+        last_thread: Optional[str] = None
+        while True:
+            started = time.monotonic()
+            thread_ids = await checkpointer.athread_ids(last_thread, RETENTION_BATCH_SIZE)
+            if not thread_ids:
+                return
+            last_thread = thread_ids[-1]
+            chat_ids = {thread_id: ObjectId(thread_id) for thread_id in thread_ids if ObjectId.is_valid(thread_id)}
+            existing = await repo.existing_chat_ids(list(chat_ids.values()))
+            orphans = [thread_id for thread_id, chat_id in chat_ids.items() if chat_id not in existing]
+            await checkpointer.adelete_threads(orphans)
+            await self._batch_done(repo, job, started, len(orphans), deleted_orphans=len(orphans))
+
+    async def _reset(self, repo, job: Dict[str, Any]) -> None:
+        dropped = await repo.drop_all()
+        await repo.update_retention_job(job["_id"], {"dropped_collections": dropped, "heartbeat_at": datetime.now(timezone.utc)})
+        # Checkpointer fora do banco (CHECKPOINTER=memory): as threads são apagadas uma a uma
+        checkpointer = get_checkpointer()
+        while thread_ids := await checkpointer.athread_ids(None, RETENTION_BATCH_SIZE):
+            await checkpointer.adelete_threads(thread_ids)
+        await self.ensure_indexes(repo)
+
+    async def wait(self, job_id: str) -> None:
+        task = self.tasks.get(job_id)
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def run_periodic(self, get_repo: Callable[[], Any]) -> None:
+        """
+        Varredura em segundo plano a cada RETENTION_SWEEP_INTERVAL_S: triagens
+        concluídas além de RETENTION_COMPLETED_MAX_AGE_DAYS (se definido) e órfãos.
+        Com vários workers, quem encontra um job em andamento pula a rodada.
+        """
+        while True:
+            await asyncio.sleep(RETENTION_SWEEP_INTERVAL_S)
+            try:
+                repo = get_repo()
+                if RETENTION_COMPLETED_MAX_AGE_DAYS > 0:
+                    job = await self.start(repo, "purge", COMPLETED_STATUSES, RETENTION_COMPLETED_MAX_AGE_DAYS, source="schedule")
+                    await self.wait(job["_id"])
+                job = await self.start(repo, "orphans", source="schedule")
+                await self.wait(job["_id"])
+            except RetentionJobRunning:
+                logger.debug("Varredura de retenção pulada: outro job em andamento")
+            except Exception as e:
+                logger.warning("Varredura de retenção falhou: %r", e)
+
+    async def shutdown(self) -> None:
+        """Cancela os jobs deste worker (ficam como `cancelled`; podem ser disparados de novo)."""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
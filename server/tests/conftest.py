@@ -0,0 +1,49 @@
+"""
+Testes sem MongoDB nem rede: o InMemoryChatRepository e o checkpointer em
+memória no lugar do banco e o StubProvider no lugar do Gemini. Rode a partir
+da pasta `server`:
+
+    pip install -r requirements-dev.txt
+    python -m pytest
+"""
+import os
+
+# Configuração lida na importação dos módulos: vem antes de qualquer import da aplicação
+os.environ.update(
+    LLM_PROVIDER="stub",
+    LLM_STUB_LATENCY_S="0",
+    LLM_STUB_JITTER_S="0",
+    LLM_RETRY_BACKOFF_S="0",
+    CHECKPOINTER="memory",
+    RETENTION_SWEEP_INTERVAL_S="0",
+)
+os.environ.pop("MONGO_URI", None)
+os.environ.pop("GOOGLE_API_KEY", None)
+
+import httpx
+import pytest
+
+import main
+from database.configurations import get_repository
+from database.memory import InMemoryChatRepository
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def repo():
+    return InMemoryChatRepository()
+
+@pytest.fixture
+async def client(repo):
+    """Cliente da API com o repositório em memória (o checkpointer em memória vem de CHECKPOINTER)."""
+    app = main.create_app()
+    app.dependency_overrides[get_repository] = lambda: repo
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+        yield c
+
+@pytest.fixture
+async def chat_id(client):
+    response = await client.post("/criar-chat", json={"title": "Teste"})
+    return response.json()["_id"]
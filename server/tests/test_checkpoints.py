@@ -0,0 +1,112 @@
+import pytest
+from bson import ObjectId
+
+import agent.default_agent as default_agent
+from agent.context import STATE_MAX_MESSAGES
+from database.configurations import get_checkpointer
+
+pytestmark = pytest.mark.anyio
+
+def stored(chat_id: str) -> tuple[int, int, int]:
+    """Checkpoints, versões de canais e escritas pendentes guardados para o chat."""
+    saver = get_checkpointer()
+    return (
+        len(saver.storage[chat_id][""]),
+        sum(1 for key in saver.blobs if key[0] == chat_id),
+        sum(1 for key in saver.writes if key[0] == chat_id),
+    )
+
+async def graph_state(chat_id: str):
+    return (await default_agent.get_agent_app().aget_state(default_agent.thread_config(chat_id))).values
+
+async def send(client, chat_id, text):
+    response = await client.post(f"/send/{chat_id}", json={"text": text, "sender": "user"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+async def test_storage_stays_bounded(client, chat_id):
+    sizes = []
+    for turn in range(12):
+        await send(client, chat_id, f"resposta número {turn}")
+        sizes.append(stored(chat_id))
+
+    # Depois dos primeiros turnos, o que fica guardado não cresce mais com a conversa
+    assert sizes[-1] == sizes[5]
+    assert sizes[-1][0] <= 5
+
+    values = await graph_state(chat_id)
+    assert len(values["messages"]) == STATE_MAX_MESSAGES
+    assert values["summary_upto"] > 0
+    # O histórico completo continua em chat_messages
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    assert [msg["id"] for msg in messages] == list(range(1, 25))
+
+async def test_messages_between_turns_go_to_the_summary(client, repo, chat_id):
+    await send(client, chat_id, "Oi")
+    for idx in range(STATE_MAX_MESSAGES + 5):
+        await repo.append_message(ObjectId(chat_id), {"text": f"detalhe {idx}", "sender": "user"})
+    await send(client, chat_id, "É isso")
+
+    values = await graph_state(chat_id)
+    assert len(values["messages"]) <= STATE_MAX_MESSAGES
+    # Nenhuma mensagem descartada do estado ficou fora do resumo
+    assert "- detalhe 0" in values["summary"].splitlines()
+    assert values["summary_upto"] >= values["messages"][0]["id"] - 1
+
+async def test_legacy_history_is_folded(repo):
+    messages = [
+        {"id": idx, "text": f"mensagem {idx}", "sender": "user" if idx % 2 else "model"}
+        for idx in range(1, 41)
+    ]
+    state = default_agent.load_state({"messages": messages})
+    assert state["messages"] == messages[-STATE_MAX_MESSAGES:]
+    assert "- mensagem 1" in state["summary"].splitlines()
+    assert state["summary_upto"] >= 40 - STATE_MAX_MESSAGES
+
+async def test_resume_after_crash(client, repo, chat_id, monkeypatch):
+    for turn in range(4):
+        await send(client, chat_id, f"resposta número {turn}")
+
+    # O worker cai depois da chamada ao LLM, antes do fim do turno
+    search = default_agent.emergency_detector.search
+    calls = []
+
+    def crash(text):
+        calls.append(text)
+        if len(calls) == 2:
+            raise RuntimeError("worker caiu")
+        return search(text)
+
+    monkeypatch.setattr(default_agent.emergency_detector, "search", crash)
+    with pytest.raises(RuntimeError):
+        await send(client, chat_id, "tomei dipirona")
+    monkeypatch.setattr(default_agent.emergency_detector, "search", search)
+
+    # O próximo envio termina o turno interrompido a partir do checkpoint e responde
+    await send(client, chat_id, "mais alguma coisa?")
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    ids = [msg["id"] for msg in messages]
+    assert ids == sorted(set(ids))
+    assert [msg["sender"] for msg in messages][-4:] == ["user", "model", "user", "model"]
+
+async def test_reply_of_an_unsaved_turn_is_saved_next_turn(client, repo, chat_id, monkeypatch):
+    await send(client, chat_id, "Oi")
+
+    # O grafo termina o turno, mas a gravação em chat_messages falha
+    save_turn = repo.save_turn
+
+    async def failing(*args):
+        raise RuntimeError("MongoDB fora do ar")
+
+    monkeypatch.setattr(repo, "save_turn", failing)
+    with pytest.raises(RuntimeError):
+        await send(client, chat_id, "dor de cabeça")
+    monkeypatch.setattr(repo, "save_turn", save_turn)
+
+    await send(client, chat_id, "há dois dias")
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    assert [msg["id"] for msg in messages] == list(range(1, 7))
+    assert [msg["sender"] for msg in messages] == ["user", "model"] * 3
+    # O histórico visível é o mesmo que o grafo tem no estado
+    values = await graph_state(chat_id)
+    assert [msg["id"] for msg in values["messages"]] == list(range(1, 7))
@@ -0,0 +1,35 @@
+import pytest
+
+from agent.default_agent import confirmation_matcher, emergency_detector
+from agent.emergency import KeywordMatcher, normalize_text
+
+@pytest.mark.parametrize("text, category", [
+    ("Meu pai desmaiou agora", "neurologico"),
+    ("eu desmaiei no banho", "neurologico"),
+    ("Tenho hemorragias nasais", "hemorragia_trauma"),
+    ("ando com TAQUICARDIAS à noite", "cardiovascular"),
+    ("teve convulsões ontem", "outros_criticos"),
+    ("Estou com dor no peito!!", "cardiovascular"),
+    ("nao consigo respirar direito", "respiratorio"),
+])
+def test_inflected_emergency_terms(text, category):
+    match = emergency_detector.search(text)
+    assert match is not None
+    assert match.category == category
+
+@pytest.mark.parametrize("text", ["Estou com dor de cabeça", "tomei dipirona", "predesmaio"])
+def test_no_emergency(text):
+    assert emergency_detector.search(text) is None
+
+def test_confirmation_needs_whole_words():
+    assert confirmation_matcher.search("Sim, pode salvar") is not None
+    assert confirmation_matcher.search("é assim mesmo") is None
+    assert confirmation_matcher.search("está incorreto") is None
+
+def test_longest_term_wins():
+    matcher = KeywordMatcher({"curto": ["dor"], "longo": ["dor no peito"]})
+    assert matcher.search("dor no peito").term == "dor no peito"
+    assert matcher.search("dores fortes").category == "curto"
+
+def test_normalize_text():
+    assert normalize_text("  Parada   CARDÍACA!! ") == "parada cardiaca"
@@ -0,0 +1,57 @@
+import csv
+import io
+from datetime import datetime, timezone
+
+import orjson
+import pytest
+
+from export import CSV_COLUMNS
+
+pytestmark = pytest.mark.anyio
+
+async def completed_chat(repo, status="TRIAGE_COMPLETED", day=1, **triagem):
+    return await repo.create_chat({
+        "title": "Triagem",
+        "status": status,
+        "completed_at": datetime(2026, 10, day, tzinfo=timezone.utc),
+        "triagem": triagem,
+    })
+
+async def test_empty_ndjson(client):
+    response = await client.get("/export/triagens")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.content == b""
+
+async def test_empty_csv_has_header(client):
+    response = await client.get("/export/triagens", params={"format": "csv"})
+    assert response.status_code == 200
+    assert list(csv.reader(io.StringIO(response.text))) == [CSV_COLUMNS]
+
+async def test_ndjson_in_completion_order(client, repo):
+    second = await completed_chat(repo, day=2, queixa_principal="febre")
+    first = await completed_chat(repo, status="EMERGENCY_ALERT", day=1)
+    await repo.create_chat({"title": "Em andamento"})
+
+    response = await client.get("/export/triagens")
+    records = [orjson.loads(line) for line in response.content.splitlines()]
+    assert [record["chat_id"] for record in records] == [first, second]
+    assert records[1]["triagem"]["queixa_principal"] == "febre"
+    assert records[1]["completed_at"] == "2026-10-02T00:00:00+00:00"
+
+    response = await client.get("/export/triagens", params={"completed_since": "2026-10-01T12:00:00"})
+    assert [orjson.loads(line)["chat_id"] for line in response.content.splitlines()] == [second]
+
+async def test_csv_rows(client, repo):
+    chat_id = await completed_chat(repo, queixa_principal="dor, forte")
+    response = await client.get("/export/triagens", params={"format": "csv"})
+    header, row = list(csv.reader(io.StringIO(response.text)))
+    assert header == CSV_COLUMNS
+    assert row[0] == chat_id
+    assert row[CSV_COLUMNS.index("queixa_principal")] == "dor, forte"
+
+async def test_zstd(client):
+    response = await client.get("/export/triagens", params={"format": "csv"}, headers={"Accept-Encoding": "zstd"})
+    assert response.headers["content-encoding"] == "zstd"
+    # O httpx descomprime o corpo sozinho
+    assert response.text.splitlines() == [",".join(CSV_COLUMNS)]
@@ -0,0 +1,49 @@
+import pytest
+from bson import ObjectId
+
+from agent.default_agent import get_llm_policy
+
+pytestmark = pytest.mark.anyio
+
+async def test_reply_id_comes_from_the_chat_counter(client, repo, chat_id, monkeypatch):
+    """Uma mensagem gravada no chat durante a chamada ao LLM não divide o id com a resposta."""
+    provider = get_llm_policy().provider
+    generate = provider.generate
+
+    async def append_during_call(prompt):
+        await repo.append_message(ObjectId(chat_id), {"text": "mensagem no meio do turno", "sender": "user"})
+        return await generate(prompt)
+
+    monkeypatch.setattr(provider, "generate", append_during_call)
+    response = await client.post(f"/send/{chat_id}", json={"text": "Oi", "sender": "user"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["user_message"]["id"] == 1
+    assert body["agent_message"]["id"] == 3
+
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    assert [(msg["id"], msg["sender"]) for msg in messages] == [(1, "user"), (2, "user"), (3, "model")]
+    # O cliente que parou no id 2 recebe a resposta
+    messages = (await client.get(f"/chat-messages/{chat_id}", params={"since": 2})).json()
+    assert [msg["id"] for msg in messages] == [3]
+
+async def test_reserved_id_does_not_advance_the_etag(client, repo, chat_id):
+    await repo.append_message(ObjectId(chat_id), {"text": "Oi", "sender": "user"})
+    reserved = await repo.allocate_message_id(ObjectId(chat_id))
+    assert reserved == 2
+
+    response = await client.get(f"/chat-messages/{chat_id}")
+    etag = response.headers["etag"]
+    assert etag == 'W/"1"'
+    response = await client.get(f"/chat-messages/{chat_id}", params={"since": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Gravada a mensagem reservada, o mesmo ETag já não vale
+    await repo.save_turn(ObjectId(chat_id), [{"id": reserved, "text": "Olá", "sender": "model"}], {})
+    response = await client.get(f"/chat-messages/{chat_id}", params={"since": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [msg["id"] for msg in response.json()] == [2]
+    assert response.headers["etag"] == 'W/"2"'
+
+async def test_allocate_on_missing_chat(repo):
+    assert await repo.allocate_message_id(ObjectId()) is None
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+from database.repository import MESSAGES_BUCKET_SIZE
+from migrations.bucket_messages import migrate_chat
+
+pytestmark = pytest.mark.anyio
+
+class RecordingCollection:
+    """Guarda os comandos recebidos; `matched` é o resultado do update_one (0: o chat mudou)."""
+
+    def __init__(self, matched: int = 1):
+        self.matched = matched
+        self.calls = []
+
+    async def bulk_write(self, requests, **kwargs):
+        self.calls.append(("bulk_write", requests))
+
+    async def update_one(self, query, update):
+        self.calls.append(("update_one", query, update))
+        return SimpleNamespace(matched_count=self.matched)
+
+def legacy_chat(count: int):
+    messages = [{"text": f"m{idx}", "sender": "user" if idx % 2 else "model"} for idx in range(1, count + 1)]
+    # Só os mais recentes tinham id
+    for idx, msg in enumerate(messages, start=1):
+        if idx > 3:
+            msg["id"] = idx
+    return {"_id": ObjectId(), "messages": messages, "lastMessage": None}
+
+def repo_stub(matched: int = 1):
+    return SimpleNamespace(messages=RecordingCollection(), collection=RecordingCollection(matched))
+
+async def test_moves_messages_into_buckets():
+    chat = legacy_chat(MESSAGES_BUCKET_SIZE + 5)
+    repo = repo_stub()
+
+    assert await migrate_chat(repo, chat, dry_run=False)
+
+    [(_, requests)] = repo.messages.calls
+    buckets = [request._doc for request in requests]
+    assert [bucket["seq"] for bucket in buckets] == [0, 1]
+    assert [bucket["count"] for bucket in buckets] == [MESSAGES_BUCKET_SIZE, 5]
+    ids = [msg["id"] for bucket in buckets for msg in bucket["messages"]]
+    assert ids == list(range(1, MESSAGES_BUCKET_SIZE + 6))
+
+    [(_, query, update)] = repo.collection.calls
+    # O array só sai se não mudou desde a leitura
+    assert query == {"_id": chat["_id"], "messages": {"$size": MESSAGES_BUCKET_SIZE + 5}}
+    assert update["$unset"] == {"messages": ""}
+    assert update["$max"] == {"message_seq": MESSAGES_BUCKET_SIZE + 5}
+    assert update["$set"] == {"lastMessage": f"m{MESSAGES_BUCKET_SIZE + 5}"}
+
+async def test_chat_changed_during_migration_is_skipped():
+    repo = repo_stub(matched=0)
+    assert not await migrate_chat(repo, legacy_chat(3), dry_run=False)
+
+async def test_dry_run_writes_nothing():
+    repo = repo_stub()
+    assert await migrate_chat(repo, legacy_chat(3), dry_run=True)
+    assert repo.messages.calls == [] and repo.collection.calls == []
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from agent.default_agent import apply_model_output
+from agent.parsing import ModelOutputError, merge_triagem, parse_model_output
+
+REPLY = {
+    "next_response": "Há quanto tempo?",
+    "triagem_data": {"queixa_principal": "dor de cabeça", "intensidade": 7, "emergency_alert": False},
+}
+
+def test_plain_json():
+    parsed = parse_model_output(json.dumps(REPLY))
+    assert parsed.reply.next_response == "Há quanto tempo?"
+    assert parsed.reply.triagem_data.intensidade == "7"
+    assert not parsed.partial
+
+def test_markdown_fence_and_surrounding_text():
+    text = "Claro! Segue:\n```json\n" + json.dumps(REPLY) + "\n```\nObrigado."
+    parsed = parse_model_output(text)
+    assert parsed.reply.triagem_data.queixa_principal == "dor de cabeça"
+    assert not parsed.partial
+
+def test_truncated_json_keeps_complete_fields():
+    text = json.dumps(REPLY)
+    cut = text[:text.index('"intensidade"') + len('"intensidade": ')]
+    parsed = parse_model_output(cut)
+    assert parsed.partial
+    assert parsed.reply.next_response == "Há quanto tempo?"
+    assert parsed.reply.triagem_data.model_fields_set == {"queixa_principal"}
+
+def test_truncated_json_rejected_when_not_tolerant():
+    text = json.dumps(REPLY)[:-10]
+    with pytest.raises(ModelOutputError) as error:
+        parse_model_output(text, tolerant=False)
+    assert error.value.reason == "json"
+
+def test_truncated_inside_next_response_is_an_error():
+    with pytest.raises(ModelOutputError) as error:
+        parse_model_output('{"next_response": "Há quanto')
+    assert error.value.reason == "json"
+
+def test_schema_error():
+    with pytest.raises(ModelOutputError) as error:
+        parse_model_output(json.dumps({"triagem_data": {}}))
+    assert error.value.reason == "schema"
+
+def test_merge_triagem():
+    previous = {"queixa_principal": "febre", "duracao_frequencia": "2 dias"}
+    full = parse_model_output(json.dumps(REPLY))
+    assert merge_triagem(previous, full)["duracao_frequencia"] == ""
+
+    text = json.dumps(REPLY)
+    partial = parse_model_output(text[:text.index('"intensidade"') + len('"intensidade": ')])
+    assert merge_triagem(previous, partial) == {"queixa_principal": "dor de cabeça", "duracao_frequencia": "2 dias"}
+
+    no_triagem = parse_model_output(json.dumps({"next_response": "Oi"}))
+    assert merge_triagem(previous, no_triagem) is previous
+
+STATE = {"messages": [{"id": 1, "text": "Oi", "sender": "user"}], "triagem": {"queixa_principal": "febre"}, "turn_count": 2}
+
+def test_turn_with_truncated_reply_keeps_complete_fields():
+    text = json.dumps(REPLY)
+    update = apply_model_output(STATE, text[:text.index('"intensidade"') + len('"intensidade": ')], {}, 2)
+    assert update["messages"] == [{"id": 2, "text": "Há quanto tempo?", "sender": "model"}]
+    assert update["triagem"]["queixa_principal"] == "dor de cabeça"
+    assert update["turn_count"] == 3
+
+@pytest.mark.parametrize("raw", [None, "não é JSON", json.dumps({"triagem_data": {}})])
+def test_turn_with_invalid_reply_falls_back(raw):
+    update = apply_model_output(STATE, raw, {"summary_upto": 1}, 2)
+    assert update["messages"][0]["id"] == 2
+    assert update["messages"][0]["text"].startswith("Houve um erro no processamento")
+    # A triagem anterior fica intacta e o resumo do prompt é gravado mesmo assim
+    assert update["triagem"] is STATE["triagem"]
+    assert update["summary_upto"] == 1
@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import pytest
+
+from agent.concurrency import LLMUnavailable
+from agent.default_agent import build_repair_prompt, valid_model_output
+from agent.llm import LLMProvider, Prompt, TransientLLMError
+from agent.resilience import CircuitBreaker, LLMCallPolicy
+
+pytestmark = pytest.mark.anyio
+
+PROMPT = Prompt(system="sistema")
+
+class FaultyProvider(LLMProvider):
+    """Provedor cujas respostas (texto ou exceção) vêm de uma fila; `hang` segura a chamada até ser cancelada."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def _next(self) -> str:
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if outcome == "hang":
+            await asyncio.Event().wait()
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    async def generate(self, prompt: Prompt) -> str:
+        return await self._next()
+
+    async def stream(self, prompt: Prompt):
+        yield await self._next()
+        yield " fim"
+
+def make_policy(provider) -> LLMCallPolicy:
+    return LLMCallPolicy(
+        provider, timeout=5, max_attempts=1, backoff=0, backoff_max=0,
+        hedge=False, hedge_delay=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0),
+    )
+
+async def open_breaker(policy: LLMCallPolicy) -> None:
+    policy.provider.outcomes.insert(0, TransientLLMError("fora do ar"))
+    with pytest.raises(TransientLLMError):
+        await policy._call(PROMPT)
+    assert policy.breaker.is_open
+
+async def test_success_closes_the_breaker():
+    policy = make_policy(FaultyProvider())
+    await open_breaker(policy)
+    assert await policy._call(PROMPT) == "ok"
+    assert not policy.breaker.is_open
+
+async def test_transient_failure_in_trial_reopens():
+    policy = make_policy(FaultyProvider(TransientLLMError("ainda fora")))
+    await open_breaker(policy)
+    with pytest.raises(TransientLLMError):
+        await policy._call(PROMPT)
+    policy.breaker.reset_timeout = 60
+    with pytest.raises(LLMUnavailable):
+        await policy._call(PROMPT)
+
+async def test_non_transient_error_in_trial_releases_it():
+    policy = make_policy(FaultyProvider(ValueError("resposta inesperada")))
+    await open_breaker(policy)
+    with pytest.raises(ValueError):
+        await policy._call(PROMPT)
+    # O circuito segue aberto, mas a próxima chamada pode ser o novo teste
+    assert policy.breaker.is_open
+    assert await policy._call(PROMPT) == "ok"
+    assert not policy.breaker.is_open
+
+async def test_cancelled_trial_releases_it():
+    policy = make_policy(FaultyProvider("hang"))
+    await open_breaker(policy)
+    task = asyncio.create_task(policy._call(PROMPT))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert await policy._call(PROMPT) == "ok"
+
+async def test_abandoned_stream_trial_releases_it():
+    policy = make_policy(FaultyProvider())
+    await open_breaker(policy)
+    chunks = policy.stream(PROMPT)
+    assert await chunks.__anext__() == "ok"
+    # O cliente desiste antes do fim do stream
+    await chunks.aclose()
+    assert policy.breaker.is_open
+    assert [chunk async for chunk in policy.stream(PROMPT)] == ["ok", " fim"]
+    assert not policy.breaker.is_open
+
+async def test_open_breaker_fails_fast():
+    policy = make_policy(FaultyProvider())
+    await open_breaker(policy)
+    policy.breaker.reset_timeout = 60
+    calls = policy.provider.calls
+    with pytest.raises(LLMUnavailable) as error:
+        await policy._call(PROMPT)
+    assert error.value.retry_after >= 1
+    assert policy.provider.calls == calls
+
+async def test_invalid_json_gets_one_repair_call():
+    valid = json.dumps({"next_response": "Há quanto tempo?"})
+    provider = FaultyProvider('{"next_response": "Há', valid)
+    text = await make_policy(provider).generate(PROMPT, valid_model_output, build_repair_prompt)
+    assert text == valid
+    assert provider.calls == 2
+
+async def test_failed_repair_returns_the_original_text():
+    provider = FaultyProvider("não é JSON", "também não")
+    text = await make_policy(provider).generate(PROMPT, valid_model_output, build_repair_prompt)
+    assert text == "não é JSON"
+    assert provider.calls == 2
@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+
+import main
+import retention
+from database.configurations import get_checkpointer
+
+pytestmark = pytest.mark.anyio
+
+async def send(client, chat_id, text="Oi"):
+    response = await client.post(f"/send/{chat_id}", json={"text": text, "sender": "user"})
+    assert response.status_code == 200, response.text
+
+async def new_chat(client):
+    response = await client.post("/criar-chat", json={"title": "Teste"})
+    return response.json()["_id"]
+
+async def finished(client, response):
+    """Espera o job disparado pela resposta 202 e devolve o seu estado final."""
+    assert response.status_code == 202, response.text
+    job_id = response.json()["job_id"]
+    assert response.headers["location"] == f"/retention/jobs/{job_id}"
+    await main.retention.wait(job_id)
+    return (await client.get(f"/retention/jobs/{job_id}")).json()
+
+async def thread_exists(chat_id: str) -> bool:
+    return chat_id in await get_checkpointer().athread_ids(None, 10_000)
+
+async def test_purge_by_status(client, repo):
+    completed, incomplete = await new_chat(client), await new_chat(client)
+    await send(client, completed)
+    await send(client, incomplete)
+    repo.chats[ObjectId(completed)]["status"] = "TRIAGE_COMPLETED"
+
+    job = await finished(client, await client.post("/retention/jobs", json={"kind": "purge", "statuses": ["TRIAGE_COMPLETED"]}))
+    assert job["state"] == "done"
+    assert (job["total"], job["deleted_chats"]) == (1, 1)
+
+    assert await repo.get_chat(ObjectId(completed)) is None
+    assert await repo.get_messages(ObjectId(completed)) is None
+    assert not await thread_exists(completed)
+    assert await repo.get_chat(ObjectId(incomplete)) is not None
+    assert await thread_exists(incomplete)
+
+async def test_purge_needs_statuses(client):
+    response = await client.post("/retention/jobs", json={"kind": "purge"})
+    assert response.status_code == 422
+
+async def test_orphans(client, repo):
+    chat_id = await new_chat(client)
+    await send(client, chat_id)
+    # Como o índice TTL: só o documento do chat some
+    del repo.chats[ObjectId(chat_id)]
+    assert await thread_exists(chat_id)
+
+    job = await finished(client, await client.post("/retention/jobs", json={"kind": "orphans"}))
+    assert job["state"] == "done"
+    assert job["deleted_orphans"] >= 2
+    assert not any(key[0] == ObjectId(chat_id) for key in repo.buckets)
+    assert not await thread_exists(chat_id)
+
+async def test_cancel(client, repo, monkeypatch):
+    monkeypatch.setattr(retention, "RETENTION_BATCH_SIZE", 1)
+    monkeypatch.setattr(retention, "RETENTION_MAX_CHATS_PER_S", 20)
+    for _ in range(5):
+        await new_chat(client)
+
+    response = await client.post("/retention/jobs", json={"kind": "purge", "statuses": ["INCOMPLETE"]})
+    job_id = response.json()["job_id"]
+    await asyncio.sleep(0.01)
+    assert (await client.delete(f"/retention/jobs/{job_id}")).json()["cancel_requested"]
+
+    job = await finished(client, response)
+    assert job["state"] == "cancelled"
+    assert 1 <= job["deleted_chats"] < 5
+    assert len(repo.chats) == 5 - job["deleted_chats"]
+
+async def test_one_job_at_a_time(client, repo):
+    # Com latência, as duas chamadas se intercalam no banco
+    repo.latency = 0.01
+    first, second = await asyncio.gather(
+        client.post("/retention/jobs", json={"kind": "orphans"}),
+        client.post("/retention/jobs", json={"kind": "orphans"}),
+    )
+    assert sorted([first.status_code, second.status_code]) == [202, 409]
+    started = first if first.status_code == 202 else second
+    assert (await finished(client, started))["state"] == "done"
+
+    # Terminado o job, outro pode começar
+    assert (await finished(client, await client.post("/retention/jobs", json={"kind": "orphans"})))["state"] == "done"
+
+async def test_stale_job_is_taken_over(client, repo):
+    stale = datetime.now(timezone.utc) - timedelta(seconds=retention.RETENTION_JOB_STALE_S + 1)
+    repo.retention_jobs["antigo"] = {"_id": "antigo", "kind": "orphans", "state": "running", "heartbeat_at": stale}
+
+    job = await finished(client, await client.post("/retention/jobs", json={"kind": "orphans"}))
+    assert job["state"] == "done"
+    assert repo.retention_jobs["antigo"]["state"] == "failed"
+
+async def test_apagar_tudo(client, repo):
+    chat_id = await new_chat(client)
+    await send(client, chat_id)
+
+    response = await client.delete("/apagar-tudo")
+    assert response.json()["status"] == "agendado"
+    job = await finished(client, response)
+    assert job["kind"] == "reset" and job["state"] == "done"
+    assert repo.chats == {} and repo.buckets == {}
+    assert not await thread_exists(chat_id)
+    # Os jobs sobrevivem ao reset
+    assert job["job_id"] in repo.retention_jobs
+
+async def test_ttl_is_opt_in(repo, monkeypatch):
+    engine = retention.RetentionEngine(main.ensure_indexes)
+    repo.abandoned_ttl = 30 * 86400
+    await engine.ensure_ttl(repo)
+    assert repo.abandoned_ttl is None
+
+    monkeypatch.setattr(retention, "ABANDONED_CHAT_TTL_DAYS", 7)
+    await engine.ensure_ttl(repo)
+    assert repo.abandoned_ttl == 7 * 86400
+
+async def test_running_job_blocks_reset(client, repo):
+    now = datetime.now(timezone.utc)
+    repo.retention_jobs["atual"] = {"_id": "atual", "kind": "orphans", "state": "running", "heartbeat_at": now}
+
+    with pytest.raises(retention.RetentionJobRunning) as error:
+        await main.retention.start(repo, "orphans", source="schedule")
+    assert error.value.job_id == "atual"
+
+    response = await client.delete("/apagar-tudo")
+    assert response.status_code == 409
+    assert "atual" in response.json()["detail"]
@@ -0,0 +1,81 @@
+import pytest
+from bson import ObjectId
+
+from agent.default_agent import CONFIRMATION_MESSAGE, get_llm_policy
+
+pytestmark = pytest.mark.anyio
+
+ANSWERS = ["Oi", "Dor de cabeça", "Latejante, do lado direito", "Há três dias", "7", "Enxaqueca", "Dipirona"]
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    """Conta as chamadas ao provedor (StubProvider)."""
+    provider = get_llm_policy().provider
+    calls = []
+    generate = provider.generate
+
+    async def counting(prompt):
+        calls.append(prompt)
+        return await generate(prompt)
+
+    monkeypatch.setattr(provider, "generate", counting)
+    return calls
+
+async def send(client, chat_id, text, **headers):
+    response = await client.post(f"/send/{chat_id}", json={"text": text, "sender": "user"}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+async def test_full_triage(client, repo, chat_id, llm_calls):
+    for text in ANSWERS:
+        reply = await send(client, chat_id, text)
+        assert not reply["is_completed"]
+    assert "podemos encerrar a triagem" in reply["agent_message"]["text"]
+
+    # A confirmação tem resposta fixa: não chama o LLM
+    calls = len(llm_calls)
+    reply = await send(client, chat_id, "Sim, pode salvar")
+    assert reply["is_completed"]
+    assert reply["agent_message"]["text"] == CONFIRMATION_MESSAGE
+    assert len(llm_calls) == calls
+
+    chat = await repo.get_chat(ObjectId(chat_id))
+    assert chat["status"] == "TRIAGE_COMPLETED"
+    assert chat["triagem"]["medidas_tomadas"] == "Dipirona"
+    assert chat["completed_at"] is not None
+
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    assert [msg["id"] for msg in messages] == list(range(1, 2 * len(ANSWERS) + 3))
+    assert [msg["sender"] for msg in messages[:2]] == ["user", "model"]
+
+async def test_emergency_keyword_skips_llm(client, repo, chat_id, llm_calls):
+    await send(client, chat_id, "Oi")
+    calls = len(llm_calls)
+
+    reply = await send(client, chat_id, "Estou com DOR NO PEITO e falta de ar")
+    assert reply["is_completed"]
+    assert "ALERTA DE EMERGÊNCIA" in reply["agent_message"]["text"]
+    assert len(llm_calls) == calls
+
+    chat = await repo.get_chat(ObjectId(chat_id))
+    assert chat["status"] == "EMERGENCY_ALERT"
+    assert chat["emergency_category"] == "cardiovascular"
+
+async def test_incremental_fetch_and_etag(client, chat_id):
+    first = await send(client, chat_id, "Oi")
+    response = await client.get(f"/chat-messages/{chat_id}")
+    etag = response.headers["etag"]
+    assert len(response.json()) == 2
+
+    response = await client.get(f"/chat-messages/{chat_id}", params={"since": 2}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    await send(client, chat_id, "Dor de cabeça")
+    response = await client.get(f"/chat-messages/{chat_id}", params={"since": first["agent_message"]["id"]}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [msg["id"] for msg in response.json()] == [3, 4]
+
+async def test_unknown_chat(client):
+    response = await client.post(f"/send/{ObjectId()}", json={"text": "Oi", "sender": "user"})
+    assert response.status_code == 404
+    assert (await client.get("/chat/nao-e-um-id")).status_code == 400
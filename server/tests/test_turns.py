@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from agent.concurrency import LLMQueueFull
+from agent.default_agent import get_llm_policy
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def gate(monkeypatch):
+    """Segura a chamada ao LLM até `release` ser sinalizado; `entered` avisa que ela começou."""
+    provider = get_llm_policy().provider
+    generate = provider.generate
+    entered, release = asyncio.Event(), asyncio.Event()
+    calls = []
+
+    async def held(prompt):
+        calls.append(prompt)
+        entered.set()
+        await release.wait()
+        return await generate(prompt)
+
+    monkeypatch.setattr(provider, "generate", held)
+    return entered, release, calls
+
+def post_send(client, chat_id, text, key=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    return client.post(f"/send/{chat_id}", json={"text": text, "sender": "user"}, headers=headers)
+
+async def test_concurrent_sends_one_turn(client, chat_id, gate):
+    entered, release, calls = gate
+    first = asyncio.create_task(post_send(client, chat_id, "Oi"))
+    await entered.wait()
+
+    second = await post_send(client, chat_id, "Oi de novo")
+    assert second.status_code == 409
+    assert second.headers["retry-after"] == "1"
+
+    release.set()
+    assert (await first).status_code == 200
+    assert len(calls) == 1
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    assert [msg["sender"] for msg in messages] == ["user", "model"]
+    assert messages[0]["text"] == "Oi"
+
+async def test_send_user_waits_for_the_turn(client, chat_id, gate):
+    entered, release, _ = gate
+    turn = asyncio.create_task(post_send(client, chat_id, "Oi"))
+    await entered.wait()
+
+    response = await client.post(f"/send-user/{chat_id}", json={"text": "no meio", "sender": "user"})
+    assert response.status_code == 409
+
+    release.set()
+    assert (await turn).status_code == 200
+    response = await client.post(f"/send-user/{chat_id}", json={"text": "depois", "sender": "user"})
+    assert response.status_code == 200
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    assert [msg["text"] for msg in messages][-1] == "depois"
+    assert "no meio" not in [msg["text"] for msg in messages]
+
+async def test_send_user_unknown_chat(client):
+    response = await client.post(f"/send-user/{ObjectId()}", json={"text": "Oi", "sender": "user"})
+    assert response.status_code == 404
+
+async def test_retry_with_same_key_replays_response(client, repo, chat_id, gate):
+    _, release, calls = gate
+    release.set()
+    first = await post_send(client, chat_id, "Oi", key="msg-1")
+    assert first.status_code == 200
+
+    retry = await post_send(client, chat_id, "Oi", key="msg-1")
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert len(calls) == 1
+    assert len((await repo.get_messages(ObjectId(chat_id)))["messages"]) == 2
+
+    # A mesma chave com outro corpo é outro pedido
+    response = await post_send(client, chat_id, "Outra coisa", key="msg-1")
+    assert response.status_code == 422
+
+async def test_retry_during_the_turn_gets_409(client, chat_id, gate):
+    entered, release, calls = gate
+    first = asyncio.create_task(post_send(client, chat_id, "Oi", key="msg-1"))
+    await entered.wait()
+
+    assert (await post_send(client, chat_id, "Oi", key="msg-1")).status_code == 409
+
+    release.set()
+    response = await first
+    retry = await post_send(client, chat_id, "Oi", key="msg-1")
+    assert retry.json() == response.json()
+    assert len(calls) == 1
+
+async def test_failed_turn_releases_key_and_lease(client, repo, chat_id, monkeypatch):
+    save_turn = repo.save_turn
+
+    async def failing(*args):
+        raise RuntimeError("MongoDB fora do ar")
+
+    monkeypatch.setattr(repo, "save_turn", failing)
+    with pytest.raises(RuntimeError):
+        await post_send(client, chat_id, "Oi", key="msg-1")
+
+    # A repetição reaproveita a mensagem já gravada e entrega a resposta do turno que não foi salvo
+    monkeypatch.setattr(repo, "save_turn", save_turn)
+    retry = await post_send(client, chat_id, "Oi", key="msg-1")
+    assert retry.status_code == 200
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    assert [(msg["id"], msg["sender"]) for msg in messages] == [(1, "user"), (2, "model")]
+    assert messages[0]["text"] == "Oi"
+    assert retry.json()["user_message"] == messages[0]
+    assert retry.json()["agent_message"] == messages[1]
+
+async def test_retry_after_failed_llm_call_reuses_the_message(client, repo, chat_id, monkeypatch):
+    provider = get_llm_policy().provider
+    generate = provider.generate
+
+    async def overloaded(prompt):
+        raise LLMQueueFull("Fila de chamadas ao modelo cheia")
+
+    monkeypatch.setattr(provider, "generate", overloaded)
+    assert (await post_send(client, chat_id, "Oi", key="msg-1")).status_code == 429
+
+    monkeypatch.setattr(provider, "generate", generate)
+    assert (await post_send(client, chat_id, "Oi", key="msg-1")).status_code == 200
+    messages = (await client.get(f"/chat-messages/{chat_id}")).json()
+    assert [(msg["id"], msg["sender"]) for msg in messages] == [(1, "user"), (2, "model")]
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from errors import RetryableHTTPError
+
+# Validade do lease de um turno: acima do pior caso de um turno (fila do LLM +
+# tentativas com timeout), para não vencer com o turno ainda rodando. Só importa
+# quando o worker cai no meio do turno e o lease não é liberado.
+TURN_LEASE_TTL_S = float(os.getenv("TURN_LEASE_TTL_S", "120"))
+# Por quanto tempo a resposta de uma Idempotency-Key é devolvida às repetições
+IDEMPOTENCY_TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", "86400"))
+
+class TurnInProgress(RetryableHTTPError):
+    """Já há um turno rodando neste chat (ou com esta Idempotency-Key): o cliente tenta de novo."""
+    status_code = 409
+    retry_after = 1
+
+class TurnLease:
+    """
+    Um turno por chat: reserva o chat no MongoDB (lease com prazo, ver
+    ChatRepository.acquire_turn_lease) antes de ler o chat e rodar o grafo, e
+    libera ao final. Um segundo envio no mesmo chat recebe 409 em vez de rodar o
+    grafo de novo e intercalar as escritas do turno.
+    """
+
+    def __init__(self, repo, chat_id: ObjectId):
+        self.repo = repo
+        self.chat_id = chat_id
+        self.owner = uuid.uuid4().hex
+        self.held = False
+
+    async def acquire(self) -> Dict[str, Any]:
+        """Reserva o chat e devolve o documento lido depois da reserva."""
+        chat = await self.repo.acquire_turn_lease(self.chat_id, self.owner, TURN_LEASE_TTL_S)
+        if chat is None:
+            if await self.repo.get_chat(self.chat_id) is None:
+                raise HTTPException(status_code=404, detail="Chat não encontrado")
+            raise TurnInProgress("Já há um turno em andamento neste chat; tente novamente")
+        self.held = True
+        return chat
+
+    async def release(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        # shield: a liberação termina mesmo se o turno foi cancelado (cliente desconectou)
+        await asyncio.shield(self.repo.release_turn_lease(self.chat_id, self.owner))
+
+    async def __aenter__(self) -> Dict[str, Any]:
+        return await self.acquire()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.release()
+
+class IdempotentRequest:
+    """
+    Repetições de um envio com a mesma Idempotency-Key (duplo toque, retry do app
+    após timeout) recebem a resposta guardada em vez de uma nova geração. A chave
+    vale por chat; reutilizá-la com outra rota ou outro corpo é 422. Sem chave,
+    nada é registrado.
+
+    Se a tentativa anterior falhou depois de gravar a mensagem do usuário
+    (record_message), a repetição encontra essa mensagem em `message` e a
+    reaproveita em vez de gravá-la de novo.
+    """
+
+    def __init__(self, repo, chat_id: ObjectId, key: Optional[str], *request_parts: str):
+        self.repo = repo
+        self.chat_id = chat_id
+        self.key = key
+        self.fingerprint = hashlib.sha256("\x1f".join(request_parts).encode()).hexdigest()
+        self.reserved = False
+        self.message: Optional[Dict[str, Any]] = None
+
+    async def begin(self) -> Optional[Dict[str, Any]]:
+        """Reserva a chave; devolve a resposta guardada se a requisição já foi atendida."""
+        if self.key is None:
+            return None
+        # Reserva com o prazo do lease: se o worker cair, a chave volta a ficar livre junto com o chat
+        reserved, existing = await self.repo.reserve_idempotency_key(
+            self.chat_id, self.key, self.fingerprint, TURN_LEASE_TTL_S, IDEMPOTENCY_TTL_S
+        )
+        if reserved:
+            self.reserved = True
+            self.message = existing.get("message")
+            return None
+        if existing["fingerprint"] != self.fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key já usada com outra requisição")
+        if existing["response"] is None:
+            raise TurnInProgress("Requisição com esta Idempotency-Key ainda em andamento; tente novamente")
+        return existing["response"]
+
+    async def record_message(self, message: Dict[str, Any]) -> None:
+        """Registra na chave a mensagem do usuário que esta chamada gravou."""
+        if self.reserved:
+            self.message = message
+            await self.repo.record_idempotent_message(self.chat_id, self.key, message)
+
+    async def complete(self, response: Dict[str, Any]) -> None:
+        if self.reserved:
+            self.reserved = False
+            await self.repo.complete_idempotency_key(self.chat_id, self.key, response, IDEMPOTENCY_TTL_S)
+
+    async def abandon(self) -> None:
+        """Libera a chave de uma requisição que falhou, para a repetição processar o turno (a mensagem registrada fica)."""
+        if self.reserved:
+            self.reserved = False
+            await asyncio.shield(self.repo.release_idempotency_key(self.chat_id, self.key))
+
+    async def __aenter__(self) -> Optional[Dict[str, Any]]:
+        return await self.begin()
+
+    async def __aexit__(self, exc_type, *exc) -> None:
+        # Sem complete() (erro ou saída antecipada), a chave é liberada
+        await self.abandon()
@@ -6,6 +6,39 @@ import Constants from "expo-constants";
 
 const apiUrl = Constants.expoConfig?.extra?.API_URL;
 
+// Tentativas do envio de uma mensagem (rede caiu, 409 de turno em andamento, 503)
+const SEND_ATTEMPTS = 3;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Chave única por mensagem: as repetições do mesmo envio recebem a resposta já gerada
+const newIdempotencyKey = () =>
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+
+// POST com a mesma Idempotency-Key em todas as tentativas
+async function postWithRetry(url: string, body: object, idempotencyKey: string): Promise<Response> {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      const response = await fetch(url, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "Idempotency-Key": idempotencyKey },
+        body: JSON.stringify(body),
+      });
+      const retryable = response.status === 409 || response.status === 503;
+      if (!retryable || attempt >= SEND_ATTEMPTS) {
+        return response;
+      }
+      await sleep(Number(response.headers.get("Retry-After") ?? "1") * 1000);
+    } catch (error) {
+      // Falha de rede: o servidor pode ter recebido o envio, a chave evita a resposta em dobro
+      if (attempt >= SEND_ATTEMPTS) {
+        throw error;
+      }
+      await sleep(1000 * attempt);
+    }
+  }
+}
+
 interface Message {
   id: string; 
   text: string;
@@ -21,20 +54,38 @@ export default function ChatScreenPage() {
 
   const flatListRef = useRef<FlatList<Message>>(null);
 
-  // Função para buscar mensagens da API
+  // Versão (ETag) e último id já carregados, para buscar só o que for novo
+  const etagRef = useRef<string | null>(null);
+  const lastIdRef = useRef(0);
+
+  // Função para buscar mensagens da API (incremental: só mensagens com id > último carregado)
   const fetchMessages = async () => {
     try {
-      const response = await fetch(`${apiUrl}/chat-messages/${chatId}`);
+      const headers: Record<string, string> = {};
+      if (etagRef.current) {
+        headers["If-None-Match"] = etagRef.current;
+      }
+      const response = await fetch(
+        `${apiUrl}/chat-messages/${chatId}?since=${lastIdRef.current}`,
+        { headers }
+      );
+      if (response.status === 304) {
+        return; // nada mudou desde a última busca
+      }
       if (!response.ok) {
         throw new Error("Erro ao carregar mensagens.");
       }
+      etagRef.current = response.headers.get("ETag");
       const data: Message[] = await response.json();
       const formatted = data.map((msg) => ({
         id: msg.id,
         text: msg.text,
         sender: msg.sender,
       }));
-      setMessages(formatted);
+      if (formatted.length > 0) {
+        lastIdRef.current = Number(formatted[formatted.length - 1].id);
+      }
+      setMessages((prev) => [...prev, ...formatted]);
     } catch (error) {
       console.error("Erro ao buscar mensagens:", error);
     } finally {
@@ -53,34 +104,28 @@ export default function ChatScreenPage() {
       text: inputText,
       sender: "user",
     };
+    const idempotencyKey = newIdempotencyKey();
     setMessages((prev) => [...prev, newUserMessage]);
     setInputText("");
 
     try {
-      // Envia a mensagem do usuário
-      const sendUserResponse = await fetch(`${apiUrl}/send-user/${chatId}`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          text: newUserMessage.text,
-          sender: newUserMessage.sender,
-        }),
-      });
-      if (!sendUserResponse.ok) {
-        throw new Error("Erro ao enviar mensagem do usuário.");
-      }
-
-      // Chama a API para o modelo responder
-      const sendModelResponse = await fetch(`${apiUrl}/send-model/${chatId}`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-      });
-      if (!sendModelResponse.ok) {
-        throw new Error("Erro ao obter resposta do modelo.");
+      // Envia a mensagem do usuário e recebe a resposta do modelo na mesma chamada
+      const response = await postWithRetry(
+        `${apiUrl}/send/${chatId}`,
+        { text: newUserMessage.text, sender: newUserMessage.sender },
+        idempotencyKey
+      );
+      if (!response.ok) {
+        throw new Error("Erro ao enviar mensagem.");
       }
+      const data: { user_message: Message; agent_message: Message } = await response.json();
 
-      // Recarrega mensagens para obter a resposta completa da IA
-      await fetchMessages();
+      // Troca a mensagem temporária pela versão salva e adiciona a resposta da IA
+      lastIdRef.current = Number(data.agent_message.id);
+      setMessages((prev) => [
+        ...prev.map((msg) => (msg.id === userMessageId ? data.user_message : msg)),
+        data.agent_message,
+      ]);
     } catch (error) {
       console.error("Erro no fluxo de envio:", error);
       // Opcional: Reverter o estado em caso de erro
@@ -92,6 +137,9 @@ export default function ChatScreenPage() {
 
   // Efeitos para carregar mensagens na montagem e rolar a lista
   useEffect(() => {
+    etagRef.current = null;
+    lastIdRef.current = 0;
+    setMessages([]);
     fetchMessages();
   }, [chatId]);
 
@@ -11,10 +11,13 @@ export default function ChatListScreen() {
   const [chats, setChats] = useState<Chat[]>([]);
   const [loading, setLoading] = useState(true);
 
-  // Busca todos os chats
-  async function fetchChats() {
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+
+  // Busca uma página de chats (a primeira, ou a seguinte a partir do cursor)
+  async function fetchChats(cursor?: string) {
     try {
-      const response = await fetch(`${apiUrl}/chats`, {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+      const response = await fetch(`${apiUrl}/chats${query}`, {
         headers: {
           "Content-Type": "application/json",
           "ngrok-skip-browser-warning": "true",
@@ -27,7 +30,8 @@ export default function ChatListScreen() {
         title: chat.title,
         lastMessage: chat.lastMessage || "",
       }));
-      setChats(formatted);
+      setChats((prev) => (cursor ? [...prev, ...formatted] : formatted));
+      setNextCursor(response.headers.get("X-Next-Cursor"));
     } catch (error) {
       console.error("Erro ao buscar chats:", error);
     } finally {
@@ -35,6 +39,14 @@ export default function ChatListScreen() {
     }
   }
 
+  // Carrega a próxima página ao chegar no fim da lista
+  function handleEndReached() {
+    if (nextCursor) {
+      setNextCursor(null); // evita buscar a mesma página duas vezes
+      fetchChats(nextCursor);
+    }
+  }
+
   useEffect(() => {
     fetchChats();
   }, []);
@@ -74,6 +86,7 @@ export default function ChatListScreen() {
       chats={chats}
       onSelectChat={handleSelectChat}
       onNewChat={handleNewChat}
+      onEndReached={handleEndReached}
     />
   );
 }
\ No newline at end of file
@@ -11,9 +11,10 @@ export interface ChatListProps {
     chats: Chat[];
     onSelectChat: (chatId: string) => void;
     onNewChat: () => void;
+    onEndReached?: () => void;
 }
 
-export function ChatList({ chats, onSelectChat, onNewChat }: ChatListProps) {
+export function ChatList({ chats, onSelectChat, onNewChat, onEndReached }: ChatListProps) {
   return (
     <View style={styles.container}>
     <TouchableOpacity style={styles.newChatButton} onPress={onNewChat}>
@@ -22,6 +23,8 @@ export function ChatList({ chats, onSelectChat, onNewChat }: ChatListProps) {
       <FlatList
         data={chats}
         keyExtractor={(item) => item.id}
+        onEndReached={onEndReached}
+        onEndReachedThreshold={0.5}
         renderItem={({ item }) => (
           <TouchableOpacity
             style={styles.chatItem}